@@ -0,0 +1,611 @@
+"""
+Adds up long captures offline, without the UI, for reviewing a channel:
+
+    python analyze.py ~/.netterm/capture.bin
+    python analyze.py --format json --out review captures/*.kiss
+    python analyze.py --tnc2 traffic.txt ~/.netterm/capture.bin
+
+It reads NetTerm captures (see capture.py) and raw KISS streams, like a log
+of everything that went to and from a TNC. Each file is split into chunks
+that a pool of processes read as a stream, and what the chunks add up to is
+merged back in order, so a TEST answered or an RMODE taken up in the next
+chunk still counts. The tables are:
+
+summary   frames, bytes, the time covered, airtime and duty cycle
+stations  frames and bytes each station sent and was sent
+pairs     frames and bytes from each station to each other station
+modes     frames, bytes, airtime and duty cycle in each mode, the SETHWs
+          that switched to it and the RMODEs that asked for it
+rmode     RMODEs for each mode, and how many were followed by the station
+          being heard in that mode within MODE_TIMEOUT
+test      TEST commands from each station to each other station, how many
+          were answered within TEST_TIMEOUT and the average round trip
+types     frames of each type
+
+Raw KISS has no timestamps, so nothing in it times out and there's no duty
+cycle, and the mode is only known from the SETHWs in it.
+"""
+
+import argparse
+import csv
+import json
+import os
+import re
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import ax25
+
+import capture
+import transport
+from modes import BITRATES, MODES, MODE_IDS, MODE_TIMEOUT, airtime
+from packet import FRAME_TYPE_NAMES, Packet
+
+CHUNK_SIZE = 32 * 1024 * 1024  # bytes of capture each process reads at once
+READ_SIZE = 1024 * 1024
+TEST_TIMEOUT = 30  # seconds a TEST reply can take to count as an answer
+
+NETTERM = 'netterm'
+KISS = 'kiss'
+
+UNKNOWN = 'unknown'  # the mode of frames from before we knew it
+
+# a SETHW in raw KISS: a FEND (which never appears escaped, so always starts
+# or ends a frame), the SETHW command for any KISS port and its value
+SETHW_COMMANDS = bytes(port << 4 | transport.SET_HARDWARE for port in range(16))
+SETHW = re.compile(b"\\xc0[" + re.escape(SETHW_COMMANDS) + b"]([^\\xc0])",
+                   re.DOTALL)
+
+
+def within(start: float | None, end: float | None, seconds: float) -> bool:
+    # without timestamps nothing times out
+    return start is None or end is None or end - start <= seconds
+
+
+class Tally():
+    """
+    What a stretch of traffic adds up to. The tally of one chunk of a file
+    is merged with the tally of the next, which settles the TESTs and RMODEs
+    still open at the end of the first with what the second heard first.
+    """
+
+    def __init__(self):
+        self.frames = 0
+        self.undecodable = 0
+        self.bytes = 0
+        self.first_time = None
+        self.last_time = None
+        # seconds covered by the files finished so far, and mode_id ->
+        # [frames, bytes] in the ones with timestamps, for the duty cycle
+        self.seconds = 0.0
+        self.timed = {}
+        # (src, dst) -> [frames, bytes]
+        self.pairs = {}
+        # frame type name -> frames
+        self.types = {}
+        # mode_id -> [frames, bytes], None for frames from before the first
+        # SETHW in raw KISS
+        self.modes = {}
+        # the mode the TNC is in, as far as we know
+        self.mode = None
+        # mode_id -> SETHWs to it
+        self.switches = {}
+        # mode_id -> [RMODEs, taken up]
+        self.rmodes = {}
+        # (src, dst) -> [TESTs, answered, total round trip, timed]
+        self.tests = {}
+
+        # station -> (mode_id, time) of the last RMODE to it not yet settled
+        self.open_rmodes = {}
+        # (src, dst, data) -> time of TESTs not yet answered
+        self.open_tests = {}
+        # station -> time of the first RMODE to it, after which anything
+        # still open from an earlier chunk is superseded
+        self.first_rmode = {}
+        # (station, mode_id) -> time it was first heard in mode_id, before
+        # any RMODE to it
+        self.first_heard = {}
+        # (src, dst, data) -> time of the first TEST reply nothing here asked
+        # for
+        self.first_reply = {}
+
+    def frame(self, packet: Packet, length: int, when: float | None,
+              mode_id: str | None) -> None:
+        """Adds a frame of length bytes heard or sent in mode_id"""
+
+        self.frames += 1
+        self.bytes += length
+        if when is not None:
+            if self.first_time is None:
+                self.first_time = when
+            self.last_time = when
+        src = packet.src
+        dst = packet.dst
+
+        pair = self.pairs.get((src, dst))
+        if pair is None:
+            pair = self.pairs[(src, dst)] = [0, 0]
+        pair[0] += 1
+        pair[1] += length
+        name = FRAME_TYPE_NAMES.get(packet.frame_type, "other")
+        self.types[name] = self.types.get(name, 0) + 1
+        counts = self.modes.get(mode_id)
+        if counts is None:
+            counts = self.modes[mode_id] = [0, 0]
+        counts[0] += 1
+        counts[1] += length
+
+        # did an RMODE to src work?
+        asked = self.open_rmodes.get(src)
+        if asked is not None:
+            if asked[0] == mode_id and within(asked[1], when, MODE_TIMEOUT):
+                self.rmodes[asked[0]][1] += 1
+                del self.open_rmodes[src]
+            elif not within(asked[1], when, MODE_TIMEOUT):
+                del self.open_rmodes[src]
+        elif src not in self.first_rmode and \
+                (src, mode_id) not in self.first_heard:
+            self.first_heard[(src, mode_id)] = when
+
+        frame_type = packet.frame_type
+        if frame_type == ax25.FrameType.TEST:
+            self.test(packet, src, dst, when)
+        elif frame_type == ax25.FrameType.UI and packet.poll_final and \
+                packet.data[:6] == b"RMODE ":
+            self.rmode(packet.text[6:].strip(), dst, when)
+
+    def test(self, packet: Packet, src: str, dst: str,
+             when: float | None) -> None:
+        data = packet.data
+        key = (dst, src, data)
+        sent = self.open_tests.pop(key, False)
+        if sent is not False:
+            if within(sent, when, TEST_TIMEOUT):
+                self.answered(dst, src, sent, when)
+        elif packet.poll_final:
+            self.open_tests[(src, dst, data)] = when
+            self.test_counts(src, dst)[0] += 1
+        elif key not in self.first_reply:
+            self.first_reply[key] = when
+
+    def test_counts(self, src: str, dst: str) -> list:
+        counts = self.tests.get((src, dst))
+        if counts is None:
+            counts = self.tests[(src, dst)] = [0, 0, 0.0, 0]
+        return counts
+
+    def answered(self, src: str, dst: str, sent: float | None,
+                 when: float | None) -> None:
+        counts = self.test_counts(src, dst)
+        counts[1] += 1
+        if sent is not None and when is not None:
+            counts[2] += when - sent
+            counts[3] += 1
+
+    def rmode(self, mode_id: str, dst: str, when: float | None) -> None:
+        if mode_id not in MODES:
+            return
+        self.rmodes.setdefault(mode_id, [0, 0])[0] += 1
+        # anything still open for dst is superseded
+        self.open_rmodes[dst] = (mode_id, when)
+        self.first_rmode.setdefault(dst, when)
+
+    def sethw(self, mode_id: str) -> None:
+        self.mode = mode_id
+        self.switches[mode_id] = self.switches.get(mode_id, 0) + 1
+
+    def merge(self, later: 'Tally') -> 'Tally':
+        """Adds the tally of the traffic that came straight after this"""
+
+        # settle what was still open here with what the later chunk heard,
+        # which is only kept from before any RMODE of its own
+        for station, (mode_id, asked) in self.open_rmodes.items():
+            heard = later.first_heard.get((station, mode_id), False)
+            if heard is not False and within(asked, heard, MODE_TIMEOUT):
+                self.rmodes[mode_id][1] += 1
+            elif station not in later.first_rmode and \
+                    within(asked, later.last_time, MODE_TIMEOUT):
+                later.open_rmodes[station] = (mode_id, asked)
+        for key, sent in self.open_tests.items():
+            replied = later.first_reply.get(key, False)
+            if replied is not False and within(sent, replied, TEST_TIMEOUT):
+                self.answered(key[0], key[1], sent, replied)
+            elif within(sent, later.last_time, TEST_TIMEOUT):
+                later.open_tests.setdefault(key, sent)
+
+        self.frames += later.frames
+        self.undecodable += later.undecodable
+        self.bytes += later.bytes
+        self.seconds += later.seconds
+        if later.first_time is not None:
+            self.first_time = min(self.first_time or later.first_time,
+                                  later.first_time)
+            self.last_time = max(self.last_time or later.last_time,
+                                 later.last_time)
+        for pair, (frames, length) in later.pairs.items():
+            counts = self.pairs.setdefault(pair, [0, 0])
+            counts[0] += frames
+            counts[1] += length
+        for name, frames in later.types.items():
+            self.types[name] = self.types.get(name, 0) + frames
+        for mine, theirs in ((self.modes, later.modes),
+                             (self.timed, later.timed)):
+            for mode_id, (frames, length) in theirs.items():
+                counts = mine.setdefault(mode_id, [0, 0])
+                counts[0] += frames
+                counts[1] += length
+        for mode_id, switches in later.switches.items():
+            self.switches[mode_id] = self.switches.get(mode_id, 0) + switches
+        for mode_id, (asked, taken) in later.rmodes.items():
+            counts = self.rmodes.setdefault(mode_id, [0, 0])
+            counts[0] += asked
+            counts[1] += taken
+        for pair, later_counts in later.tests.items():
+            counts = self.test_counts(*pair)
+            for i, value in enumerate(later_counts):
+                counts[i] += value
+
+        if later.mode is not None:
+            self.mode = later.mode
+        self.open_rmodes = later.open_rmodes
+        self.open_tests = later.open_tests
+        return self
+
+    def finish(self) -> 'Tally':
+        """
+        Ends a file: whatever is still open failed, and frames from before
+        its first SETHW were in a mode we'll never know
+        """
+
+        opening = self.modes.pop(None, None)
+        if opening:
+            counts = self.modes.setdefault(UNKNOWN, [0, 0])
+            counts[0] += opening[0]
+            counts[1] += opening[1]
+        if self.first_time is not None:
+            self.seconds += self.last_time - self.first_time
+            self.timed = {mode_id: list(counts)
+                          for mode_id, counts in self.modes.items()}
+        self.mode = None
+        self.open_rmodes = {}
+        self.open_tests = {}
+        self.first_rmode = {}
+        self.first_heard = {}
+        self.first_reply = {}
+        return self
+
+    @staticmethod
+    def airtime(modes: dict) -> dict:
+        """mode_id -> seconds on air, for the modes we know"""
+
+        return {mode_id: frames * airtime(mode_id, 0) +
+                         length * 8 / BITRATES[mode_id]
+                for mode_id, (frames, length) in modes.items()
+                if mode_id in BITRATES}
+
+    def tables(self) -> dict:
+        """Table name -> rows, each a dict"""
+
+        airtimes = self.airtime(self.modes)
+        total_airtime = sum(airtimes.values())
+        # only traffic with timestamps counts towards the duty cycle
+        timed = self.airtime(self.timed)
+
+        def duty(mode_id: str | None = None) -> float | None:
+            if not self.seconds or (mode_id and mode_id not in timed):
+                return None
+            seconds = timed[mode_id] if mode_id else sum(timed.values())
+            return round(seconds / self.seconds, 4)
+
+        def stamp(when: float | None) -> str | None:
+            if when is None:
+                return None
+            return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(when))
+
+        summary = [{'frames': self.frames, 'undecodable': self.undecodable,
+                    'bytes': self.bytes, 'first': stamp(self.first_time),
+                    'last': stamp(self.last_time),
+                    'seconds': round(self.seconds, 1),
+                    'airtime_s': round(total_airtime, 1),
+                    'duty_cycle': duty()}]
+
+        stations = {}
+        for (src, dst), (frames, length) in self.pairs.items():
+            sent = stations.setdefault(src, [0, 0, 0, 0])
+            sent[0] += frames
+            sent[1] += length
+            received = stations.setdefault(dst, [0, 0, 0, 0])
+            received[2] += frames
+            received[3] += length
+        station_rows = [{'station': station, 'frames_sent': counts[0],
+                         'bytes_sent': counts[1], 'frames_to': counts[2],
+                         'bytes_to': counts[3]}
+                        for station, counts in sorted(
+                            stations.items(), key=lambda item: -item[1][0])]
+
+        pairs = [{'src': src, 'dst': dst, 'frames': frames, 'bytes': length}
+                 for (src, dst), (frames, length) in sorted(
+                     self.pairs.items(), key=lambda item: -item[1][0])]
+
+        modes = []
+        for mode_id in [*MODES, UNKNOWN]:
+            frames, length = self.modes.get(mode_id, (0, 0))
+            switches = self.switches.get(mode_id, 0)
+            asked = self.rmodes.get(mode_id, (0, 0))[0]
+            if not (frames or switches or asked):
+                continue
+            seconds = airtimes.get(mode_id)
+            modes.append({'mode': mode_id, 'frames': frames, 'bytes': length,
+                          'airtime_s': None if seconds is None
+                          else round(seconds, 1),
+                          'duty_cycle': duty(mode_id),
+                          'sethw': switches, 'rmode': asked})
+
+        rmodes = [{'mode': mode_id, 'sent': asked, 'taken_up': taken,
+                   'rate': round(taken / asked, 3)}
+                  for mode_id in MODES
+                  for asked, taken in [self.rmodes.get(mode_id, (0, 0))]
+                  if asked]
+
+        tests = [{'src': src, 'dst': dst, 'sent': sent, 'answered': answered,
+                  'rate': round(answered / sent, 3) if sent else None,
+                  'avg_rtt_ms': round(total / timed * 1000, 1) if timed
+                  else None}
+                 for (src, dst), (sent, answered, total, timed) in sorted(
+                     self.tests.items(), key=lambda item: -item[1][0])]
+
+        types = [{'type': name, 'frames': frames}
+                 for name, frames in sorted(self.types.items(),
+                                            key=lambda item: -item[1])]
+
+        return {'summary': summary, 'stations': station_rows, 'pairs': pairs,
+                'modes': modes, 'rmode': rmodes, 'test': tests,
+                'types': types}
+
+
+def kind_of(path: str) -> str:
+    with open(path, "rb") as f:
+        return NETTERM if f.read(len(capture.MAGIC)) == capture.MAGIC else KISS
+
+
+def capture_base(path: str) -> str:
+    # Capture wants the path without .bin
+    return path[:-len(".bin")] if path.endswith(".bin") else path
+
+
+def last_sethw(chunk: tuple) -> str | None:
+    """
+    The mode the last SETHW in a chunk of raw KISS switched to, which the
+    chunk after it starts in. Found without decoding the chunk.
+    """
+
+    path, kind, start, end = chunk
+    if kind != KISS:
+        return None
+    with open(path, "rb") as f:
+        f.seek(start)
+        # enough to see a SETHW that opens right at the end
+        data = f.read(end - start + 2)
+    mode_id = None
+    for match in SETHW.finditer(data):
+        if match.start() >= end - start:
+            break
+        mode_id = MODE_IDS.get(match.group(1)[0] & 0x0F, UNKNOWN)
+    return mode_id
+
+
+def plan(path: str, chunk_size: int) -> list:
+    """Splits a file into (path, kind, start, end) chunks"""
+
+    kind = kind_of(path)
+    size = os.path.getsize(path)
+    count = max(1, -(-size // chunk_size))
+    bounds = [size * i // count for i in range(count)] + [size]
+    if kind == NETTERM and count > 1:
+        # chunks start on a record, which only the index knows
+        past = capture.Capture(capture_base(path))
+        try:
+            bounds = [0, *(past.first_at(bound) for bound in bounds[1:-1]),
+                      size]
+        except OSError:
+            bounds = [0, size]
+        finally:
+            past.close()
+    return [(path, kind, start, end)
+            for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def kiss_frames(path: str, start: int, end: int):
+    """
+    (kiss port, command, data) for every KISS frame in a raw stream whose
+    opening FEND is from offset start up to end. A frame belongs to the
+    chunk its opening FEND is in, so splitting a stream anywhere gives
+    every frame to exactly one chunk.
+    """
+
+    fend = transport.FEND[0]
+    with open(path, "rb") as f:
+        f.seek(start)
+        buffer = bytearray()
+        base = start
+        # skip to the first FEND, the end of a frame from the chunk before
+        while True:
+            block = f.read(READ_SIZE)
+            if not block:
+                return
+            i = block.find(transport.FEND)
+            if i >= 0:
+                buffer += block[i:]
+                base += i
+                break
+            base += len(block)
+        while base < end:
+            # buffer starts with the FEND that opens the next frame
+            i = buffer.find(fend, 1)
+            if i < 0:
+                block = f.read(READ_SIZE)
+                if not block:
+                    return
+                buffer += block
+                continue
+            if i > 1:
+                raw = bytes(buffer[1:i])
+                yield raw[0] >> 4, raw[0] & 0x0F, transport.decode(raw[1:])
+            # NOTE: Deleting from the front of a bytearray doesn't copy
+            #       what's left
+            del buffer[:i]
+            base += i
+
+
+def analyze_chunk(task: tuple) -> Tally:
+    """Adds up one chunk, writing its TNC2 lines to a file if asked to"""
+
+    path, kind, start, end, mode_id, tnc2_path = task
+    tally = Tally()
+    tally.mode = mode_id
+    lines = open(tnc2_path, "w") if tnc2_path else None
+    try:
+        if kind == NETTERM:
+            past = capture.Capture(capture_base(path))
+            try:
+                for record in past.records(start):
+                    if record.offset >= end:
+                        break
+                    try:
+                        packet = Packet.unpack(record.data)
+                    except (ValueError, IndexError):
+                        tally.undecodable += 1
+                        continue
+                    tally.frame(packet, len(record.data), record.time,
+                                record.mode_id or UNKNOWN)
+                    if lines:
+                        stamp = time.strftime("%Y-%m-%d %H:%M:%S",
+                                              time.localtime(record.time))
+                        lines.write(f"{stamp} {packet.tnc2}\n")
+            finally:
+                past.close()
+        else:
+            for _, command, data in kiss_frames(path, start, end):
+                if command == transport.SET_HARDWARE:
+                    if data:
+                        tally.sethw(MODE_IDS.get(data[0] & 0x0F, UNKNOWN))
+                    continue
+                if command != transport.DATA_FRAME:
+                    continue
+                try:
+                    packet = Packet.unpack(data)
+                except (ValueError, IndexError):
+                    tally.undecodable += 1
+                    continue
+                tally.frame(packet, len(data), None, tally.mode)
+                if lines:
+                    lines.write(f"{packet.tnc2}\n")
+    finally:
+        if lines:
+            lines.close()
+    return tally
+
+
+def analyze(paths: list, jobs: int, chunk_size: int = CHUNK_SIZE,
+            tnc2_path: str | None = None) -> Tally:
+    """Adds up every file in paths, in jobs processes"""
+
+    chunks = [chunk for path in paths for chunk in plan(path, chunk_size)]
+    pool = None
+    if jobs > 1 and len(chunks) > 1:
+        pool = ProcessPoolExecutor(min(jobs, len(chunks)))
+    run = pool.map if pool else map
+    try:
+        # the mode each chunk of raw KISS starts in, from the SETHWs before it
+        tasks = []
+        mode_id = None
+        for chunk, last in zip(chunks, run(last_sethw, chunks)):
+            if tasks and tasks[-1][0] != chunk[0]:
+                mode_id = None
+            part = f"{tnc2_path}.{len(tasks)}" if tnc2_path else None
+            tasks.append((*chunk, mode_id, part))
+            if last is not None:
+                mode_id = last
+        tallies = list(run(analyze_chunk, tasks))
+    finally:
+        if pool:
+            pool.shutdown()
+
+    total = Tally()
+    current = None
+    for task, tally in zip(tasks, tallies):
+        if current is not None and task[0] == current_path:
+            current.merge(tally)
+            continue
+        if current is not None:
+            total.merge(current.finish())
+        current = tally
+        current_path = task[0]
+    if current is not None:
+        total.merge(current.finish())
+
+    if tnc2_path:
+        with open(tnc2_path, "w") as out:
+            for task in tasks:
+                with open(task[5]) as part:
+                    shutil.copyfileobj(part, out)
+                os.remove(task[5])
+    return total
+
+
+def write_tables(tables: dict, form: str, out: str | None) -> None:
+    if out:
+        os.makedirs(out, exist_ok=True)
+    if form == 'json':
+        if out:
+            with open(os.path.join(out, "analysis.json"), "w") as f:
+                json.dump(tables, f, indent=2)
+        else:
+            json.dump(tables, sys.stdout, indent=2)
+            print()
+        return
+    for name, rows in tables.items():
+        if not rows:
+            continue
+        if out:
+            with open(os.path.join(out, f"{name}.csv"), "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+                writer.writeheader()
+                writer.writerows(rows)
+        else:
+            print(f"# {name}")
+            writer = csv.DictWriter(sys.stdout, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+            print()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Add up NetTerm captures and raw KISS streams")
+    parser.add_argument("captures", nargs="+",
+                        help="NetTerm captures (capture.bin) or raw KISS")
+    parser.add_argument("--format", choices=['csv', 'json'], default='csv')
+    parser.add_argument("--out", help="a directory to write the tables to, "
+                                      "instead of stdout")
+    parser.add_argument("--tnc2", help="also write every frame as a TNC2 "
+                                       "line to this file")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="processes to read chunks in")
+    parser.add_argument("--chunk-mb", type=float,
+                        default=CHUNK_SIZE / 1024 / 1024,
+                        help="megabytes of capture in each chunk")
+    options = parser.parse_args(argv)
+
+    started = time.monotonic()
+    tally = analyze(options.captures, options.jobs,
+                    max(1, int(options.chunk_mb * 1024 * 1024)), options.tnc2)
+    write_tables(tally.tables(), options.format, options.out)
+    print(f"{tally.frames} frames in {time.monotonic() - started:.1f}s",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,499 @@
+"""
+Times NetTerm, run from the repository:
+
+    python bench.py
+    python bench.py receive stack --runs 10
+    python bench.py --save
+
+startup   seconds from starting Python to NetTerm's first paint, and to the
+          gateway's control socket taking clients, with the TNC down
+reconnect seconds from a TNC coming back after a power blip to us being
+          connected to it again
+unpack    ax25.Frame.unpack on made up traffic
+receive   Net.data_received, everything a frame from the TNC goes through
+stack     Net.frame_received with the default stack, and with STACK_SIZES
+          more stack actions pushed on it
+format    building a frame's TNC2 line
+ui        NetTerm.log_packet and View.write across VIEWS views, headless
+
+The frame benchmarks report frames a second, the percentiles of the time
+each frame took and the peak memory allocated while running them (measured
+in a separate pass, as tracemalloc slows everything down).
+
+--save keeps the results in bench.json next to this file (git ignores it,
+the numbers only mean anything on the machine that made them), and later
+runs are compared with it. Anything more than --tolerance worse is marked,
+and the exit status is 1 if there was any.
+
+Everything runs with HOME set to a temporary directory, so nothing here
+touches ~/.netterm.
+"""
+
+import argparse
+import array
+import asyncio
+import gc
+import itertools
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# a port nothing listens on, so the TNC is down
+NO_TNC = "127.0.0.1:1"
+OUTAGE = 2.0  # seconds the TNC is away in the reconnect benchmark
+OUR_CALL = "N0CALL"
+STATIONS = 50               # callsigns in the made up traffic
+STACK_SIZES = (100, 1000)   # extra stack actions in the stack benchmark
+VIEWS = 500                 # views written to in the ui benchmark
+BASELINE = os.path.join(HERE, "bench.json")
+
+# metrics that are compared with the baseline, and whether more is better
+COMPARED = {'fps': True, 'p50_us': False, 'p99_us': False, 'peak_kb': False,
+            'median_ms': False}
+
+
+def summary(name: str, samples: list) -> tuple:
+    samples = sorted(samples)
+    return name, {'median_ms': statistics.median(samples) * 1000,
+                  'min_ms': samples[0] * 1000,
+                  'max_ms': samples[-1] * 1000,
+                  'runs': len(samples)}
+
+
+def describe(name: str, metrics: dict) -> str:
+    if 'fps' in metrics:
+        return (f"{name}: {metrics['fps']:,.0f} frames/s, p50 "
+                f"{metrics['p50_us']:.1f}us, p90 {metrics['p90_us']:.1f}us, "
+                f"p99 {metrics['p99_us']:.1f}us, peak "
+                f"{metrics['peak_kb']:,.0f}KiB")
+    return (f"{name}: median {metrics['median_ms']:.0f}ms, "
+            f"min {metrics['min_ms']:.0f}ms, max {metrics['max_ms']:.0f}ms "
+            f"({metrics['runs']} runs)")
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> tuple:
+    """
+    (lines comparing results with baseline, whether anything was more
+    than tolerance worse)
+    """
+
+    lines = []
+    worse = False
+    for name, metrics in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        changes = []
+        for metric, more_is_better in COMPARED.items():
+            if not before.get(metric) or metric not in metrics:
+                continue
+            change = metrics[metric] / before[metric] - 1
+            bad = -change if more_is_better else change
+            mark = ""
+            if bad > tolerance:
+                mark = " WORSE"
+                worse = True
+            changes.append(f"{metric} {change:+.0%}{mark}")
+        lines.append(f"{name}: {', '.join(changes)}")
+    return lines, worse
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def ui_child(started: float) -> None:
+    """Runs NetTerm headless, reporting when it painted and was ready"""
+
+    from nt import NetTerm
+
+    class Timed(NetTerm):
+        async def on_ready(self) -> None:
+            painted = time.time()
+            await super().on_ready()
+            print(json.dumps({'paint': painted - started,
+                              'ready': time.time() - started}))
+            self.exit()
+
+    Timed().run(headless=True)
+
+
+def ui_startup() -> dict:
+    started = time.time()
+    result = subprocess.run(
+        [sys.executable, __file__, "--ui-child", str(started)],
+        capture_output=True, text=True, cwd=HERE, timeout=60)
+    lines = [line for line in result.stdout.splitlines()
+             if line.startswith('{')]
+    if not lines:
+        raise RuntimeError(f"NetTerm didn't start: {result.stderr[-500:]}")
+    return json.loads(lines[-1])
+
+
+def gateway_startup() -> float:
+    port = free_port()
+    started = time.time()
+    gateway = subprocess.Popen(
+        [sys.executable, "gateway.py", "--call", OUR_CALL, "--tnc", NO_TNC,
+         "--control-port", str(port)],
+        cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.time() - started < 30:
+            try:
+                socket.create_connection(("127.0.0.1", port), 0.1).close()
+                return time.time() - started
+            except OSError:
+                time.sleep(0.005)
+        raise RuntimeError("the gateway's control socket never came up")
+    finally:
+        gateway.terminate()
+        gateway.wait()
+
+
+def startup(runs: int, count: int) -> list:
+    paint, ready, gateway = [], [], []
+    for _ in range(runs):
+        times = ui_startup()
+        paint.append(times['paint'])
+        ready.append(times['ready'])
+        gateway.append(gateway_startup())
+    return [summary("NetTerm first paint", paint),
+            summary("NetTerm ready", ready),
+            summary("gateway control socket", gateway)]
+
+
+class WaitSink():
+    """Sets an asyncio.Event when the TNC is connected"""
+
+    def __init__(self):
+        self.connected = asyncio.Event()
+
+    def debug(self, msg: str) -> None:
+        pass
+
+    def emit(self, event) -> None:
+        from events import TncChanged
+
+        if type(event) == TncChanged:
+            if event.state == "connected":
+                self.connected.set()
+            else:
+                self.connected.clear()
+
+
+async def reconnect_once() -> float:
+    from ports import Ports
+
+    tnc_port = free_port()
+    clients = []
+
+    def client(reader, writer):
+        clients.append(writer)
+
+    server = await asyncio.start_server(client, "127.0.0.1", tnc_port)
+    sink = WaitSink()
+    ports = Ports(sink, OUR_CALL)
+    ports.open([f"127.0.0.1:{tnc_port}"])
+    try:
+        await asyncio.wait_for(sink.connected.wait(), 10)
+        # the power blip
+        server.close()
+        for writer in clients:
+            writer.close()
+        await server.wait_closed()
+        while sink.connected.is_set():
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(OUTAGE)
+        server = await asyncio.start_server(client, "127.0.0.1", tnc_port)
+        back = time.monotonic()
+        await asyncio.wait_for(sink.connected.wait(), 30)
+        return time.monotonic() - back
+    finally:
+        ports.close()
+        server.close()
+
+
+def reconnect(runs: int, count: int) -> list:
+    samples = [asyncio.run(reconnect_once()) for _ in range(runs)]
+    return [summary(f"reconnect after a {OUTAGE:g}s outage", samples)]
+
+
+# numbers every made up frame, so none of them look like a duplicate
+sequence = itertools.count()
+
+
+def frames(count: int) -> list:
+    """
+    Made up traffic, like tncsim.py's: mostly UI frames between STATIONS
+    stations, some of them digipeated, and a TEST to us now and then
+    """
+
+    import ax25
+
+    made = []
+    for seq in itertools.islice(sequence, count):
+        src = f"SIM{seq % STATIONS}"
+        if seq % 20 == 0:
+            control = ax25.Control(ax25.FrameType.TEST, poll_final=True)
+            frame = ax25.Frame(OUR_CALL, src, control=control,
+                               data=f"SIMTEST {src} {seq}".encode())
+        else:
+            dst = f"SIM{seq * 7 % STATIONS}" if seq % 3 else "APRS"
+            control = ax25.Control(ax25.FrameType.UI, poll_final=False)
+            frame = ax25.Frame(dst, src, via=["WIDE1-1"] if seq % 2 else None,
+                               control=control, pid=0xF0,
+                               data=f"simulated traffic {seq}".encode())
+        made.append(frame.pack())
+    return made
+
+
+def packets(count: int) -> list:
+    from packet import Packet
+
+    return [Packet.unpack(data) for data in frames(count)]
+
+
+def percentile(samples: array.array, percent: float) -> float:
+    """The percent percentile of sorted samples, in microseconds"""
+
+    return samples[min(len(samples) - 1,
+                       int(len(samples) * percent / 100))] / 1000
+
+
+async def measure(name: str, run, batch, runs: int, count: int) -> tuple:
+    """
+    Calls run (a function or a coroutine function) with every item of a
+    fresh batch(count), runs times after a warm up, then once more under
+    tracemalloc for the peak memory. Returns (name, metrics).
+    """
+
+    is_coroutine = asyncio.iscoroutinefunction(run)
+    perf_counter_ns = time.perf_counter_ns
+
+    async def run_all(items, samples=None):
+        for item in items:
+            then = perf_counter_ns()
+            if is_coroutine:
+                await run(item)
+            else:
+                run(item)
+            if samples is not None:
+                samples.append(perf_counter_ns() - then)
+
+    await run_all(batch(min(count, 1000)))
+    rates = []
+    samples = array.array('q')
+    for _ in range(runs):
+        items = batch(count)
+        gc.collect()
+        started = perf_counter_ns()
+        await run_all(items, samples)
+        rates.append(len(items) * 1e9 / (perf_counter_ns() - started))
+        # let anything the frames scheduled run
+        await asyncio.sleep(0)
+
+    items = batch(count)
+    gc.collect()
+    tracemalloc.start()
+    await run_all(items)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    samples = array.array('q', sorted(samples))
+    return name, {'fps': statistics.median(rates),
+                  'p50_us': percentile(samples, 50),
+                  'p90_us': percentile(samples, 90),
+                  'p99_us': percentile(samples, 99),
+                  'peak_kb': peak / 1024}
+
+
+def unpack(runs: int, count: int) -> list:
+    import ax25
+
+    return [asyncio.run(measure("ax25.Frame.unpack", ax25.Frame.unpack,
+                                frames, runs, count))]
+
+
+class Watch():
+    """A stack action that wants UI frames to one station, and keeps them"""
+
+    frame_types = None
+    dst = None
+
+    def __init__(self, dst: str):
+        import ax25
+
+        self.frame_types = (ax25.FrameType.UI,)
+        self.dst = dst
+
+    def frame_received(self, packet) -> bool:
+        return True
+
+    def __str__(self):
+        return f"Watch({self.dst})"
+
+
+class QuietSink():
+    """Drops everything a Net sends it"""
+
+    def debug(self, msg: str) -> None:
+        pass
+
+    def emit(self, event) -> None:
+        pass
+
+
+async def receive_frames(runs: int, count: int) -> list:
+    from net import Net
+
+    net = Net(QuietSink(), OUR_CALL)
+    try:
+        return [await measure("Net.data_received",
+                              lambda data: net.data_received(0, data),
+                              frames, runs, count)]
+    finally:
+        net.close()
+
+
+async def stack_frames(runs: int, count: int) -> list:
+    from net import Net
+
+    net = Net(QuietSink(), OUR_CALL)
+    try:
+        results = []
+        default_size = len(net.stack)
+        for size in (0, *STACK_SIZES):
+            while len(net.stack) < default_size + size:
+                net.push(Watch(f"SIM{len(net.stack) % STATIONS}"))
+            results.append(await measure(
+                f"Net.frame_received, {len(net.stack)} stack actions",
+                net.frame_received, packets, runs, count))
+        return results
+    finally:
+        net.close()
+
+
+def receive(runs: int, count: int) -> list:
+    return asyncio.run(receive_frames(runs, count))
+
+
+def stack(runs: int, count: int) -> list:
+    return asyncio.run(stack_frames(runs, count))
+
+
+def format_tnc2(runs: int, count: int) -> list:
+    from packet import Packet
+
+    def batch(count: int) -> list:
+        # Packet caches its TNC2 line, so each one is new
+        return [Packet(packet.frame) for packet in packets(count)]
+
+    return [asyncio.run(measure("Packet.tnc2", lambda packet: packet.tnc2,
+                                batch, runs, count))]
+
+
+async def ui_frames(runs: int, count: int) -> list:
+    from nt import NetTerm
+
+    app = NetTerm()
+    async with app.run_test(headless=True) as pilot:
+        while app.ports is None:
+            await pilot.pause()
+        results = [await measure("NetTerm.log_packet", app.log_packet,
+                                 packets, runs, count)]
+        view = app.view
+        for i in range(VIEWS):
+            view.append(f"bench-{i}", f"Bench {i}")
+
+        def lines(count: int) -> list:
+            return [(f"bench-{seq % VIEWS}", f"line {seq}")
+                    for seq in itertools.islice(sequence, count)]
+
+        results.append(await measure(
+            f"View.write across {VIEWS} views",
+            lambda line: view.write(*line), lines, runs, count))
+        await pilot.pause()
+    return results
+
+
+def ui(runs: int, count: int) -> list:
+    return asyncio.run(ui_frames(runs, count))
+
+
+BENCHMARKS = {
+    'startup': startup,
+    'reconnect': reconnect,
+    'unpack': unpack,
+    'receive': receive,
+    'stack': stack,
+    'format': format_tnc2,
+    'ui': ui,
+}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Time NetTerm")
+    parser.add_argument("benchmarks", nargs="*", choices=[[], *BENCHMARKS],
+                        help="which to run, all of them by default")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--frames", type=int, default=20000,
+                        help="frames in each run of the frame benchmarks")
+    parser.add_argument("--baseline", default=BASELINE,
+                        help="results to compare with")
+    parser.add_argument("--save", action="store_true",
+                        help="save the results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="how much worse than the baseline is too much")
+    parser.add_argument("--ui-child", type=float, help=argparse.SUPPRESS)
+    options = parser.parse_args(argv)
+
+    if options.ui_child:
+        ui_child(options.ui_child)
+        return 0
+    os.environ['HOME'] = tempfile.mkdtemp(prefix="netterm-bench-")
+    os.makedirs(os.path.join(os.environ['HOME'], ".netterm"))
+    with open(os.path.join(os.environ['HOME'], ".netterm", "ports.json"), "w") as f:
+        json.dump([NO_TNC], f)
+    results = {}
+    for name in options.benchmarks or BENCHMARKS:
+        for result, metrics in BENCHMARKS[name](options.runs, options.frames):
+            print(describe(result, metrics))
+            results[result] = metrics
+
+    worse = False
+    if os.path.exists(options.baseline):
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        lines, worse = compare(results, baseline['results'],
+                               options.tolerance)
+        if lines:
+            print(f"\nCompared with {options.baseline} from "
+                  f"{baseline['saved']}:")
+            for line in lines:
+                print(line)
+    if options.save:
+        # keep what wasn't run this time
+        saved = {}
+        if os.path.exists(options.baseline):
+            with open(options.baseline) as f:
+                saved = json.load(f)['results']
+        saved.update(results)
+        with open(options.baseline, "w") as f:
+            json.dump({'saved': time.strftime("%Y-%m-%d %H:%M:%S"),
+                       'python': sys.version.split()[0],
+                       'results': saved}, f, indent=2)
+        print(f"\nSaved as the baseline in {options.baseline}")
+    return 1 if worse else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
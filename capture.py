@@ -0,0 +1,197 @@
+import bisect
+import mmap
+import os
+import struct
+import time
+
+from modes import MODES, MODE_IDS
+
+# Every raw frame NetTerm receives or sends is appended to PATH.bin:
+#
+#   MAGIC, then for each frame a RECORD header followed by the frame itself
+#
+# and gets a fixed size ENTRY in PATH.idx pointing at it. Since frames are
+# appended as they happen the index is sorted by time (and offset), so
+# lookups by time never have to parse the capture. Lookups by callsign go
+# through the memory mapped postings in search.py instead.
+MAGIC = b"NTCAP1\n\0"
+RECORD = struct.Struct("<dBBBH")    # time, direction, port, mode, length
+ENTRY = struct.Struct("<dQ10s10s")  # time, offset, src, dst
+
+RX = 0
+TX = 1
+
+NO_MODE = 0xFF
+
+
+class Record():
+    """A frame read back from a capture"""
+
+    __slots__ = ('time', 'direction', 'port', 'mode_id', 'data', 'offset')
+
+    def __init__(self, time, direction, port, mode_id, data, offset):
+        self.time = time
+        self.direction = direction
+        # the NetTerm port (see ports.py) it went through
+        self.port = port
+        self.mode_id = mode_id
+        self.data = data
+        self.offset = offset
+
+
+def mode_value(mode_id: str | None) -> int:
+    """The SETHW value for a mode, which unlike its name fits in a byte"""
+    return MODES.get(mode_id, NO_MODE)
+
+
+class CaptureWriter():
+    """Appends frames to a capture and its index"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.data_file = open(path + ".bin", "ab")
+        if self.data_file.tell() == 0:
+            self.data_file.write(MAGIC)
+        self.index_file = open(path + ".idx", "ab")
+
+        # anything before this was captured by an earlier session
+        self.session_start = self.data_file.tell()
+
+    def write(self, direction: int, port: int, mode_id: str | None,
+              data: bytes, src: str = "", dst: str = "") -> int:
+        """Appends a frame, returning the offset it was written at"""
+
+        now = time.time()
+        offset = self.data_file.tell()
+        self.data_file.write(RECORD.pack(now, direction, port,
+                                         mode_value(mode_id), len(data)))
+        self.data_file.write(data)
+        self.index_file.write(ENTRY.pack(now, offset, src.encode(),
+                                         dst.encode()))
+        return offset
+
+    def flush(self) -> None:
+        self.data_file.flush()
+        self.index_file.flush()
+
+    def close(self) -> None:
+        self.data_file.close()
+        self.index_file.close()
+
+
+class Capture():
+    """
+    Reads a capture. The index is memory mapped, so finding the frames in a
+    time range only touches the index and the frames asked for.
+    """
+
+    def __init__(self, path: str):
+        self.data_file = open(path + ".bin", "rb")
+        if self.data_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path}.bin is not a NetTerm capture")
+        self.index_path = path + ".idx"
+        self.map = None
+        self.map_size = 0
+
+    def index(self):
+        """
+        The index as it is right now. It's mapped once, and mapped again only
+        when it has grown. Returns b"" if there's nothing in it yet, as mmap
+        can't map an empty file.
+        """
+
+        size = os.stat(self.index_path).st_size
+        size -= size % ENTRY.size
+        if size != self.map_size:
+            old = self.map
+            if size == 0:
+                self.map = None
+            else:
+                with open(self.index_path, "rb") as index_file:
+                    self.map = mmap.mmap(index_file.fileno(), size,
+                                         access=mmap.ACCESS_READ)
+            self.map_size = size
+            if old is not None:
+                try:
+                    old.close()
+                except BufferError:
+                    # still being read, it's closed once it's let go of
+                    pass
+        return self.map if self.map is not None else b""
+
+    def offsets_between(self, start: float, end: float) -> list:
+        """Offsets of every frame from start up to (not including) end"""
+
+        index = self.index()
+        count = len(index) // ENTRY.size
+        times = TimeColumn(index, count)
+        first = bisect.bisect_left(times, start)
+        last = bisect.bisect_left(times, end, lo=first)
+        return [ENTRY.unpack_from(index, i * ENTRY.size)[1]
+                for i in range(first, last)]
+
+    def read_at(self, offset: int) -> Record:
+        self.data_file.seek(offset)
+        return self.read_record()
+
+    def read_record(self) -> Record | None:
+        offset = self.data_file.tell()
+        header = self.data_file.read(RECORD.size)
+        if len(header) < RECORD.size:
+            return None
+        t, direction, port, mode, length = RECORD.unpack(header)
+        data = self.data_file.read(length)
+        if len(data) < length:
+            return None
+        return Record(t, direction, port, MODE_IDS.get(mode), data, offset)
+
+    def first_at(self, offset: int) -> int:
+        """The offset of the first frame at or after offset"""
+
+        index = self.index()
+        count = len(index) // ENTRY.size
+        i = bisect.bisect_left(OffsetColumn(index, count), offset)
+        if i == count:
+            return os.fstat(self.data_file.fileno()).st_size
+        return ENTRY.unpack_from(index, i * ENTRY.size)[1]
+
+    def records(self, start: int = 0):
+        """
+        Every record that starts at or after offset start, oldest first,
+        read as a stream
+        """
+
+        if start > len(MAGIC):
+            start = self.first_at(start)
+        self.data_file.seek(max(start, len(MAGIC)))
+        while (record := self.read_record()) is not None:
+            yield record
+
+    def close(self) -> None:
+        self.data_file.close()
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                pass
+
+
+class TimeColumn():
+    """The times in a mapped index, as a sequence bisect can search"""
+
+    def __init__(self, index, count: int):
+        self.index = index
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i: int) -> float:
+        return ENTRY.unpack_from(self.index, i * ENTRY.size)[0]
+
+
+class OffsetColumn(TimeColumn):
+    """The offsets in a mapped index, as a sequence bisect can search"""
+
+    def __getitem__(self, i: int) -> int:
+        return ENTRY.unpack_from(self.index, i * ENTRY.size)[1]
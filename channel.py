@@ -0,0 +1,149 @@
+import time
+from collections import OrderedDict
+
+from modes import airtime
+from packet import Packet
+
+WINDOW = 60          # seconds each rolling rate covers
+STATIONS_MAX = 500   # most stations and conversations counted, idle ones go
+DASH_STATIONS = 15   # busiest stations and conversations shown on /dash
+
+
+class Rolling():
+    """
+    Frames, bytes, airtime and retransmissions over the last WINDOW seconds,
+    kept as one slot per second in a ring with running totals. Adding to it
+    or reading it only touches the slots that have gone stale since, never
+    the whole history.
+    """
+
+    __slots__ = ('frames', 'bytes', 'airtime', 'retransmits', 'totals',
+                 'second')
+
+    def __init__(self):
+        self.frames = [0] * WINDOW
+        self.bytes = [0] * WINDOW
+        self.airtime = [0.0] * WINDOW
+        self.retransmits = [0] * WINDOW
+        # running sums of the slots above, in the same order
+        self.totals = [0, 0, 0.0, 0]
+        # the second the newest slot is for
+        self.second = int(time.monotonic())
+
+    def advance(self, second: int) -> int:
+        """Clears the slots for the seconds since we last moved on"""
+
+        stale = min(second - self.second, WINDOW)
+        totals = self.totals
+        for i in range(1, stale + 1):
+            slot = (self.second + i) % WINDOW
+            for n, ring in enumerate((self.frames, self.bytes, self.airtime,
+                                      self.retransmits)):
+                totals[n] -= ring[slot]
+                ring[slot] = 0
+        if second > self.second:
+            self.second = second
+        return second % WINDOW
+
+    def add(self, length: int, seconds: float) -> None:
+        slot = self.advance(int(time.monotonic()))
+        self.frames[slot] += 1
+        self.bytes[slot] += length
+        self.airtime[slot] += seconds
+        self.totals[0] += 1
+        self.totals[1] += length
+        self.totals[2] += seconds
+
+    def retransmitted(self) -> None:
+        slot = self.advance(int(time.monotonic()))
+        self.retransmits[slot] += 1
+        self.totals[3] += 1
+
+    def rates(self) -> tuple:
+        """
+        Frames/s, bytes/s, the fraction of the time on air and
+        retransmissions a minute, over the window
+        """
+
+        self.advance(int(time.monotonic()))
+        frames, length, seconds, retransmits = self.totals
+        return (frames / WINDOW, length / WINDOW,
+                max(0.0, seconds) / WINDOW, retransmits * 60 / WINDOW)
+
+    def __str__(self) -> str:
+        fps, bps, busy, retransmits = self.rates()
+        return (f"{fps:.2f} frames/s {bps:.0f} B/s {busy:.0%} airtime "
+                f"{retransmits:.1f} retransmits/min")
+
+
+class ChannelStats():
+    """
+    Rolling rates for the whole channel, each station and each conversation
+    (the same pairs as the call-X-call-Y views), counted as frames are
+    received and sent. Only the STATIONS_MAX most recently active stations
+    and conversations are kept.
+    """
+
+    def __init__(self, modes):
+        # the ModeManager, for the time spent in each mode
+        self.modes = modes
+        self.channel = Rolling()
+        self.stations = OrderedDict()
+        self.conversations = OrderedDict()
+
+    @staticmethod
+    def entry(table: OrderedDict, key) -> Rolling:
+        rolling = table.get(key)
+        if rolling is None:
+            rolling = table[key] = Rolling()
+            if len(table) > STATIONS_MAX:
+                table.popitem(last=False)
+        else:
+            table.move_to_end(key)
+        return rolling
+
+    def frame(self, packet: Packet, mode_id: str, length: int) -> None:
+        """A frame of length bytes went over the air in mode_id"""
+
+        seconds = airtime(mode_id, length)
+        self.channel.add(length, seconds)
+        src = packet.src
+        dst = packet.dst
+        self.entry(self.stations, src).add(length, seconds)
+        # a conversation is the same whichever way the frame went
+        pair = (src, dst) if src < dst else (dst, src)
+        self.entry(self.conversations, pair).add(length, seconds)
+
+    def retransmitted(self, call: str) -> None:
+        """We sent call an I frame again"""
+
+        self.channel.retransmitted()
+        self.entry(self.stations, call).retransmitted()
+
+    @staticmethod
+    def busiest(table: OrderedDict) -> list:
+        """The entries with the most airtime in the window"""
+
+        second = int(time.monotonic())
+        for rolling in table.values():
+            rolling.advance(second)
+        return sorted(table.items(), key=lambda item: item[1].totals[2],
+                      reverse=True)[:DASH_STATIONS]
+
+    def lines(self) -> list:
+        lines = [f"Channel ({WINDOW}s): {self.channel}"]
+        times = self.modes.times()
+        total = sum(times.values()) or 1
+        lines.append("Modes: " + ", ".join(
+            f"{mode_id} {seconds:.0f}s ({seconds / total:.0%})"
+            for mode_id, seconds in sorted(times.items(),
+                                           key=lambda item: -item[1])))
+        lines.append("Stations:")
+        lines += [f"  {call}: {rolling}"
+                  for call, rolling in self.busiest(self.stations)
+                  if rolling.totals[0] or rolling.totals[3]]
+        lines.append("Conversations:")
+        lines += [f"  {a} {b}: {rolling}"
+                  for (a, b), rolling in self.busiest(self.conversations)
+                  if rolling.totals[0]]
+        return lines
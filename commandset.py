@@ -0,0 +1,212 @@
+import os
+
+from modes import MODES
+
+AUTO = 'auto'
+CONNECT = 'connect'
+DASH = 'dash'
+DISCONNECT = 'disconnect'
+FIND = 'find'
+MODE = 'mode'
+PORT = 'port'
+RMODE = 'rmode'
+SEND = 'send'
+STATS = 'stats'
+SWEEP = 'sweep'
+LINKS = 'links'
+QUEUE = 'queue'
+QUIT = 'quit'
+REPLAY = 'replay'
+TEST = 'test'
+TRACE = 'trace'
+# not a command, lines that don't start with / go over the connection
+SAY = 'say'
+
+NT_COMMANDS = {
+    AUTO: {
+        'names': ['auto', 'negotioate'],
+        'suggest': "/auto CALL",
+        'help': "switches to the best mode for connecting to CALL",
+        'args': ['call'],
+    },
+    CONNECT: {
+        'names': ['connect', 'c'],
+        'suggest': "/connect CALL",
+        'help': "opens an AX.25 connection to CALL, anything typed without a / is then sent to it",
+        'args': ['call'],
+    },
+    DASH: {
+        'names': ['dash', 'dashboard'],
+        'suggest': "/dash",
+        'help': "shows frames, bytes and airtime a second and retransmissions for the channel, each station and each conversation over the last minute, and the time spent in each mode",
+        'args': [],
+    },
+    DISCONNECT: {
+        'names': ['disconnect', 'd'],
+        'suggest': "/disconnect",
+        'help': "closes the connection to CALL (by default the last one opened)",
+        'args': ['call?'],
+    },
+    FIND: {
+        'names': ['find', 'search'],
+        'suggest': "/find CALL",
+        'help': "shows the newest frames in all traffic with every word, from:CALL, to:CALL, via:CALL, call:CALL or type:UI given, since:30m (or s, h, d) for only recent ones",
+        'args': ['term*'],
+    },
+    LINKS: {
+        'names': ['links'],
+        'suggest': "/links",
+        'help': "lists the best known mode, RTT and loss for each station",
+        'args': [],
+    },
+    MODE: {
+        'names': ['mode', 'speed'],
+        'suggest': "/mode 1200-AFSK-AX.25",
+        'help': "uses SETHW on the local NinoTNC to change the mode to one of:" +
+                ", ".join(MODES.keys()),
+        'args': ['mode'],
+    },
+    PORT: {
+        'names': ['port', 'tnc'],
+        'suggest': "/port 0",
+        'help': "lists the TNCs, and with a NUMBER sends the commands after it to that one",
+        'args': ['number?'],
+    },
+    QUEUE: {
+        'names': ['queue', 'txq'],
+        'suggest': "/queue",
+        'help': "shows how many frames are waiting to be sent, how long until they are on air, the time spent in each mode and how many duplicate frames were dropped",
+        'args': [],
+    },
+    QUIT: {
+        'names': ['quit', 'exit', 'bye'],
+        'suggest': "/quit",
+        'help': "exits the program",
+        'args': [],
+    },
+    REPLAY: {
+        'names': ['replay'],
+        'suggest': "/replay FILE",
+        'help': "runs every received frame in a capture FILE (with or without its .bin) through the stack without transmitting",
+        'args': ['capture'],
+    },
+    RMODE: {
+        'names': ['rmode', 'rspeed', 'remote_mode', 'remote_speed'],
+        'suggest': "/rmode CALL 1200-AFSK-AX.25",
+        'help': "requests that a remote NinoTNC change its mode (by default the fastest known to work with CALL) to one of:" +
+                ", ".join(MODES.keys()),
+        'args': ['call', 'mode?'],
+    },
+    SEND: {
+        'names': ['send', 'put'],
+        'suggest': "/send CALL FILE",
+        'help': "sends FILE to CALL in the mode it is in, compressed where that saves airtime, and shows the throughput as it goes",
+        'args': ['call', 'file'],
+    },
+    STATS: {
+        'names': ['stats', 'profile'],
+        'suggest': "/stats",
+        'help': "shows how often each part of the stack and each timer ran and how long it took, and saves it as JSON to FILE if given",
+        'args': ['path?'],
+    },
+    SWEEP: {
+        'names': ['sweep'],
+        'suggest': "/sweep CALL CALL",
+        'help': "sends TEST probes to every CALL at once and shows the round trip times and loss for each station and mode, without a CALL it shows the totals so far",
+        'args': ['call*'],
+    },
+    TEST: {
+        'names': ['test', 'ping'],
+        'suggest': "/test CALL",
+        'help': "sends a test packet to CALL and shows how long the reply took",
+        'args': ['call'],
+    },
+    TRACE: {
+        'names': ['trace'],
+        'suggest': "/trace",
+        'help': "toggles tracing frames through the stack in the debug view",
+        'args': [],
+    },
+}
+
+
+class CommandError(Exception):
+    """A command that can't be run, the message says why"""
+
+
+def capture_path(arg: str) -> str:
+    """The path of a capture, without the .bin, from a capture argument"""
+    return os.path.expanduser(arg).removesuffix(".bin")
+
+
+def lookup_id(command: str) -> str | None:
+    for command_id, command_dict in NT_COMMANDS.items():
+        if command in command_dict['names']:
+            return command_id
+    return None
+
+
+def parse(line: str) -> tuple:
+    """
+    Checks a line of input and returns (command_id, args). Lines that don't
+    start with / are SAY. Raises CommandError if the command is unknown or
+    its arguments are wrong.
+    """
+
+    if not line.startswith('/'):
+        return SAY, [line]
+
+    params = line[1:].split()
+    if not params:
+        raise CommandError("No command given")
+    command = params[0]
+
+    # check the command
+    command_id = lookup_id(command)
+    if not command_id:
+        raise CommandError(f"Unknown command: {command}")
+    command_args = NT_COMMANDS[command_id]['args']
+
+    # do we have enough? arguments ending in ? are optional, one ending in *
+    # (always the last) takes any number
+    args = params[1:]
+    required = [arg_type for arg_type in command_args
+                if not arg_type.endswith(('?', '*'))]
+    if len(args) < len(required):
+        raise CommandError(f"{command} command requires {len(required)} argument(s)")
+
+    if command_args and command_args[-1].endswith('*'):
+        arg_types = command_args[:-1] + [command_args[-1]] * len(args)
+    else:
+        # strip off any extra arguments
+        args = args[:len(command_args)]
+        arg_types = command_args
+
+    # are the arguments valid?
+    for arg, arg_type in zip(args, arg_types):
+        arg_type = arg_type.rstrip('?*')
+        if arg_type == 'call':
+            # not needed until the first command, so not imported at startup
+            import ax25
+
+            if not ax25.Address.valid_call(arg):
+                raise CommandError(f"{arg} is not a valid call sign")
+        elif arg_type == 'mode':
+            if arg not in MODES:
+                raise CommandError(f"{arg} is not a valid mode")
+        elif arg_type == 'file':
+            if not os.path.isfile(arg):
+                raise CommandError(f"{arg} is not a file")
+        elif arg_type == 'capture':
+            # either capture or capture.bin
+            if not os.path.isfile(capture_path(arg) + ".bin"):
+                raise CommandError(f"{arg} is not a capture")
+        elif arg_type == 'number':
+            if not arg.isdigit():
+                raise CommandError(f"{arg} is not a number")
+        elif arg_type == 'path':
+            # somewhere to write, so only the directory has to exist
+            if not os.path.isdir(os.path.dirname(os.path.abspath(arg))):
+                raise CommandError(f"{os.path.dirname(arg)} is not a directory")
+
+    return command_id, args
@@ -0,0 +1,427 @@
+import time
+
+import ax25
+
+from events import ConnectionData, ConnectionChanged
+from modes import PACLEN, WINDOW, airtime
+from packet import Packet
+
+NO_LAYER3_PID = 0xF0
+
+# pyham_ax25 only packs the one octet control field, so sequence numbers are
+# modulo 8. With selective reject the receiver has to tell a new frame from
+# a retransmitted one, so no more than half of them can be outstanding.
+MODULUS = 8
+MAX_WINDOW = MODULUS // 2
+
+HEADER = 16       # bytes of addresses, control and PID around the data
+T1_MARGIN = 2.0   # seconds on top of the airtime for the other end to answer
+T1_MAX = 60       # most seconds T1 backs off to
+T3 = 180          # seconds of an idle link before we check it is still there
+N2 = 10           # most times T1 runs out before we give up
+
+DISCONNECTED = "disconnected"
+CONNECTING = "connecting"
+CONNECTED = "connected"
+DISCONNECTING = "disconnecting"
+
+
+def ahead(a: int, b: int) -> int:
+    """How far sequence number b is ahead of a"""
+    return (b - a) % MODULUS
+
+
+class Connection():
+    """
+    Stack action for one AX.25 connection with another station. Runs until
+    the connection is closed.
+
+    Up to a window of I frames are sent before waiting for an
+    acknowledgement, and both the window and the size of each frame come
+    from the mode the TNC is in, so the fast modes keep the channel full.
+    A frame that arrives early is kept and the missing ones are asked for
+    with SREJ, so a single lost frame is all that gets sent again. When T1
+    runs out only the oldest unacknowledged frame is sent again, with the
+    poll bit set, and the answer tells us where the other end is up to.
+    T3 polls a link that has gone quiet.
+    """
+
+    frame_types = (
+        ax25.FrameType.I,
+        ax25.FrameType.RR,
+        ax25.FrameType.RNR,
+        ax25.FrameType.REJ,
+        ax25.FrameType.SREJ,
+        ax25.FrameType.SABM,
+        ax25.FrameType.UA,
+        ax25.FrameType.DM,
+        ax25.FrameType.DISC,
+        ax25.FrameType.FRMR,
+    )
+
+    def __init__(self, sink, net, our_call, call):
+        self.sink = sink
+        self.net = net
+        self.our_call = our_call
+        self.dst = our_call
+        self.call = call
+        self.state = DISCONNECTED
+
+        # V(S), V(A) and V(R) from the spec
+        self.vs = 0
+        self.va = 0
+        self.vr = 0
+
+        # data waiting to be put in I frames, frames sent but not yet
+        # acknowledged and frames that arrived ahead of a missing one, the
+        # last two by N(S)
+        self.sending = bytearray()
+        self.unacked = {}
+        self.received = {}
+        # N(S) of the frames we've sent an SREJ for
+        self.rejected = set()
+        self.remote_busy = False
+
+        self.retries = 0
+        self.t1 = None
+        self.t2 = None
+        self.t3 = None
+
+        self.started = time.monotonic()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.retransmitted = 0
+
+    @property
+    def mode_id(self) -> str:
+        """The mode our frames to the other station go out in"""
+        return self.net.modes.mode_for(self.call)
+
+    @property
+    def window(self) -> int:
+        return min(WINDOW[self.mode_id], MAX_WINDOW)
+
+    @property
+    def paclen(self) -> int:
+        return PACLEN[self.mode_id]
+
+    def open(self) -> None:
+        """Asks the other station for a connection"""
+
+        self.change(CONNECTING)
+        self.send_u(ax25.FrameType.SABM, True)
+        self.start_t1()
+
+    def accept(self, poll: bool) -> None:
+        """Takes up a connection the other station asked for"""
+
+        self.reset()
+        self.send_u(ax25.FrameType.UA, poll)
+        self.connected()
+
+    def close(self) -> None:
+        """Disconnects, dropping anything that hasn't been sent"""
+
+        if self.state == CONNECTING:
+            self.finish()
+            return
+        self.change(DISCONNECTING)
+        self.retries = 0
+        self.send_u(ax25.FrameType.DISC, True)
+        self.start_t1()
+
+    def write(self, data: bytes) -> None:
+        """Queues data to go over the connection"""
+
+        self.sending.extend(data)
+        self.transmit()
+
+    def reset(self) -> None:
+        self.vs = self.va = self.vr = 0
+        self.unacked.clear()
+        self.received.clear()
+        self.rejected.clear()
+        self.remote_busy = False
+        self.retries = 0
+
+    def connected(self) -> None:
+        self.net.scheduler.cancel(self.t1)
+        self.t1 = None
+        self.retries = 0
+        self.change(CONNECTED)
+        self.start_t3()
+        self.transmit()
+
+    def change(self, state: str) -> None:
+        self.state = state
+        self.sink.debug(f"{self}")
+        self.sink.emit(ConnectionChanged(self.call, state, self.net.port))
+
+    def finish(self) -> None:
+        """Cleans up once the connection is gone"""
+
+        for timer in (self.t1, self.t2, self.t3):
+            self.net.scheduler.cancel(timer)
+        if self.sending or self.unacked:
+            self.sink.debug(f"{self.call}: {len(self.sending)} byte(s) and "
+                           f"{len(self.unacked)} frame(s) never acknowledged")
+        self.change(DISCONNECTED)
+        self.net.connections.pop(self.call, None)
+        self.net.remove(self)
+
+    # sending
+
+    def frame(self, control: ax25.Control, command: bool,
+              **kwargs) -> ax25.Frame:
+        """
+        A frame to the other station, with the C bits set to say whether it
+        is a command or a response
+        """
+
+        dst = ax25.Address(self.call)
+        src = ax25.Address(self.our_call)
+        dst.command_response = command
+        src.command_response = not command
+        return ax25.Frame(dst, src, control=control, **kwargs)
+
+    def send_u(self, frame_type: ax25.FrameType, poll_final: bool) -> None:
+        command = frame_type in (ax25.FrameType.SABM, ax25.FrameType.DISC)
+        control = ax25.Control(frame_type, poll_final=poll_final)
+        self.net.send(self.frame(control, command))
+
+    def send_s(self, frame_type: ax25.FrameType, nr: int,
+               poll_final: bool = False, command: bool = False) -> None:
+        control = ax25.Control(frame_type, poll_final=poll_final,
+                               recv_seqno=nr)
+        self.net.send(self.frame(control, command))
+
+    def send_i(self, ns: int, poll: bool = False) -> None:
+        # every I frame acknowledges what we've received, so there's no
+        # need for a separate RR
+        self.net.scheduler.cancel(self.t2)
+        self.t2 = None
+        control = ax25.Control(ax25.FrameType.I, poll_final=poll,
+                               recv_seqno=self.vr, send_seqno=ns)
+        self.net.send(self.frame(control, True, pid=NO_LAYER3_PID,
+                                 data=self.unacked[ns]))
+
+    def send_ack(self, final: bool = False) -> None:
+        self.net.scheduler.cancel(self.t2)
+        self.t2 = None
+        self.send_s(ax25.FrameType.RR, self.vr, final)
+
+    def transmit(self) -> None:
+        """Sends as much waiting data as the window allows"""
+
+        if self.state != CONNECTED or self.remote_busy:
+            return
+        paclen = self.paclen
+        while self.sending and len(self.unacked) < self.window:
+            self.unacked[self.vs] = bytes(self.sending[:paclen])
+            del self.sending[:paclen]
+            self.send_i(self.vs)
+            self.vs = (self.vs + 1) % MODULUS
+        if self.unacked and self.t1 is None:
+            self.start_t1()
+
+    def retransmit(self, ns: int, poll: bool = False) -> None:
+        if ns in self.unacked:
+            self.retransmitted += 1
+            self.net.channel.retransmitted(self.call)
+            self.send_i(ns, poll)
+
+    # timers
+
+    def t1_seconds(self) -> float:
+        """
+        Long enough for everything queued ahead of us and a full window to
+        go out and the acknowledgement to come back, doubled for every retry
+        """
+
+        mode_id = self.mode_id
+        seconds = (self.net.txqueue.drain_time() +
+                   airtime(mode_id, self.paclen + HEADER) * self.window +
+                   airtime(mode_id, HEADER) + self.t2_seconds() + T1_MARGIN)
+        return min(seconds * 2 ** self.retries, T1_MAX)
+
+    def t2_seconds(self) -> float:
+        # long enough for the next frame in the other end's window to arrive
+        return airtime(self.mode_id, self.paclen + HEADER)
+
+    def start_t1(self) -> None:
+        self.net.scheduler.cancel(self.t1)
+        self.net.scheduler.cancel(self.t3)
+        self.t3 = None
+        self.t1 = self.net.scheduler.call_later(self.t1_seconds(),
+                                                self.t1_expired)
+
+    def start_t3(self) -> None:
+        self.net.scheduler.cancel(self.t3)
+        self.t3 = self.net.scheduler.call_later(T3, self.t3_expired)
+
+    def t1_expired(self) -> None:
+        self.t1 = None
+        if self.retries >= N2:
+            self.sink.debug(f"{self.call}: no answer after {N2} tries")
+            self.finish()
+            return
+        self.retries += 1
+        if self.state == CONNECTING:
+            self.send_u(ax25.FrameType.SABM, True)
+        elif self.state == DISCONNECTING:
+            self.send_u(ax25.FrameType.DISC, True)
+        elif self.unacked:
+            # their answer tells us which frame they are waiting for
+            self.retransmit(self.va, poll=True)
+        else:
+            # T3 ran out or they are busy, ask where they are
+            self.send_s(ax25.FrameType.RR, self.vr, True, command=True)
+        self.start_t1()
+
+    def t2_expired(self) -> None:
+        self.t2 = None
+        if self.state == CONNECTED:
+            self.send_ack()
+
+    def t3_expired(self) -> None:
+        self.t3 = None
+        if self.state == CONNECTED and self.t1 is None:
+            self.send_s(ax25.FrameType.RR, self.vr, True, command=True)
+            self.start_t1()
+
+    # receiving
+
+    def frame_received(self, packet: Packet) -> bool:
+        if packet.src != self.call:
+            return True
+        frame_type = packet.frame_type
+        if frame_type == ax25.FrameType.I:
+            self.i_received(packet)
+        elif frame_type.is_S():
+            self.s_received(packet)
+        else:
+            self.u_received(packet)
+        return True
+
+    def acknowledge(self, nr: int) -> None:
+        """Frees every frame before nr, which the other end has now got"""
+
+        if ahead(self.va, nr) > ahead(self.va, self.vs):
+            self.sink.debug(f"{self.call}: ignoring N(R) {nr} outside the "
+                           f"window {self.va}-{self.vs}")
+            return
+        if nr == self.va:
+            return
+        while self.va != nr:
+            self.bytes_sent += len(self.unacked.pop(self.va, b''))
+            self.va = (self.va + 1) % MODULUS
+        self.retries = 0
+        if self.unacked:
+            self.start_t1()
+        else:
+            self.net.scheduler.cancel(self.t1)
+            self.t1 = None
+            self.start_t3()
+
+    def deliver(self, data: bytes) -> None:
+        self.bytes_received += len(data)
+        self.sink.emit(ConnectionData(self.call, data, self.net.port))
+
+    def i_received(self, packet: Packet) -> None:
+        if self.state != CONNECTED:
+            return
+        control = packet.control
+        self.acknowledge(control.recv_seqno)
+        ns = control.send_seqno
+        distance = ahead(self.vr, ns)
+        if distance == 0:
+            # the one we were waiting for, and anything kept that follows it
+            self.deliver(packet.data)
+            self.rejected.discard(ns)
+            self.vr = (self.vr + 1) % MODULUS
+            while self.vr in self.received:
+                self.deliver(self.received.pop(self.vr))
+                self.rejected.discard(self.vr)
+                self.vr = (self.vr + 1) % MODULUS
+        elif distance < MAX_WINDOW:
+            # early, keep it and ask for each missing frame once
+            self.received[ns] = packet.data
+            for missing in range(distance):
+                seq = (self.vr + missing) % MODULUS
+                if seq not in self.received and seq not in self.rejected:
+                    self.rejected.add(seq)
+                    self.send_s(ax25.FrameType.SREJ, seq)
+        # anything else is a frame we already have, sent again
+
+        if packet.poll_final:
+            self.send_ack(final=True)
+        elif self.t2 is None:
+            # wait a little, so one RR covers the rest of their window
+            self.t2 = self.net.scheduler.call_later(self.t2_seconds(),
+                                                    self.t2_expired)
+        self.transmit()
+
+    def s_received(self, packet: Packet) -> None:
+        if self.state != CONNECTED:
+            return
+        control = packet.control
+        frame_type = packet.frame_type
+        nr = control.recv_seqno
+        poll_final = control.poll_final
+
+        if frame_type == ax25.FrameType.SREJ:
+            # only acknowledges the frames before it when F is set
+            if poll_final:
+                self.acknowledge(nr)
+            self.retransmit(nr)
+            return
+
+        self.remote_busy = frame_type == ax25.FrameType.RNR
+        self.acknowledge(nr)
+        if frame_type == ax25.FrameType.REJ:
+            # they don't do SREJ, go back to nr
+            for i in range(ahead(self.va, self.vs)):
+                self.retransmit((self.va + i) % MODULUS)
+        if poll_final and packet.command:
+            # they want to know where we are
+            self.send_ack(final=True)
+        elif poll_final and self.unacked:
+            # the answer to our poll, they are still waiting on va
+            self.retransmit(self.va, poll=True)
+            self.start_t1()
+        if self.remote_busy and self.t1 is None:
+            # keep asking until they're ready again
+            self.start_t1()
+        self.transmit()
+
+    def u_received(self, packet: Packet) -> None:
+        frame_type = packet.frame_type
+        poll_final = packet.poll_final
+        if frame_type == ax25.FrameType.SABM:
+            # they reset the link, or we both asked at once
+            if self.state in (CONNECTED, CONNECTING):
+                self.accept(poll_final)
+        elif frame_type == ax25.FrameType.UA:
+            if self.state == CONNECTING:
+                self.reset()
+                self.connected()
+            elif self.state == DISCONNECTING:
+                self.finish()
+        elif frame_type == ax25.FrameType.DM:
+            if self.state == CONNECTING:
+                self.sink.debug(f"{self.call} refused the connection")
+            self.finish()
+        elif frame_type == ax25.FrameType.DISC:
+            self.send_u(ax25.FrameType.UA, poll_final)
+            self.finish()
+        elif frame_type == ax25.FrameType.FRMR:
+            self.sink.debug(f"{self.call} rejected a frame, resetting the link")
+            self.reset()
+            self.open()
+
+    def __str__(self) -> str:
+        seconds = time.monotonic() - self.started
+        return (f"Connection({self.call}, {self.state}, V(S) {self.vs} "
+                f"V(A) {self.va} V(R) {self.vr}, {self.bytes_sent}/"
+                f"{self.bytes_received} bytes out/in, {self.retransmitted} "
+                f"retransmitted, {seconds:.0f}s)")
@@ -0,0 +1,67 @@
+import time
+from collections import OrderedDict
+
+import ax25
+
+from packet import Packet
+
+DEDUP_WINDOW = 30.0  # seconds a frame counts as a duplicate of one heard before
+DEDUP_MAX = 2000     # most frames remembered, the oldest go first
+
+# connected mode frames have sequence numbers and their own retransmits, so
+# only frames that don't are checked
+DEDUP_TYPES = frozenset((ax25.FrameType.UI, ax25.FrameType.TEST))
+
+
+class Dedup():
+    """
+    Spots frames we've already heard in the last DEDUP_WINDOW seconds, like
+    the copies of one frame that come back from each digipeater. Frames are
+    the same if their src, dst, control and data are, whatever their via
+    path says. Like APRS, the window runs from the first time we heard the
+    frame, so a beacon repeated every 30s still gets through.
+    """
+
+    def __init__(self, window: float = DEDUP_WINDOW, size: int = DEDUP_MAX):
+        self.window = window
+        self.size = size
+        # hash of the frame -> monotonic time it stops being a duplicate, in
+        # the order they were first heard
+        self.seen = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(packet: Packet) -> int:
+        return hash((packet.src, packet.dst, packet.frame_type,
+                     packet.poll_final, packet.pid, packet.data))
+
+    def duplicate(self, packet: Packet) -> bool:
+        """True if packet is a copy of a frame heard within the window"""
+
+        if packet.frame_type not in DEDUP_TYPES:
+            return False
+
+        now = time.monotonic()
+        seen = self.seen
+        # forget what has aged out, it's all at the front
+        while seen:
+            key, expires = next(iter(seen.items()))
+            if expires > now:
+                break
+            del seen[key]
+
+        key = self.key(packet)
+        if key in seen:
+            self.hits += 1
+            return True
+        self.misses += 1
+        seen[key] = now + self.window
+        if len(seen) > self.size:
+            seen.popitem(last=False)
+        return False
+
+    def __str__(self) -> str:
+        return (f"Dedup({self.hits} duplicates dropped, {self.misses} new, "
+                f"{len(self.seen)} remembered)")
@@ -0,0 +1,67 @@
+"""
+What Net tells the outside world about, passed to Sink.emit(). These are
+plain classes so Net can run without a UI, NetTerm wraps them in a Textual
+message (see NetEvent in nt.py) and the gateway writes them out as JSON.
+Each says which port (see ports.py) it happened on.
+"""
+
+
+class LogFrames():
+    """A batch of sent/received frames to log"""
+
+    __slots__ = ('packets', 'dropped', 'port')
+
+    def __init__(self, packets: list, dropped: int, port: int = 0) -> None:
+        self.packets = packets
+        # how many frames were dropped from this batch to keep up
+        self.dropped = dropped
+        self.port = port
+
+
+class ModeChanged():
+    """The mode we listen in changed"""
+
+    __slots__ = ('mode_id', 'port')
+
+    def __init__(self, mode_id: str, port: int = 0) -> None:
+        self.mode_id = mode_id
+        self.port = port
+
+
+class ConnectionData():
+    """Data that arrived, in order, over a connection"""
+
+    __slots__ = ('call', 'data', 'port')
+
+    def __init__(self, call: str, data: bytes, port: int = 0) -> None:
+        self.call = call
+        self.data = data
+        self.port = port
+
+
+class ConnectionChanged():
+    """A connection changed state"""
+
+    __slots__ = ('call', 'state', 'port')
+
+    def __init__(self, call: str, state: str, port: int = 0) -> None:
+        self.call = call
+        self.state = state
+        self.port = port
+
+
+# the states of the link to the TNC, nothing to do with the AX.25
+# connection states in connection.py
+TNC_CONNECTING = "connecting"
+TNC_CONNECTED = "connected"
+TNC_DISCONNECTED = "disconnected"
+
+
+class TncChanged():
+    """The link to the TNC changed state, see Ports.keep_connected"""
+
+    __slots__ = ('state', 'port')
+
+    def __init__(self, state: str, port: int = 0) -> None:
+        self.state = state
+        self.port = port
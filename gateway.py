@@ -0,0 +1,188 @@
+"""
+Runs the Net stack without the UI, for unattended nodes. Debug output and
+events are written to stdout as JSON lines, and to every client attached to
+the control socket, which takes the same /commands as NetTerm.
+
+    python gateway.py --call N0CALL --host 127.0.0.1 --port 8001
+    python gateway.py --call N0CALL --serial /dev/ttyACM0
+    python gateway.py --call N0CALL --tnc 127.0.0.1:8001 --tnc /dev/ttyACM0
+
+Doesn't import Textual, so it starts quickly and stays small.
+"""
+
+import argparse
+import asyncio
+import json
+import signal
+import sys
+import time
+
+import commandset
+from commandset import CommandError
+from events import (ConnectionChanged, ConnectionData, LogFrames, ModeChanged,
+                    TncChanged)
+from ports import Ports
+from sink import Sink
+
+CONTROL_HOST = "127.0.0.1"
+CONTROL_PORT = 8002
+
+
+def event_record(event) -> dict:
+    """An event from events.py as something json can write"""
+
+    if type(event) == LogFrames:
+        return {'type': 'frames', 'port': event.port,
+                'frames': [packet.tnc2 for packet in event.packets],
+                'dropped': event.dropped}
+    if type(event) == ModeChanged:
+        return {'type': 'mode', 'port': event.port, 'mode_id': event.mode_id}
+    if type(event) == ConnectionData:
+        return {'type': 'data', 'port': event.port, 'call': event.call,
+                'data': event.data.decode('utf-8', errors='replace')}
+    if type(event) == ConnectionChanged:
+        return {'type': 'connection', 'port': event.port, 'call': event.call,
+                'state': event.state}
+    if type(event) == TncChanged:
+        return {'type': 'tnc', 'port': event.port, 'state': event.state}
+    return {'type': type(event).__name__}
+
+
+class JsonSink(Sink):
+    """
+    Writes debug output and events as one JSON object per line to stdout and
+    to every attached control client
+    """
+
+    def __init__(self, out=sys.stdout):
+        self.out = out
+        # StreamWriters of the attached control clients
+        self.clients = set()
+
+    def write(self, record: dict) -> None:
+        record['time'] = round(time.time(), 3)
+        line = json.dumps(record) + "\n"
+        if self.out:
+            self.out.write(line)
+            self.out.flush()
+        data = line.encode('utf-8')
+        for writer in list(self.clients):
+            if writer.is_closing():
+                self.clients.discard(writer)
+                continue
+            writer.write(data)
+
+    def debug(self, msg: str) -> None:
+        self.write({'type': 'debug', 'msg': msg})
+
+    def emit(self, event) -> None:
+        self.write(event_record(event))
+
+
+class Gateway():
+    """
+    The ports and the control socket that drives them. Every line a client
+    sends is parsed with commandset and gets a 'result' record back, lines
+    without a / are sent over the client's current connection.
+    """
+
+    def __init__(self, sink: JsonSink, ports: Ports):
+        self.sink = sink
+        self.ports = ports
+        self.server = None
+
+    async def start(self, host: str, port: int) -> None:
+        self.server = await asyncio.start_server(self.client, host, port)
+        self.sink.debug(f"Control socket on {host}:{port}")
+
+    async def client(self, reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter) -> None:
+        self.sink.clients.add(writer)
+        # where lines without a / go, (port, call) like NetTerm's connected_to
+        connected_to = None
+        try:
+            while line := await reader.readline():
+                line = line.decode('utf-8', errors='replace').strip()
+                if not line:
+                    continue
+                result = {'type': 'result', 'line': line}
+                try:
+                    command_id, args = commandset.parse(line)
+                    if command_id == commandset.QUIT:
+                        break
+                    if command_id == commandset.SAY:
+                        port, call = connected_to or (None, None)
+                        connection = (port is not None and
+                                      self.ports.nets[port].connections.get(call))
+                        if not connection:
+                            raise CommandError("Not connected, use /connect CALL")
+                        connection.write((args[0] + "\r").encode('utf-8'))
+                        lines = []
+                    elif command_id == commandset.DISCONNECT and not args and connected_to:
+                        # whichever port it's on
+                        port, call = connected_to
+                        lines = await self.ports.nets[port].run_command(command_id, [call])
+                    else:
+                        if command_id == commandset.CONNECT:
+                            connected_to = (self.ports.current, args[0].upper())
+                        lines = await self.ports.run_command(command_id, args)
+                    result.update(ok=True, lines=lines)
+                except CommandError as e:
+                    result.update(ok=False, error=str(e))
+                result['time'] = round(time.time(), 3)
+                writer.write((json.dumps(result) + "\n").encode('utf-8'))
+        except ConnectionError:
+            pass
+        finally:
+            self.sink.clients.discard(writer)
+            writer.close()
+
+    def close(self) -> None:
+        if self.server:
+            self.server.close()
+        self.ports.close()
+
+
+async def main(options) -> None:
+    sink = JsonSink()
+    ports = Ports(sink, options.call.upper())
+    gateway = Gateway(sink, ports)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    try:
+        await gateway.start(options.control_host, options.control_port)
+        if options.tnc:
+            specs = options.tnc
+        elif options.serial:
+            specs = [f"serial:{options.serial}@{options.baudrate}"]
+        else:
+            specs = [f"tcp:{options.host}:{options.port}"]
+        # the TNCs connect, and reconnect, in the background
+        ports.open(specs)
+        await stop.wait()
+    finally:
+        gateway.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run the NetTerm stack headless, controlled over a socket")
+    parser.add_argument("--call", required=True, help="our call sign")
+    parser.add_argument("--host", default="127.0.0.1", help="KISS TCP host")
+    parser.add_argument("--port", type=int, default=8001, help="KISS TCP port")
+    parser.add_argument("--serial", help="KISS serial device, instead of TCP")
+    parser.add_argument("--baudrate", type=int, default=57600)
+    parser.add_argument("--tnc", action="append", metavar="SPEC",
+                        help="a TNC port, HOST:PORT or DEVICE[@BAUDRATE], "
+                             "repeat for more ports, instead of the above")
+    parser.add_argument("--control-host", default=CONTROL_HOST)
+    parser.add_argument("--control-port", type=int, default=CONTROL_PORT)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,176 @@
+import json
+import os
+import time
+from collections import OrderedDict
+
+from modes import MODES
+from packet import Packet
+
+LINK_TTL = 6 * 60 * 60  # seconds before what we know about a station is stale
+LINKS_MAX = 1000        # most stations remembered
+SAVE_INTERVAL = 60      # seconds between saves to disk
+
+
+class Link():
+    """What we know about talking to one station"""
+
+    __slots__ = ('call', 'best_mode', 'rtt', 'loss', 'last_heard', 'updated')
+
+    def __init__(self, call: str, best_mode: str | None = None,
+                 rtt: float | None = None, loss: float | None = None,
+                 last_heard: float | None = None,
+                 updated: float | None = None):
+        self.call = call
+        # the fastest mode known to work and how it went when last measured
+        self.best_mode = best_mode
+        self.rtt = rtt
+        self.loss = loss
+        # wall clock times, so they mean something after a restart
+        self.last_heard = last_heard
+        self.updated = updated or time.time()
+
+    def to_json(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __str__(self) -> str:
+        rtt = f"{self.rtt * 1000:.0f}ms" if self.rtt is not None else "-"
+        loss = f"{self.loss:.0%}" if self.loss is not None else "-"
+        heard = (time.strftime("%H:%M:%S", time.localtime(self.last_heard))
+                 if self.last_heard else "-")
+        return f"{self.call}: {self.best_mode or '-'} rtt {rtt} loss {loss} heard {heard}"
+
+
+def faster(mode_id: str, than: str | None) -> bool:
+    """True if mode_id comes before than in MODES (or than is None)"""
+
+    if than is None:
+        return True
+    order = list(MODES)
+    return order.index(mode_id) < order.index(than)
+
+
+class LinkTable():
+    """
+    Link quality keyed by callsign. Entries expire LINK_TTL seconds after
+    they were last updated, and once there are LINKS_MAX of them the least
+    recently used is evicted. The table is saved to a JSON file so it
+    survives restarts.
+    """
+
+    def __init__(self, path: str, ttl: float = LINK_TTL, size: int = LINKS_MAX):
+        self.path = path
+        self.ttl = ttl
+        self.size = size
+        self.links = OrderedDict()
+        self.load()
+
+    def get(self, call: str) -> Link | None:
+        link = self.links.get(call)
+        if link is None:
+            return None
+        if time.time() - link.updated > self.ttl:
+            del self.links[call]
+            return None
+        self.links.move_to_end(call)
+        return link
+
+    def entry(self, call: str) -> Link:
+        """Gets the Link for call, making a new one if needed"""
+
+        link = self.get(call)
+        if link is None:
+            link = self.links[call] = Link(call)
+            if len(self.links) > self.size:
+                self.links.popitem(last=False)
+        return link
+
+    def best_mode(self, call: str) -> str | None:
+        link = self.get(call)
+        return link.best_mode if link else None
+
+    def heard(self, call: str, mode_id: str) -> None:
+        """
+        Passive update from a frame we received from call while in mode_id.
+        Hearing them tells us the mode works in at least one direction, so
+        it only ever raises best_mode.
+        """
+
+        link = self.entry(call)
+        now = time.time()
+        link.last_heard = now
+        if faster(mode_id, link.best_mode):
+            link.best_mode = mode_id
+            link.updated = now
+
+    def measured(self, call: str, mode_id: str, rtt: float | None,
+                 loss: float | None) -> None:
+        """Active update from TEST probes that made it there and back"""
+
+        link = self.entry(call)
+        link.best_mode = mode_id
+        link.rtt = rtt
+        link.loss = loss
+        link.updated = time.time()
+
+    def failed(self, call: str, mode_id: str) -> None:
+        """mode_id didn't work with call, so it can't be its best mode"""
+
+        link = self.get(call)
+        if link and link.best_mode == mode_id:
+            link.best_mode = None
+            link.updated = time.time()
+
+    def __iter__(self):
+        # copied, as get() reorders the table
+        for call in list(self.links):
+            link = self.get(call)
+            if link:
+                yield link
+
+    def load(self) -> None:
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        for fields in saved:
+            link = Link(**fields)
+            self.links[link.call] = link
+        # drop anything that went stale while we weren't running
+        list(self)
+
+    def save(self) -> None:
+        # write then rename, so a crash can't leave half a file behind
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump([link.to_json() for link in self], f)
+        os.replace(tmp, self.path)
+
+
+class LinkMonitor():
+    """
+    Stack action that passively updates the LinkTable from every frame we
+    receive, and saves it every so often. Runs forever.
+    """
+
+    frame_types = None
+    dst = None
+
+    def __init__(self, sink, net, our_call):
+        self.sink = sink
+        self.net = net
+        self.our_call = our_call
+        self.timer = self.net.scheduler.call_later(SAVE_INTERVAL, self.save)
+
+    def frame_received(self, packet: Packet) -> bool:
+        # frames we sent to ourselves don't tell us anything
+        if packet.src != self.our_call:
+            self.net.links.heard(packet.src, self.net.modes.mode_id)
+        return True
+
+    def save(self) -> None:
+        self.net.links.save()
+        self.timer = self.net.scheduler.call_later(SAVE_INTERVAL, self.save)
+
+    def __str__(self) -> str:
+        return "LinkMonitor()"
@@ -0,0 +1,112 @@
+import time
+
+import transport
+from modes import MODES, DEFAULT_MODE, MODE_TIMEOUT
+
+REMOTE_MAX = 500  # stations remembered before the stale ones are dropped
+
+
+class ModeManager():
+    """
+    Keeps track of the mode the TNC is really in, the mode we want to listen
+    in and the mode each station we've heard or asked to change is
+    listening in. SETHW is only sent when the TNC isn't already in the mode,
+    and the switches and time spent in each mode are counted.
+
+    A station goes back to the default mode MODE_TIMEOUT seconds after it
+    last heard traffic, so that's what we assume once we haven't heard it
+    or sent it anything for that long. Stations we know nothing about are
+    sent to in the listening mode, the same as everything else.
+    """
+
+    def __init__(self, mode_id: str = DEFAULT_MODE):
+        # what the TNC will be in once it's dealt with what it's been sent
+        self.mode_id = mode_id
+        # where the TNC goes back to once there's nothing else to send
+        self.listen = mode_id
+        # call -> (mode_id, monotonic deadline)
+        self.remote = {}
+
+        self.switches = 0
+        self.skipped = 0
+        self.since = time.monotonic()
+        self.time_in = dict.fromkeys(MODES, 0.0)
+
+    def mode_for(self, call: str) -> str:
+        """The mode a frame to call should go out in"""
+
+        known = self.remote.get(call)
+        if known is None:
+            return self.listen
+        mode_id, deadline = known
+        if time.monotonic() > deadline:
+            return DEFAULT_MODE
+        return mode_id
+
+    def station(self, call: str, mode_id: str) -> None:
+        """
+        call is (or has been asked to be) in mode_id, from a frame we heard
+        from it, a frame we sent it or an RMODE
+        """
+
+        now = time.monotonic()
+        self.remote[call] = (mode_id, now + MODE_TIMEOUT)
+        if len(self.remote) > REMOTE_MAX:
+            # a busy channel, forget the stations that have gone quiet
+            self.remote = {call: known for call, known in self.remote.items()
+                           if known[1] > now}
+
+    def sent(self, call: str, mode_id: str) -> None:
+        """
+        We've just sent call a frame in mode_id. Unless it has since been
+        asked to change, that keeps it in mode_id.
+        """
+
+        known = self.remote.get(call)
+        if known is None or known[0] == mode_id:
+            self.station(call, mode_id)
+
+    def listen_in(self, mode_id: str) -> None:
+        """Makes mode_id the mode the TNC goes back to when it's idle"""
+
+        if mode_id == self.mode_id:
+            # the TNC is already there, no need for a SETHW
+            self.skipped += 1
+        self.listen = mode_id
+
+    def switch(self, mode_id: str) -> bytes:
+        """Returns the KISS SETHW frame to put the TNC in mode_id"""
+
+        now = time.monotonic()
+        self.time_in[self.mode_id] += now - self.since
+        self.since = now
+        self.mode_id = mode_id
+        self.switches += 1
+        hw = MODES[mode_id] + 16 # set it temporarily
+        return transport.encode(transport.SET_HARDWARE, hw.to_bytes(1, 'big'))
+
+    def tnc_reset(self) -> None:
+        """
+        We've (re)connected to the TNC, which may have been power cycled, so
+        it could be back in its default mode whatever we last told it
+        """
+
+        now = time.monotonic()
+        self.time_in[self.mode_id] += now - self.since
+        self.since = now
+        self.mode_id = DEFAULT_MODE
+
+    def times(self) -> dict:
+        """Seconds spent in each mode that has been used, up to now"""
+
+        times = dict(self.time_in)
+        times[self.mode_id] += time.monotonic() - self.since
+        return {mode_id: seconds for mode_id, seconds in times.items()
+                if seconds}
+
+    def __str__(self) -> str:
+        times = ", ".join(f"{mode_id} {seconds:.0f}s"
+                          for mode_id, seconds in self.times().items())
+        return (f"ModeManager({self.mode_id}, listening in {self.listen}, "
+                f"{len(self.remote)} stations known, "
+                f"{self.switches} switches, {self.skipped} skipped, {times})")
@@ -0,0 +1,85 @@
+# Modes available as of NinoTNC v3.41 ordered from most to least preferred,
+# with the value SETHW takes for each of them
+MODES = {
+    '19.2K-C4FSK-IL2Pc': 0b0001,
+    '9600-C4SK-IL2Pc':   0b0011,
+    '9600-GFSK-IL2Pc':   0b0010,
+    '9600-GFSK-AX.25':   0b0000,
+    '4800-GFSK-IL2Pc':   0b0100,
+    '3600-AQPSK-IL2Pc':  0b0101,
+    '2400-QPSK-IL2Pc':   0b1011,
+    '1200-BPSK-ILP2Pc':  0b1010,
+    '1200-AFSK-AX.25':   0b0110,
+    '600-QPSK-IL2Pc':    0b1001,
+    '300-BPSK-IP2Pc':    0b1000,
+    '300-AFSK-IL2Pc':    0b1110,
+    '300-AFSK-AX.25':    0b1100,
+}
+
+# the mode the NinoTNC is left in, and how long a requested mode lasts
+# without traffic before we go back to it
+DEFAULT_MODE = '1200-AFSK-AX.25'
+MODE_TIMEOUT = 30
+
+# the other way around, for things (like captures) that store the SETHW value
+MODE_IDS = {value: mode_id for mode_id, value in MODES.items()}
+
+# the raw bitrate of each mode, used to work out how long a frame is on air
+BITRATES = {
+    '19.2K-C4FSK-IL2Pc': 19200,
+    '9600-C4SK-IL2Pc':   9600,
+    '9600-GFSK-IL2Pc':   9600,
+    '9600-GFSK-AX.25':   9600,
+    '4800-GFSK-IL2Pc':   4800,
+    '3600-AQPSK-IL2Pc':  3600,
+    '2400-QPSK-IL2Pc':   2400,
+    '1200-BPSK-ILP2Pc':  1200,
+    '1200-AFSK-AX.25':   1200,
+    '600-QPSK-IL2Pc':    600,
+    '300-BPSK-IP2Pc':    300,
+    '300-AFSK-IL2Pc':    300,
+    '300-AFSK-AX.25':    300,
+}
+
+# keying up the transmitter and the flags/FCS around every frame
+TXDELAY = 0.1
+FRAME_OVERHEAD = 4
+
+
+def airtime(mode_id: str, length: int) -> float:
+    """Seconds a frame of length bytes keeps the channel busy in a mode"""
+    return TXDELAY + (length + FRAME_OVERHEAD) * 8 / BITRATES[mode_id]
+
+# for connections, how many I frames can be outstanding and how much data
+# goes in each of them. Slow modes keep both small so a lost frame doesn't
+# cost much airtime, fast ones fill the window with full frames.
+WINDOW = {
+    '19.2K-C4FSK-IL2Pc': 4,
+    '9600-C4SK-IL2Pc':   4,
+    '9600-GFSK-IL2Pc':   4,
+    '9600-GFSK-AX.25':   4,
+    '4800-GFSK-IL2Pc':   4,
+    '3600-AQPSK-IL2Pc':  4,
+    '2400-QPSK-IL2Pc':   4,
+    '1200-BPSK-ILP2Pc':  3,
+    '1200-AFSK-AX.25':   2,
+    '600-QPSK-IL2Pc':    2,
+    '300-BPSK-IP2Pc':    1,
+    '300-AFSK-IL2Pc':    1,
+    '300-AFSK-AX.25':    1,
+}
+PACLEN = {
+    '19.2K-C4FSK-IL2Pc': 256,
+    '9600-C4SK-IL2Pc':   256,
+    '9600-GFSK-IL2Pc':   256,
+    '9600-GFSK-AX.25':   256,
+    '4800-GFSK-IL2Pc':   256,
+    '3600-AQPSK-IL2Pc':  256,
+    '2400-QPSK-IL2Pc':   256,
+    '1200-BPSK-ILP2Pc':  128,
+    '1200-AFSK-AX.25':   128,
+    '600-QPSK-IL2Pc':    128,
+    '300-BPSK-IP2Pc':    64,
+    '300-AFSK-IL2Pc':    64,
+    '300-AFSK-AX.25':    64,
+}
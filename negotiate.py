@@ -0,0 +1,153 @@
+import time
+
+from modes import MODES, DEFAULT_MODE, MODE_TIMEOUT, airtime
+from probe import PROBE_SIZE
+
+PROBES = 3          # most TEST probes sent in a mode
+PROBES_NEEDED = 2   # replies needed for a mode to count as working
+SETTLE = 1.0        # seconds for the NinoTNC to settle after SETHW
+
+
+class Negotiate():
+    """
+    Stack action that finds the fastest mode that works between us and
+    another station, then leaves both in it.
+
+    MODES is ordered from most to least preferred and we assume that if a
+    mode works, every mode after it works too. Everything from DEFAULT_MODE
+    on is known to work, so we bisect between the best mode not known to
+    fail (lo) and the best mode known to work (hi). For each mode we try, we
+    send RMODE in the mode we both share, switch ourselves over and send TEST
+    probes, stopping as soon as the mode has clearly passed or failed.
+
+    A failed mode is expensive: we can't tell whether the other station got
+    the RMODE, so we go back to DEFAULT_MODE and wait out its MODE_TIMEOUT to
+    be sure it's back there too. That's why we bisect, and why the mode in
+    the LinkTable (if there is one) is tried first: if it still works we
+    stop there rather than probing for anything faster.
+
+    Probes are sent and matched up by the Prober, Negotiate wants no frames
+    and is only on the stack so there's never more than one at a time.
+    """
+
+    frame_types = ()
+
+    def __init__(self, sink, net, our_call, call):
+        self.sink = sink
+        self.net = net
+        self.our_call = our_call
+        self.dst = our_call
+        self.call = call
+
+        self.modes = list(MODES)
+        self.lo = 0
+        self.hi = self.modes.index(DEFAULT_MODE)
+        # the mode both ends are in right now
+        self.common = DEFAULT_MODE
+
+        # the mode being tried and how its probes are going
+        self.trying = None
+        self.sent = 0
+        self.replies = 0
+        self.rtts = []
+
+        # the fastest mode known to work, from the last time we checked
+        self.cached = self.net.links.best_mode(call)
+        if self.cached and not self.lo <= self.modes.index(self.cached) < self.hi:
+            self.cached = None
+
+        self.probes = 0
+        self.started = time.monotonic()
+
+        self.net.scheduler.call_later(0, self.next_mode)
+
+    def next_mode(self) -> None:
+        """Tries the mode halfway between lo and hi, or finishes"""
+
+        if self.lo >= self.hi:
+            self.finish()
+            return
+        if self.cached:
+            self.trying = self.cached
+        else:
+            self.trying = self.modes[(self.lo + self.hi) // 2]
+        self.sent = 0
+        self.replies = 0
+        self.rtts = []
+        self.sink.debug(f"Auto: trying {self.trying} with {self.call}")
+
+        # ask them to switch, in the mode they are listening in, and give
+        # the RMODE time to get out before we switch ourselves
+        self.net.send_rmode_command(self.call, self.trying)
+        delay = airtime(self.common, PROBE_SIZE) + SETTLE
+        self.net.scheduler.call_later(delay, self.switched)
+
+    def switched(self) -> None:
+        self.net.set_mode(self.trying)
+        self.net.scheduler.call_later(SETTLE, self.send_probe)
+
+    def send_probe(self) -> None:
+        self.sent += 1
+        self.probes += 1
+        self.net.prober.probe(self.call, self.probe_done)
+
+    def probe_done(self, rtt: float | None) -> None:
+        """Decides whether the mode passed, failed or needs another probe"""
+
+        if rtt is not None:
+            self.replies += 1
+            self.rtts.append(rtt)
+        if self.replies >= PROBES_NEEDED:
+            rtt = sum(self.rtts) / len(self.rtts)
+            loss = 1 - self.replies / self.sent
+            self.sink.debug(f"Auto: {self.trying} works with {self.call} "
+                           f"({rtt * 1000:.0f}ms, {loss:.0%} loss)")
+            self.hi = self.modes.index(self.trying)
+            self.common = self.trying
+            self.net.links.measured(self.call, self.trying, rtt, loss)
+            if self.cached:
+                # known good and still good, don't go looking for better
+                self.lo = self.hi
+                self.cached = None
+            self.next_mode()
+        elif self.replies + (PROBES - self.sent) < PROBES_NEEDED:
+            self.sink.debug(f"Auto: {self.trying} doesn't work with {self.call}")
+            self.lo = self.modes.index(self.trying) + 1
+            self.cached = None
+            self.net.links.failed(self.call, self.trying)
+            self.fall_back(self.next_mode)
+        else:
+            self.send_probe()
+
+    def fall_back(self, then) -> None:
+        """
+        Goes back to DEFAULT_MODE and waits until the other station must have
+        timed out back to it as well
+        """
+
+        self.net.set_mode(DEFAULT_MODE)
+        self.common = DEFAULT_MODE
+        if self.lo >= self.hi and self.modes[self.hi] == DEFAULT_MODE:
+            # nothing left to try, there's no need to wait
+            then()
+            return
+        self.sink.debug(f"Auto: waiting {MODE_TIMEOUT}s for {self.call} to "
+                       f"go back to {DEFAULT_MODE}")
+        self.net.scheduler.call_later(MODE_TIMEOUT + SETTLE, then)
+
+    def finish(self) -> None:
+        best = self.modes[self.hi]
+        if best != self.common:
+            # a slower mode worked before a faster one failed, go back to it
+            self.net.send_rmode_command(self.call, best)
+            delay = airtime(self.common, PROBE_SIZE) + SETTLE
+            self.common = best
+            self.net.scheduler.call_later(
+                delay, lambda: self.net.set_mode(best))
+        seconds = time.monotonic() - self.started
+        self.sink.debug(f"Auto: using {best} with {self.call}, "
+                       f"{self.probes} probe(s) in {seconds:.0f}s")
+        self.net.remove(self)
+
+    def __str__(self) -> str:
+        return f"Negotiate({self.call}, {self.trying})"
@@ -1,41 +1,111 @@
-import threading
-from textual.message import Message
-from textual.app import App
+import asyncio
+import os
+import time
+from collections import deque
 import ax25
 
-import pyham_kiss.kiss as kiss
-from commands import CommandInput
+import capture
+import commandset
+from channel import ChannelStats
+from commandset import CommandError
+from connection import Connection
+from dedup import Dedup
+from events import (LogFrames, ModeChanged, TncChanged, TNC_CONNECTED,
+                    TNC_DISCONNECTED)
+from links import LinkTable, LinkMonitor
+from modemanager import ModeManager
+from modes import MODES, DEFAULT_MODE, MODE_TIMEOUT
+from negotiate import Negotiate
+from packet import Packet
+from probe import Prober, Sweep
+from scheduler import Scheduler
+from search import SearchIndex
+from stack import Stack
+from stats import Profiler
+from transfer import Transfer, TransferReceive
+from transport import KISSTransport
+from txqueue import TxQueue
 
 UNPROTO_PID = 0xF0
 
-DEFAULT_MODE = '1200-AFSK-AX.25'
-MODE_TIMEOUT = 30
+# where NetTerm keeps things between runs, like the capture of all traffic
+DATA_DIR = os.path.expanduser("~/.netterm")
+CAPTURE_PATH = os.path.join(DATA_DIR, "capture")
+LINKS_PATH = os.path.join(DATA_DIR, "links.json")
+# where files other stations send us go
+RECEIVED_DIR = os.path.join(DATA_DIR, "received")
 
-class LogFrame(Message):
-    """Message for logging a sent/received frame"""
+def links_path(port: int) -> str:
+    """Each port is its own channel, so it has its own LinkTable"""
 
-    def __init__(self, frame: ax25.Frame) -> None:
-        self.frame = frame
-        super().__init__()
+    if port == 0:
+        return LINKS_PATH
+    return os.path.join(DATA_DIR, f"links-{port}.json")
+
+LOG_RATE = 25       # most LogFrames events sent to the sink per second
+LOG_BUFFER = 1000   # most frames waiting to be shown before we drop some
 
 class Log():
     """
-    Stack action that sends LogFrame messages for every frame that comes
-    in and then passes the unchanged frame out. Runs forever.
+    Stack action that logs every frame that comes in and then passes the
+    unchanged frame out. Runs forever.
+
+    Frames are collected and sent to the sink in one LogFrames event at most
+    LOG_RATE times a second. If the UI falls more than LOG_BUFFER frames
+    behind, the oldest ones are not shown. The frames themselves are still
+    passed along the stack, only their rendering is dropped.
     """
 
-    def __init__(self, app):
-        self.app = app
+    # every frame, regardless of type or destination
+    frame_types = None
+    dst = None
 
-    def frame_received(self, frame: ax25.Frame) -> bool:
-        self.app.post_message(LogFrame(frame))
-        return True
+    def __init__(self, sink, net):
+        self.sink = sink
+        self.net = net
+        self.pending = deque(maxlen=LOG_BUFFER)
+        self.timer = None
 
-    def second_passed(self) -> bool:
+        # frames that shared a message with others, and frames never shown
+        self.coalesced = 0
+        self.dropped = 0
+        self.dropped_since_flush = 0
+        self.to_sink = net.profiler.metric("frame to sink")
+
+    def frame_received(self, packet: Packet) -> bool:
+        self.append(packet)
         return True
 
+    def append(self, packet: Packet) -> None:
+        """Queues a frame to be shown, scheduling a flush if needed"""
+
+        if len(self.pending) == LOG_BUFFER:
+            # the deque drops the oldest frame for us
+            self.dropped += 1
+            self.dropped_since_flush += 1
+        self.pending.append(packet)
+        if self.timer is None:
+            self.timer = self.net.scheduler.call_later(1 / LOG_RATE,
+                                                       self.flush)
+
+    def flush(self) -> None:
+        """Sends everything pending to the sink as one event"""
+
+        self.timer = None
+        packets = list(self.pending)
+        self.pending.clear()
+        self.coalesced += len(packets) - 1
+        self.sink.emit(LogFrames(packets, self.dropped_since_flush,
+                                 self.net.port))
+        self.dropped_since_flush = 0
+        # how long received frames took to get this far
+        now = time.perf_counter_ns()
+        for packet in packets:
+            if packet.received:
+                self.to_sink.add(now - packet.received)
+
     def __str__(self):
-        return f"Log()"
+        return f"Log({self.coalesced} coalesced, {self.dropped} dropped)"
 
 class TestReply():
     """
@@ -43,22 +113,18 @@ class TestReply():
     frame. Runs forever.
     """
 
-    def __init__(self, app, net, our_call):
-        self.app = app
+    frame_types = (ax25.FrameType.TEST,)
+
+    def __init__(self, sink, net, our_call):
+        self.sink = sink
         self.net = net
         self.our_call = our_call
+        self.dst = our_call
 
-    def frame_received(self, frame: ax25.Frame) -> bool:
-        control = frame.control
-        frame_type = control.frame_type
-        poll_final = control.poll_final
-        dst = frame.dst
-        if frame_type == ax25.FrameType.TEST and poll_final and str(dst) == self.our_call:
-            self.app.debug(f"{self} sending reponse to TEST frame")
-            self.net.send_test_response(frame)
-        return True
-
-    def second_passed(self) -> bool:
+    def frame_received(self, packet: Packet) -> bool:
+        if packet.poll_final:
+            self.sink.debug(f"{self} sending reponse to TEST frame")
+            self.net.send_test_response(packet)
         return True
 
     def __str__(self):
@@ -66,32 +132,51 @@ class TestReply():
 
 class Mode():
     """
-    Stack action that temporarily changes the mode
+    Stack action that temporarily changes the mode. Any traffic pushes the
+    timeout back and once there has been none for the given number of
+    seconds, the TNC goes back to the default mode.
     """
 
-    def __init__(self, app, net, mode_id, seconds):
-        self.app = app
+    # any traffic keeps the mode alive
+    frame_types = None
+    dst = None
+
+    def __init__(self, sink, net, mode_id, seconds):
+        self.sink = sink
         self.net = net
         self.mode_id = mode_id
         self.seconds = seconds
-        self.seconds_left = seconds
 
         self.net.set_hw_mode(mode_id)
 
-    def frame_received(self, frame: ax25.Frame) -> bool:
-        self.seconds_left = self.seconds
+        self.deadline = time.monotonic() + seconds
+        self.timer = self.net.scheduler.call_at(self.deadline, self.timed_out)
+
+    def frame_received(self, packet: Packet) -> bool:
+        # NOTE: We only move the deadline here, timed_out() reschedules
+        #       itself if the deadline moved, so busy channels don't churn
+        #       the scheduler.
+        self.deadline = time.monotonic() + self.seconds
         return True
 
-    def second_passed(self) -> bool:
-        self.seconds_left -= 1
-        if self.seconds_left > 0:
-            return True
-        self.app.debug("Mode timed out")
+    def timed_out(self) -> None:
+        now = time.monotonic()
+        if now < self.deadline:
+            self.timer = self.net.scheduler.call_at(self.deadline,
+                                                    self.timed_out)
+            return
+        self.sink.debug("Mode timed out")
         self.net.set_hw_mode(DEFAULT_MODE)
-        return False
+        self.net.remove(self)
+
+    def cancel(self) -> None:
+        """Stops the timeout, used when the Mode is removed early"""
+
+        self.net.scheduler.cancel(self.timer)
 
     def __str__(self) -> str:
-        return f"Mode({self.mode_id}, {self.seconds}, {self.seconds_left})"
+        seconds_left = max(0, int(self.deadline - time.monotonic()))
+        return f"Mode({self.mode_id}, {self.seconds}, {seconds_left})"
 
 class ModeAdjust():
     """
@@ -99,36 +184,28 @@ class ModeAdjust():
     indefinitely.
     """
 
-    def __init__(self, app, net, our_call):
-        self.app = app
+    frame_types = (ax25.FrameType.UI,)
+
+    def __init__(self, sink, net, our_call):
+        self.sink = sink
         self.net = net
         self.our_call = our_call
+        self.dst = our_call
 
-    def frame_received(self, frame: ax25.Frame) -> bool:
-        control = frame.control
-        frame_type = control.frame_type
-        poll_final = control.poll_final
-        dst = frame.dst
-        data = frame.data.decode('utf-8', errors='replace')
-        if (frame_type == ax25.FrameType.UI and poll_final and
-            str(dst) == self.our_call and data[:6] == "RMODE "):
-
+    def frame_received(self, packet: Packet) -> bool:
+        if not packet.poll_final:
+            return True
+        data = packet.text
+        if data[:6] == "RMODE ":
             mode_id = data[6:]
-            self.app.debug(f"Received RMODE {mode_id} command")
-            if mode_id not in CommandInput.MODES:
-                self.app.debug("Invalid mode ID")
+            self.sink.debug(f"Received RMODE {mode_id} command")
+            if mode_id not in MODES:
+                self.sink.debug("Invalid mode ID")
+            elif self.net.connections:
+                # switching would cut off everyone we're connected to
+                self.sink.debug("Not changing mode while connected")
             else:
-                # Remove any other Modes in our stack
-                # TODO: When connections are implemented don't switch mode if
-                # there's a connection in the stack
-                for stack_action in list(self.net.stack):
-                    if type(stack_action) == Mode:
-                        self.net.stack.remove(stack_action)
-                # Put a Mode (which is temporary) on the stack
-                self.net.stack.append(Mode(self.app, self.net, mode_id, MODE_TIMEOUT))
-        return True
-
-    def second_passed(self) -> bool:
+                self.net.set_mode(mode_id)
         return True
 
     def __str__(self) -> str:
@@ -137,113 +214,351 @@ class ModeAdjust():
 class ConnectReply():
     """
     Stack action that waits for connection requests and starts connections
-    if possible
+    if possible. Runs forever.
     """
 
-    def __init__(self, app: App, net: Net, our_call: str):
-        self.app = app
+    frame_types = (
+        ax25.FrameType.SABM,
+        ax25.FrameType.SABME,
+        ax25.FrameType.DISC,
+    )
+
+    def __init__(self, sink, net: 'Net', our_call: str):
+        self.sink = sink
         self.net = net
         self.our_call = our_call
+        self.dst = our_call
 
-    def frame_received(self, frame: ax25.Frame):
-        control = frame.control
-        frame_type = control.frame_type
-        poll_final = control.poll_final
-        dst = frame.dst
-        if (frame_type == ax25.FrameType.SABM and poll_final and
-            str(dst) == self.our_call):
-            self.app.debug("Responding to connection request")
-            ua_control = ax25.Control(ax25.FrameType.UA, poll_final=False)
-            frame = ax25.Frame(dst, self.our_call, control=control)
-            self.net.send(frame)
-
-    def second_passed(self) -> bool:
+    def frame_received(self, packet: Packet) -> bool:
+        if packet.src in self.net.connections:
+            # the Connection deals with it
+            return True
+        if packet.frame_type == ax25.FrameType.SABM:
+            self.sink.debug(f"Accepting connection from {packet.src}")
+            self.net.accept(packet.src, packet.poll_final)
+        else:
+            # we can't do modulo 128, a DM tells them to try SABM instead,
+            # and a DISC for a connection we don't have is answered the same
+            control = ax25.Control(ax25.FrameType.DM,
+                                   poll_final=packet.poll_final)
+            self.net.send(ax25.Frame(packet.src, self.our_call,
+                                     control=control))
         return True
 
     def __str__(self) -> str:
         return f"ConnectReply()"
 
 
-class Net():
-    """Additional AX.25 networking for NetTerm"""
-
-    def __init__(self, app, our_call):
-        self.our_call = our_call
-        self.app = app
+# the stack actions a replay goes through, the ones that only answer or
+# log frames
+REPLAYED = (Log, TestReply, Prober)
 
-        def data_received(kiss_port, data):
-            """
-            This WILL run in another thread. Use messages to communicate
-            with the app.
-            """
 
-            #TODO: catch ax25 exceptions
-            frame = ax25.Frame.unpack(data)
-            self.frame_received(frame)
+class Net():
+    """
+    Additional AX.25 networking for NetTerm. Everything it has to say goes
+    to sink (see sink.py), so it runs the same under the UI and headless.
+    """
 
-        self.connection = kiss.Connection(data_received)
-        #net.connection.connect_to_serial()
-        self.connection.connect_to_server("127.0.0.1", 8001)
-        app.debug("Connected to TNC")
+    def __init__(self, sink, our_call, port: int = 0, scheduler=None,
+                 capture_writer=None, profiler=None, search_index=None):
+        self.our_call = our_call
+        self.sink = sink
+        # which of our TNCs this is, see ports.py. The scheduler, capture,
+        # search index and profiler can be shared with the Nets for the
+        # others.
+        self.port = port
+
+        # set to True to trace every stack action a frame is passed to
+        self.trace = False
+
+        # where the time goes, cheap enough to leave on
+        self.profiler = profiler or Profiler()
+        self.data_metric = self.profiler.metric("Net.data_received")
+        self.stack_metric = self.profiler.metric("Net.frame_received")
+
+        # stack actions register their deadlines here, the callbacks are run
+        # on the event loop with everything else
+        if scheduler is None:
+            loop = asyncio.get_running_loop()
+            scheduler = Scheduler(sink, loop.call_soon_threadsafe,
+                                  self.profiler)
+        self.scheduler = scheduler
+
+        self.connection = KISSTransport(self.data_received)
+        self.receiver = None
+
+        # the mode we want to listen in, we assume the TNC starts in the
+        # default. The mode it is really in, and the mode each frame goes out
+        # in, is up to the ModeManager.
+        self.hw_mode = DEFAULT_MODE
+        self.modes = ModeManager(DEFAULT_MODE)
+
+        # rolling rates for the dashboard
+        self.channel = ChannelStats(self.modes)
+
+        # frames wait here for their turn on the air
+        self.txqueue = TxQueue(self, self.connection, self.modes)
+
+        # while True frames are logged but not transmitted, used for replays
+        self.muted = False
+
+        # every frame that goes through the TNC is kept on disk
+        os.makedirs(DATA_DIR, exist_ok=True)
+        self.capture = capture_writer or capture.CaptureWriter(CAPTURE_PATH)
+        # and indexed as it's captured, for /find
+        self.search = search_index or SearchIndex(CAPTURE_PATH,
+                                                  self.capture.session_start)
+        # and read back through this, see reader()
+        self.past = None
+
+        # copies of frames we've already heard never reach the stack
+        self.dedup = Dedup()
+
+        # what we know about each station we've heard or measured
+        self.links = LinkTable(links_path(port))
+
+        # the Connection (also on the stack) for each station we're
+        # connected to, by callsign
+        self.connections = {}
 
         # setup the initial stack
-        self.stack = [
-            Log(app),
-            TestReply(app, self, our_call),
-            ModeAdjust(app, self, our_call),
-            ConnectReply(app, self, our_call),
-        ]
-
-        # start the timer
-        t = threading.Timer(1.0, self.second_passed)
-        t.daemon = True
-        t.start()
-
-    def second_passed(self):
+        self.log = Log(sink, self)
+        self.prober = Prober(sink, self, our_call)
+        self.stack = Stack([
+            self.log,
+            TestReply(sink, self, our_call),
+            self.prober,
+            ModeAdjust(sink, self, our_call),
+            ConnectReply(sink, self, our_call),
+            LinkMonitor(sink, self, our_call),
+            TransferReceive(sink, self, our_call, RECEIVED_DIR),
+        ])
+
+    async def connect_to_server(self, host: str, port: int) -> None:
+        """Connects to a TNC over TCP and starts receiving frames"""
+
+        await self.connection.connect_to_server(host, port)
+        self.tnc_connected()
+
+    async def connect_to_serial(self, device: str, baudrate: int = 57600) -> None:
+        """Connects to a TNC on a serial port and starts receiving frames"""
+
+        await self.connection.connect_to_serial(device, baudrate)
+        self.tnc_connected()
+
+    def tnc_connected(self) -> None:
+        self.sink.debug("Connected to TNC")
+        self.sink.emit(TncChanged(TNC_CONNECTED, self.port))
+        # it may have been power cycled while we were away, in which case
+        # it's back in its default mode and the TxQueue has to put it back
+        self.modes.tnc_reset()
+        self.start_receiving()
+        self.txqueue.schedule()
+
+    @property
+    def receiving(self) -> bool:
+        """True while we're connected to the TNC and reading from it"""
+        return self.receiver is not None and not self.receiver.done()
+
+    def start_receiving(self) -> None:
+        self.receiver = asyncio.create_task(self.connection.receive())
+        self.receiver.add_done_callback(self.receiving_stopped)
+
+    def receiving_stopped(self, receiver: asyncio.Task) -> None:
+        # cancelled means we're shutting down, not that the TNC went away
+        if not receiver.cancelled():
+            error = receiver.exception()
+            self.sink.debug(f"Disconnected from TNC{f': {error}' if error else ''}")
+            self.sink.emit(TncChanged(TNC_DISCONNECTED, self.port))
+
+    def data_received(self, kiss_port: int, data: bytes) -> None:
         """
-        Every second runs second_passed() for each stack action in the stack,
-        removing stack actions that do not return True.
+        Called by the transport on the event loop for every frame from the
+        TNC.
         """
 
-        # NOTE: We're working on a COPY of the stack so we can remove things
-        #       as we iterate.
-        for stack_action in list(self.stack):
-            if not stack_action.second_passed():
-                self.stack.remove(stack_action)
+        received = time.perf_counter_ns()
+        try:
+            packet = Packet.unpack(data)
+        except (ValueError, IndexError):
+            # keep it in the capture anyway, it might be useful later
+            self.capture.write(capture.RX, self.port, self.modes.mode_id, data)
+            self.sink.debug("Received a frame that couldn't be decoded")
+            return
+        packet.received = received
+        offset = self.capture.write(capture.RX, self.port, self.modes.mode_id,
+                                    data, packet.src, packet.dst)
+        self.search.add(packet, offset, time.time())
+        self.channel.frame(packet, self.modes.mode_id, len(data))
+        # we could only hear them if they're in the mode we're in
+        self.modes.station(packet.src, self.modes.mode_id)
+        # a digipeated copy would be logged and acted on twice, a repeated
+        # RMODE would even send another SETHW
+        if self.dedup.duplicate(packet):
+            if self.trace:
+                self.sink.debug(f"Dropping duplicate {packet.tnc2}")
+            return
+        self.frame_received(packet)
+        self.data_metric.add(time.perf_counter_ns() - received)
 
-        # schedule yourself to run in another second (yes, this will drift)
-        t = threading.Timer(1.0, self.second_passed)
-        t.daemon = True
-        t.start()
+    async def replay(self, path: str) -> int:
+        """
+        Feeds every received frame in a capture through the stack as fast as
+        it can, returning how many there were. Nothing is transmitted while
+        a replay runs.
 
-    def frame_received(self, frame):
+        Only the stack actions in REPLAYED see the frames. The rest keep
+        state about the stations we hear, connections, transfers and modes,
+        and frames from another time mustn't change any of that.
         """
-        Runs the frame_recieved() in each stack action and remove it if it
-        doesn't return True.
+
+        replay = capture.Capture(path)
+        stack = Stack(stack_action for stack_action in self.stack
+                      if type(stack_action) in REPLAYED)
+        count = 0
+        self.muted = True
+        try:
+            for record in replay.records():
+                if record.direction != capture.RX:
+                    continue
+                try:
+                    packet = Packet.unpack(record.data)
+                except (ValueError, IndexError):
+                    continue
+                self.frame_received(packet, stack)
+                count += 1
+                # let the UI breathe every so often
+                if count % 500 == 0:
+                    await asyncio.sleep(0)
+        finally:
+            self.muted = False
+            replay.close()
+        return count
+
+    def push(self, stack_action) -> int:
+        """Adds a stack action to the top of the stack, returning its handle"""
+
+        return self.stack.push(stack_action)
+
+    def remove(self, stack_action) -> None:
+        """Removes a stack action from the stack"""
+
+        self.stack.remove(self.stack.handle_of[stack_action])
+
+    def frame_received(self, packet: Packet, stack: Stack | None = None) -> None:
+        """
+        Runs the frame_recieved() in each stack action that wants this packet
+        and removes it if it doesn't return True. That's on our stack unless
+        another stack is given.
         """
-       
-        # NOTE: We're working on a COPY of the stack so we can remove things
-        #       as we iterate.
-        for stack_action in list(self.stack):
-            self.app.debug(f"Passing frame to {stack_action}")
-            result = stack_action.frame_received(frame)
-            if not result:
-                self.stack.remove(stack_action)
+
+        perf_counter_ns = time.perf_counter_ns
+        start = then = perf_counter_ns()
+        action_metric = self.profiler.action
+        # NOTE: A snapshot, so stack actions pushed or removed by the ones
+        #       we run only see the frames after this one.
+        if stack is None:
+            stack = self.stack
+        for stack_action in stack.dispatch(packet.frame_type, packet.dst):
+            if self.trace:
+                self.sink.debug(f"Passing frame to {stack_action}")
+            keep = stack_action.frame_received(packet)
+            # each stack action's time starts where the last one's ended
+            now = perf_counter_ns()
+            action_metric(stack_action).add(now - then)
+            then = now
+            if not keep:
+                stack.remove(stack.handle_of[stack_action])
                 break
+        self.stack_metric.add(then - start)
+
+    def send(self, frame: ax25.Frame, priority: int | None = None) -> None:
+        """
+        Logs and queues a frame to be sent, by default at a priority that
+        depends on its type (see txqueue.priority_for)
+        """
 
-    def send(self, frame: ax25.Frame) -> None:
-        """Logs and sends a frame"""
+        packet = Packet(frame)
 
         # log the frame
-        self.app.post_message(LogFrame(frame))
+        self.log.append(packet)
 
         # if the frame is addressed to ourselves, cut out the TNC
-        if str(frame.dst) == self.our_call:
-            self.frame_received(frame)
+        if packet.dst == self.our_call:
+            self.frame_received(packet)
+            return
+
+        if self.muted:
             return
 
         # otherwise send it out via the TNC
-        self.connection.send_data(frame.pack())
+        self.txqueue.send(packet, priority)
+
+    def reader(self) -> capture.Capture:
+        """
+        The capture, to read back. It's opened once, and flushed first so
+        everything written so far is there. Raises OSError or ValueError if
+        it can't be read.
+        """
+
+        self.capture.flush()
+        if self.past is None:
+            self.past = capture.Capture(CAPTURE_PATH)
+        return self.past
+
+    def catch_up(self, behind: list) -> asyncio.Future:
+        """Indexes traffic from earlier sessions the search index lacks"""
+
+        if self.search.catching_up is None:
+            self.sink.debug("Indexing traffic from earlier sessions")
+            self.search.catch_up(behind).add_done_callback(self.caught_up)
+        return self.search.catching_up
+
+    def caught_up(self, task: asyncio.Future) -> None:
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            self.sink.debug(f"Couldn't index earlier traffic: "
+                            f"{task.exception()}")
+        elif task.result():
+            self.sink.debug(f"Indexed {task.result()} frame(s) from earlier "
+                            f"sessions")
+
+    def history(self, call: str, limit: int) -> list:
+        """
+        Records to or from call from earlier sessions, the last limit of them,
+        looked up in the search index. Traffic it hasn't caught up with yet
+        is left out, and catching up starts in the background so it's there
+        the next time (see search.catching_up).
+        """
+
+        try:
+            past = self.reader()
+            behind = self.search.behind(past)
+            if behind:
+                self.catch_up(behind)
+            return self.search.history(past, call, limit,
+                                       self.capture.session_start)
+        except (OSError, ValueError) as e:
+            self.sink.debug(f"Couldn't read the capture: {e}")
+            return []
+
+    async def find(self, query: str) -> list:
+        """
+        The newest frames in the capture that match query (see search.py),
+        as (record, packet), oldest first. Raises CommandError if the query
+        doesn't make sense.
+        """
+
+        try:
+            past = self.reader()
+            behind = self.search.behind(past)
+            if behind:
+                await asyncio.shield(self.catch_up(behind))
+            return self.search.find(past, query)
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
 
     def send_test_command(self, dst_call: str, data: str) -> None:
         """Sends out a test command"""
@@ -253,13 +568,13 @@ class Net():
                            pid=UNPROTO_PID, data=data.encode('utf-8'))
         self.send(frame)
 
-    def send_test_response(self, command_frame: ax25.Frame) -> None:
-        """Sends out a test response with the data in the command_frame"""
+    def send_test_response(self, command: Packet) -> None:
+        """Sends out a test response with the data in the command packet"""
 
         control = ax25.Control(ax25.FrameType.TEST, poll_final=False)
-        response_frame = ax25.Frame(command_frame.src, self.our_call,
+        response_frame = ax25.Frame(command.src, self.our_call,
                                     control=control, pid=UNPROTO_PID,
-                                    data=command_frame.data)
+                                    data=command.data)
         self.send(response_frame)
 
     def send_rmode_command(self, dst_call: str, mode_id: str) -> None:
@@ -272,14 +587,161 @@ class Net():
                            pid=UNPROTO_PID,
                            data=f"RMODE {mode_id}".encode('utf-8'))
         self.send(frame)
+        # frames sent to them from now on go in the new mode
+        self.modes.station(dst_call.upper(), mode_id)
+
+    def connect(self, call: str) -> Connection:
+        """Connects to call, unless we already are"""
+
+        call = call.upper()
+        connection = self.connections.get(call)
+        if connection is None:
+            connection = self.connections[call] = Connection(
+                self.sink, self, self.our_call, call)
+            self.push(connection)
+            connection.open()
+        return connection
+
+    def accept(self, call: str, poll: bool) -> Connection:
+        """Takes up a connection call asked for"""
+
+        connection = self.connections[call] = Connection(
+            self.sink, self, self.our_call, call)
+        self.push(connection)
+        connection.accept(poll)
+        return connection
+
+    def disconnect(self, call: str) -> None:
+        connection = self.connections.get(call.upper())
+        if connection:
+            connection.close()
+
+    async def run_command(self, command_id: str, args: list) -> list:
+        """
+        Runs a command from commandset that has already been parsed,
+        returning the lines it has to show. Raises CommandError if it can't
+        be run. QUIT and SAY are up to whoever is driving us.
+        """
+
+        if command_id == commandset.AUTO:
+            # one at a time, they'd fight over the mode
+            if self.stack.of_type(Negotiate):
+                raise CommandError("Already negotiating a mode")
+            self.push(Negotiate(self.sink, self, self.our_call, args[0]))
+        elif command_id == commandset.CONNECT:
+            self.connect(args[0])
+        elif command_id == commandset.DASH:
+            return self.channel.lines()
+        elif command_id == commandset.DISCONNECT:
+            if not args:
+                raise CommandError("Not connected")
+            self.disconnect(args[0])
+        elif command_id == commandset.FIND:
+            found = await self.find(" ".join(args))
+            return [f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record.time))} "
+                    f"{packet.tnc2}" for record, packet in found] or [
+                        "Nothing found"]
+        elif command_id == commandset.LINKS:
+            return [str(link) for link in self.links]
+        elif command_id == commandset.MODE:
+            self.set_hw_mode(args[0])
+        elif command_id == commandset.QUEUE:
+            return [str(self.txqueue), str(self.modes), str(self.dedup)]
+        elif command_id == commandset.REPLAY:
+            path = commandset.capture_path(args[0])
+            self.sink.debug(f"Replaying {path}")
+            try:
+                count = await self.replay(path)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Couldn't replay {args[0]}: {e}")
+            return [f"Replayed {count} frame(s) from {path}"]
+        elif command_id == commandset.RMODE:
+            call = args[0]
+            if len(args) > 1:
+                mode_id = args[1]
+            else:
+                mode_id = self.links.best_mode(call)
+                if not mode_id:
+                    raise CommandError(f"No known mode for {call}, try /auto {call}")
+            self.send_rmode_command(call, mode_id)
+        elif command_id == commandset.SEND:
+            try:
+                transfer = Transfer(self.sink, self, self.our_call,
+                                    args[0].upper(), args[1])
+            except OSError as e:
+                raise CommandError(f"Couldn't read {args[1]}: {e}")
+            self.push(transfer)
+            return [f"Offering {transfer.name} ({transfer.size} bytes) to "
+                    f"{transfer.call}"]
+        elif command_id == commandset.STATS:
+            lines = self.profiler.lines()
+            if args:
+                try:
+                    self.profiler.export(args[0])
+                except OSError as e:
+                    raise CommandError(f"Couldn't save to {args[0]}: {e}")
+                lines.append(f"Saved to {args[0]}")
+            return lines
+        elif command_id == commandset.SWEEP:
+            if not args:
+                return self.prober.lines() or ["No probes sent yet"]
+            Sweep(self.sink, self, args)
+        elif command_id == commandset.TEST:
+            call = args[0].upper()
+
+            def done(rtt: float | None) -> None:
+                if rtt is None:
+                    self.sink.debug(f"TEST to {call} lost")
+                else:
+                    self.sink.debug(f"TEST to {call} came back in "
+                                    f"{rtt * 1000:.0f}ms")
+            self.prober.probe(call, done)
+        elif command_id == commandset.TRACE:
+            self.trace = not self.trace
+            return [f"Stack tracing {'on' if self.trace else 'off'}"]
+        else:
+            raise CommandError(f"{command_id} can't be run here")
+        return []
+
+    def mode_for(self, call: str) -> str:
+        """The fastest mode known to work with call"""
+
+        return self.links.best_mode(call) or DEFAULT_MODE
+
+    def close(self) -> None:
+        """Saves everything that outlives this session"""
+
+        self.links.save()
+        self.capture.flush()
+        self.search.save()
+        if self.past is not None:
+            self.past.close()
+
+    def set_mode(self, mode_id: str) -> None:
+        """
+        Puts the TNC in a mode until there has been no traffic for
+        MODE_TIMEOUT seconds, replacing any Mode already on the stack
+        """
+
+        # Remove any other Modes in our stack
+        for stack_action in self.stack.of_type(Mode):
+            stack_action.cancel()
+            self.remove(stack_action)
+        if mode_id == DEFAULT_MODE:
+            self.set_hw_mode(mode_id)
+            return
+        # Put a Mode (which is temporary) on the stack
+        self.push(Mode(self.sink, self, mode_id, MODE_TIMEOUT))
 
     def set_hw_mode(self, mode_id: str) -> None:
         """
         Uses the SETHW command to temporarily change the mode on a NinoTNC
         """
 
-        # FIXME: could we have threading issues with this app access?
-        hw = CommandInput.MODES[mode_id] + 16 # set it temporarily
-        self.app.debug(f"Setting mode to {mode_id}")
-        self.connection.set_hardware(int(hw).to_bytes(1,'big'))
-        self.app.sub_title = mode_id
+        if self.muted:
+            return
+        self.hw_mode = mode_id
+        self.sink.emit(ModeChanged(mode_id, self.port))
+        self.sink.debug(f"Setting mode to {mode_id}")
+        # frames already queued still go out in the old mode
+        self.txqueue.set_mode(mode_id)
@@ -1,46 +1,132 @@
+import time
+from typing import TYPE_CHECKING
+
 from textual.app import App, ComposeResult
 from textual.widgets import Footer, Header, ListView
 from textual.containers import VerticalGroup, HorizontalGroup, VerticalScroll
 from textual.message import Message
-import ax25 
 
-import pyham_kiss.kiss as kiss
-from net import Net, LogFrame
+from commandset import CommandError
+from events import (ConnectionChanged, ConnectionData, LogFrames, ModeChanged,
+                    TncChanged, TNC_CONNECTED, TNC_CONNECTING)
+from sink import Sink
 from views import View, ViewList
 from commands import CommandInput, CommandMessage
 
+if TYPE_CHECKING:
+    # only for the annotations, packet (and ax25) are imported after the
+    # first paint
+    from packet import Packet
+
+# lines from earlier sessions put in a new callsign view
+HISTORY_LINES = 100
+# most times a second the dashboard is redrawn, only while it's shown
+DASH_RATE = 1
+
+
+class NetEvent(Message):
+    """Carries an event from Net (see events.py) to the UI"""
+
+    def __init__(self, event) -> None:
+        self.event = event
+        super().__init__()
+
+
+class UISink(Sink):
+    """
+    Sends debug output to the debug view and events to the app as
+    NetEvent messages
+    """
+
+    def __init__(self, app: 'NetTerm'):
+        self.app = app
+
+    def debug(self, msg: str) -> None:
+        self.app.debug(msg)
+
+    def emit(self, event) -> None:
+        self.app.post_message(NetEvent(event))
+
 
 class NetTerm(App):
     """A TUI Python Terminal for TNCs"""
 
     CSS_PATH = "nt.tcss"
 
+    # set up once the UI is ready
+    ports = None
+
+    # where lines typed without a / go, (port, call)
+    connected_to = None
+
+    # how many /find views have been opened
+    finds = 0
+
+    @property
+    def net(self):
+        """The Net for the port commands go to"""
+        return self.ports.net
+
     def debug(self, msg: str) -> None:
         self.view.write("debug", msg)
 
-    async def on_log_frame(self, lf: LogFrame) -> None:
-        frame = lf.frame
+    async def on_net_event(self, msg: NetEvent) -> None:
+        event = msg.event
+        if type(event) == LogFrames:
+            await self.on_log_frames(event)
+        elif type(event) == ConnectionData:
+            await self.on_connection_data(event)
+        elif type(event) == ConnectionChanged:
+            await self.on_connection_changed(event)
+        elif type(event) == ModeChanged:
+            self.show_status()
+        elif type(event) == TncChanged:
+            self.port_states[event.port] = event.state
+            self.show_status()
+
+    def show_status(self) -> None:
+        """Puts each port's mode in the header, and its TNC if it's not there"""
+
+        status = []
+        for port, net in self.ports.nets.items():
+            state = self.port_states.get(port, TNC_CONNECTING)
+            text = net.hw_mode if state == TNC_CONNECTED else f"{net.hw_mode} (TNC {state})"
+            status.append(text if len(self.ports.nets) == 1 else f"{port}:{text}")
+        self.sub_title = " ".join(status)
+
+    async def on_log_frames(self, lf: LogFrames) -> None:
+        start = time.perf_counter_ns()
+        if lf.dropped:
+            self.view.write("all", f"[red]{lf.dropped} frame(s) not shown to keep up[/]")
+        # with more than one port, say which one each frame was on
+        prefix = f"[{lf.port}] " if len(self.ports.nets) > 1 else ""
+        for packet in lf.packets:
+            await self.log_packet(packet, prefix)
+        self.log_metric.add(time.perf_counter_ns() - start)
+
+    async def log_packet(self, packet: 'Packet', prefix: str = "") -> None:
+        src = packet.src
+        dst = packet.dst
         # make a list of views this frame will be written to, creating as needed
 
         # each call should have their own view
+        for call in (src, dst):
+            await self.call_view(call)
         view_list = {
-            (f"call-{frame.src}", f"Traffic to/from {frame.src}", f"{frame.src}"),
-            (f"call-{frame.dst}", f"Traffic to/from {frame.dst}", f"{frame.dst}"),
+            (f"call-{src}", f"Traffic to/from {src}", f"{src}"),
+            (f"call-{dst}", f"Traffic to/from {dst}", f"{dst}"),
         }
-        for (view_id, view_name, list_name) in view_list:
-            if not self.view.exists(view_id):
-                await self.append_view(view_id, view_name, list_name) 
 
         # the conversation should have a view, either src-dst or dst-src
         src_first = (
-            f"call-{frame.src}-call-{frame.dst}",
-            f"Traffic between {frame.src} and {frame.dst}",
-            f"{frame.src} {frame.dst}",
+            f"call-{src}-call-{dst}",
+            f"Traffic between {src} and {dst}",
+            f"{src} {dst}",
         )
         dst_first = (
-            f"call-{frame.dst}-call-{frame.src}",
-            f"Traffic between {frame.dst} and {frame.src}",
-            f"{frame.dst} {frame.src}",
+            f"call-{dst}-call-{src}",
+            f"Traffic between {dst} and {src}",
+            f"{dst} {src}",
         )
         if self.view.exists(src_first[0]):
             view_list.add(src_first)
@@ -51,46 +137,80 @@ class NetTerm(App):
                 await self.append_view(src_first[0], src_first[1], src_first[2])
                 view_list.add(src_first)
 
-        # create the TNC 2 style message we print
-        # https://raw.githubusercontent.com/wb2osz/aprsspec/main/Understanding-APRS-Packets.pdf
-        # https://wiki.oarc.uk/packet:reading_traces
-
-        # src, dst, and repeaters
-        msg = f"{frame.src}>{frame.dst}"
-        if frame.via:
-            for repeater in frame.via:
-                msg += f",{repeater}"
-
-        # control information
-        control = frame.control
-        if control.frame_type == ax25.FrameType.RR:
-            frame_type = "RR"
-        elif control.frame_type == ax25.FrameType.RNR:
-            frame_type = "RNR"
-        elif control.frame_type == ax25.FrameType.REJ:
-            frame_type = "REJ"
-        elif control.frame_type == ax25.FrameType.SREJ:
-            frame_type = "SREJ"
-        elif control.frame_type == ax25.FrameType.TEST:
-            frame_type = "TEST"
-        elif control.frame_type == ax25.FrameType.UI:
-            frame_type = "UI"
-        else:
-            frame_type = ""
-        poll_final = "P" if control.poll_final else "F"
-        msg += f" <{frame_type} {poll_final}>"
+        # store the TNC 2 style line once for every applicable view
+        view_ids = [view_id for view_id, view_name, list_name in view_list]
+        view_ids.append("all")
+        self.view.write_many(view_ids, prefix + packet.tnc2)
+        if packet.received:
+            self.to_ui.add(time.perf_counter_ns() - packet.received)
+
+    async def call_view(self, call: str) -> str:
+        """Returns the view for a callsign, creating it if needed"""
+
+        view_id = f"call-{call}"
+        if not self.view.exists(view_id):
+            await self.append_view(view_id, f"Traffic to/from {call}", call)
+            self.load_history(view_id, call)
+        return view_id
+
+    async def on_connection_data(self, cd: ConnectionData) -> None:
+        view_id = await self.call_view(cd.call)
+        text = cd.data.decode('utf-8', errors='replace')
+        for line in text.splitlines():
+            self.view.write(view_id, f"[bold]{cd.call}:[/] {line}")
+
+    async def on_connection_changed(self, cc: ConnectionChanged) -> None:
+        from connection import CONNECTED, DISCONNECTED
+
+        view_id = await self.call_view(cc.call)
+        self.view.write(view_id, f"[yellow]*** {cc.state} {cc.call}[/]")
+        if cc.state == CONNECTED:
+            self.connected_to = (cc.port, cc.call)
+        elif cc.state == DISCONNECTED and self.connected_to == (cc.port, cc.call):
+            # fall back to any connection that's left, on any port
+            self.connected_to = next(
+                ((port, call) for port, net in self.ports.nets.items()
+                 for call in net.connections), None)
 
-        # the data
-        msg += f":{frame.data.decode('utf-8', errors='replace')}"
+    def refresh_dash(self) -> None:
+        if self.view.current == "dash":
+            self.view.show("dash", self.net.channel.lines())
 
-        # send the msg to every applicable view
-        for view_id, view_name, list_name in view_list:
-            self.view.write(view_id, msg)
-        self.view.write("all", msg)
+    def load_history(self, view_id: str, call: str) -> None:
+        """Starts a callsign view off with its traffic from earlier sessions"""
+
+        from packet import Packet
+
+        for record in self.net.history(call, HISTORY_LINES):
+            try:
+                packet = Packet.unpack(record.data)
+            except (ValueError, IndexError):
+                continue
+            self.view.write(view_id, f"[dim]{packet.tnc2}[/]", record.time)
+        if self.net.search.catching_up is not None:
+            self.view.write(view_id, "[dim]Still indexing earlier sessions, "
+                                     "some of their traffic may be missing[/]")
+
+    async def show_found(self, query: str) -> None:
+        """Opens a view with the frames that match query"""
+
+        try:
+            found = await self.net.find(query)
+        except CommandError as e:
+            self.notify(str(e), severity='error')
+            return
+        self.finds += 1
+        view_id = f"find-{self.finds}"
+        await self.append_view(view_id, f"Find: {query}", f"Find {query}")
+        for record, packet in found:
+            self.view.write(view_id, packet.tnc2, record.time)
+        if not found:
+            self.view.write(view_id, "[dim]Nothing found[/]")
+        self.view.switch(view_id)
 
     async def append_view(self, view_id: str, view_name: str, list_name: str):
-        await self.view.append(view_id, view_name)
-        self.view_list.append(view_id, list_name)
+        self.view.append(view_id, view_name)
+        await self.view_list.append(view_id, list_name)
 
     async def on_ready(self) -> None:
         # store the instances of widgets we will use
@@ -100,26 +220,70 @@ class NetTerm(App):
         # setup default views
         await self.append_view("all", "All Traffic", "All")
         await self.append_view("debug", "Debug Output", "Debug")
+        await self.append_view("stats", "Stack Profile", "Stats")
+        await self.append_view("dash", "Channel Dashboard", "Dashboard")
+        self.view.show("dash", [])
         self.view.switch("all")
         self.view_list.index = 0
 
-        # set up the Net class
-        self.net = Net(app, "N2BP")
+        # a Net for each TNC, their stacks run here on the event loop. Only
+        # imported now the UI is up, and the TNCs connect in the background.
+        from ports import Ports, load_specs
+
+        self.ports = Ports(UISink(self), "N2BP")
+        self.port_states = {}
+        self.to_ui = self.ports.profiler.metric("frame to UI")
+        self.log_metric = self.ports.profiler.metric("NetTerm.on_log_frames")
+        self.set_interval(1 / DASH_RATE, self.refresh_dash)
+        self.ports.open(load_specs())
+        self.show_status()
 
     async def on_command_message(self, msg: CommandMessage):
-        if msg.command == CommandInput.AUTO:
-
-            # send a test packet
-            # expect a response
-            pass
-        elif msg.command == CommandInput.MODE:
-            self.net.set_hw_mode(msg.args[0])
-        elif msg.command == CommandInput.QUIT:
+        if msg.command == CommandInput.QUIT:
             await self.app.action_quit()
-        elif msg.command == CommandInput.RMODE:
-            self.net.send_rmode_command(msg.args[0], msg.args[1])
-        elif msg.command == CommandInput.TEST:
-            self.net.send_test_command(msg.args[0], "Testing from NetTerm")
+            return
+        if msg.command == CommandInput.SAY:
+            port, call = self.connected_to or (None, None)
+            connection = port is not None and self.ports.nets[port].connections.get(call)
+            if not connection:
+                self.notify("Not connected, use /connect CALL",
+                            severity='error')
+                return
+            connection.write((msg.args[0] + "\r").encode('utf-8'))
+            view_id = await self.call_view(call)
+            self.view.write(view_id, f"[bold]{self.ports.our_call}:[/] {msg.args[0]}")
+            return
+        if msg.command == CommandInput.FIND:
+            await self.show_found(" ".join(msg.args))
+            return
+
+        try:
+            if msg.command == CommandInput.DISCONNECT and not msg.args and self.connected_to:
+                # whichever port it's on
+                port, call = self.connected_to
+                lines = await self.ports.nets[port].run_command(msg.command, [call])
+            else:
+                lines = await self.ports.run_command(msg.command, msg.args)
+        except CommandError as e:
+            self.notify(str(e), severity='error')
+            return
+        if msg.command == CommandInput.DASH:
+            self.view.switch("dash")
+            self.view.show("dash", lines)
+            return
+        if msg.command == CommandInput.STATS:
+            # a fresh snapshot in its own view
+            self.view.write("stats", f"[bold]Profile at {time.strftime('%H:%M:%S')}[/]")
+            for line in lines:
+                self.view.write("stats", line)
+            self.view.switch("stats")
+            return
+        for line in lines:
+            self.debug(line)
+
+    def on_unmount(self) -> None:
+        if self.ports:
+            self.ports.close()
 
     def on_list_view_highlighted(self, event: ListView.Highlighted):
         self.view.switch(event.item._id)
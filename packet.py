@@ -0,0 +1,129 @@
+import ax25
+
+# names used for the control information in TNC 2 style lines
+FRAME_TYPE_NAMES = {
+    ax25.FrameType.I: "I",
+    ax25.FrameType.RR: "RR",
+    ax25.FrameType.RNR: "RNR",
+    ax25.FrameType.REJ: "REJ",
+    ax25.FrameType.SREJ: "SREJ",
+    ax25.FrameType.TEST: "TEST",
+    ax25.FrameType.UI: "UI",
+    ax25.FrameType.SABM: "SABM",
+    ax25.FrameType.SABME: "SABME",
+    ax25.FrameType.UA: "UA",
+    ax25.FrameType.DM: "DM",
+    ax25.FrameType.DISC: "DISC",
+    ax25.FrameType.FRMR: "FRMR",
+    ax25.FrameType.XID: "XID",
+}
+
+
+class Packet():
+    """
+    Wraps an ax25.Frame so each field is decoded at most once, no matter how
+    many stack actions and views look at it. One is made for every frame Net
+    sends or receives and that same Packet is what the stack and the UI get.
+    """
+
+    __slots__ = ('frame', 'frame_type', 'poll_final', 'received', '_src',
+                 '_dst', '_via', '_text', '_tnc2')
+
+    def __init__(self, frame: ax25.Frame):
+        self.frame = frame
+        control = frame.control
+        # every stack dispatch needs these, so they aren't lazy
+        self.frame_type = control.frame_type
+        self.poll_final = control.poll_final
+        # time.perf_counter_ns() when it came in from the TNC, None if we sent it
+        self.received = None
+        self._src = None
+        self._dst = None
+        self._via = None
+        self._text = None
+        self._tnc2 = None
+
+    @classmethod
+    def unpack(cls, data: bytes) -> 'Packet':
+        return cls(ax25.Frame.unpack(data))
+
+    def pack(self) -> bytes:
+        return self.frame.pack()
+
+    @property
+    def control(self) -> ax25.Control:
+        return self.frame.control
+
+    @property
+    def command(self) -> bool:
+        """
+        True for a command, False for a response, going by the C bits in the
+        addresses
+        """
+        return (self.frame.dst.command_response and
+                not self.frame.src.command_response)
+
+    @property
+    def pid(self) -> int:
+        return self.frame.pid
+
+    @property
+    def data(self) -> bytes:
+        """The information field, empty for frames that can't have one"""
+        return self.frame.data or b''
+
+    @property
+    def src(self) -> str:
+        if self._src is None:
+            self._src = str(self.frame.src)
+        return self._src
+
+    @property
+    def dst(self) -> str:
+        if self._dst is None:
+            self._dst = str(self.frame.dst)
+        return self._dst
+
+    @property
+    def via(self) -> tuple:
+        if self._via is None:
+            self._via = tuple(str(repeater) for repeater in self.frame.via or ())
+        return self._via
+
+    @property
+    def text(self) -> str:
+        """The information field decoded as UTF-8"""
+        if self._text is None:
+            self._text = self.data.decode('utf-8', errors='replace')
+        return self._text
+
+    @property
+    def tnc2(self) -> str:
+        """
+        The frame as a TNC 2 style line
+        https://raw.githubusercontent.com/wb2osz/aprsspec/main/Understanding-APRS-Packets.pdf
+        https://wiki.oarc.uk/packet:reading_traces
+        """
+
+        if self._tnc2 is None:
+            # src, dst, and repeaters
+            msg = f"{self.src}>{self.dst}"
+            for repeater in self.via:
+                msg += f",{repeater}"
+
+            # control information
+            frame_type = FRAME_TYPE_NAMES.get(self.frame_type, "")
+            if self.frame_type.is_I():
+                frame_type += (f" S{self.control.send_seqno}"
+                               f" R{self.control.recv_seqno}")
+            elif self.frame_type.is_S():
+                frame_type += f" R{self.control.recv_seqno}"
+            poll_final = "P" if self.poll_final else "F"
+            msg += f" <{frame_type} {poll_final}>"
+
+            # the data
+            self._tnc2 = f"{msg}:{self.text}"
+        return self._tnc2
+
+    def __str__(self) -> str:
+        return self.tnc2
@@ -0,0 +1,202 @@
+"""
+A port is one KISS TNC, over TCP or serial, each with its own Net: its own
+stack, mode, TxQueue and connections. Every port's receive loop runs on the
+same event loop, so a slow or busy radio never holds up the others. The
+ports share the scheduler, the capture, its search index and the profiler.
+
+Each port connects in the background and connects again whenever its TNC
+goes away, so nothing waits on a TNC that is slow or down.
+"""
+
+import asyncio
+import json
+import os
+
+import capture
+import commandset
+from commandset import CommandError
+from events import TNC_CONNECTING, TNC_DISCONNECTED, TncChanged
+from net import Net, DATA_DIR, CAPTURE_PATH
+from scheduler import Scheduler
+from search import SearchIndex
+from sink import Sink
+from stats import Profiler
+
+# a list of port specs (see parse_spec), one per TNC, used if it exists
+PORTS_PATH = os.path.join(DATA_DIR, "ports.json")
+DEFAULT_SPECS = ["127.0.0.1:8001"]
+DEFAULT_BAUDRATE = 57600
+
+CONNECT_TIMEOUT = 5.0   # seconds a connection attempt gets before it's retried
+RECONNECT_MIN = 0.5     # seconds before the first retry, doubling each time
+RECONNECT_MAX = 4.0     # up to this, so a TNC is back within seconds of power
+
+
+def parse_spec(spec: str) -> tuple:
+    """
+    Turns a port spec into ('tcp', host, port) or ('serial', device,
+    baudrate). Specs look like 127.0.0.1:8001, tcp:127.0.0.1:8001,
+    /dev/ttyACM0, serial:/dev/ttyACM0 or /dev/ttyACM0@57600.
+    """
+
+    kind, _, rest = spec.partition(':')
+    if kind not in ('tcp', 'serial'):
+        kind = 'serial' if spec.startswith(('/', 'COM')) else 'tcp'
+        rest = spec
+    if kind == 'serial':
+        device, _, baudrate = rest.partition('@')
+        return ('serial', device, int(baudrate or DEFAULT_BAUDRATE))
+    host, _, port = rest.rpartition(':')
+    if not host or not port.isdigit():
+        raise ValueError(f"{spec} is not HOST:PORT or a serial device")
+    return ('tcp', host, int(port))
+
+
+def load_specs(path: str = PORTS_PATH) -> list:
+    """The port specs in path, or DEFAULT_SPECS if there aren't any"""
+
+    try:
+        with open(path) as f:
+            specs = json.load(f)
+    except (OSError, ValueError):
+        return list(DEFAULT_SPECS)
+    return [str(spec) for spec in specs] or list(DEFAULT_SPECS)
+
+
+class PortSink(Sink):
+    """Passes everything on to the real sink, marking debug with the port"""
+
+    def __init__(self, sink: Sink, ports: 'Ports', port: int):
+        self.sink = sink
+        self.ports = ports
+        self.port = port
+
+    def debug(self, msg: str) -> None:
+        # with only one port there's nothing to tell apart
+        if len(self.ports.nets) > 1:
+            msg = f"[{self.port}] {msg}"
+        self.sink.debug(msg)
+
+    def emit(self, event) -> None:
+        self.sink.emit(event)
+
+
+class Ports():
+    """
+    Every port's Net, by port number, and which one commands go to. Ports
+    are numbered in the order they're added, starting at 0.
+    """
+
+    def __init__(self, sink: Sink, our_call: str):
+        self.sink = sink
+        self.our_call = our_call
+        self.nets = {}
+        self.specs = {}
+        # the keep_connected() task for each port
+        self.tasks = {}
+        self.current = 0
+
+        # shared by every port
+        self.profiler = Profiler()
+        loop = asyncio.get_running_loop()
+        self.scheduler = Scheduler(sink, loop.call_soon_threadsafe,
+                                   self.profiler)
+        os.makedirs(DATA_DIR, exist_ok=True)
+        self.capture = capture.CaptureWriter(CAPTURE_PATH)
+        self.search = SearchIndex(CAPTURE_PATH, self.capture.session_start)
+
+    def add(self, spec: str) -> Net:
+        port = len(self.nets)
+        net = Net(PortSink(self.sink, self, port), self.our_call, port,
+                  self.scheduler, self.capture, self.profiler, self.search)
+        self.nets[port] = net
+        self.specs[port] = parse_spec(spec)
+        return net
+
+    async def connect(self, port: int) -> None:
+        kind, where, number = self.specs[port]
+        if kind == 'serial':
+            await self.nets[port].connect_to_serial(where, number)
+        else:
+            await self.nets[port].connect_to_server(where, number)
+
+    async def keep_connected(self, port: int) -> None:
+        """
+        Connects port's TNC, and again whenever it goes away, backing off
+        from RECONNECT_MIN to RECONNECT_MAX seconds while it can't be reached
+        """
+
+        net = self.nets[port]
+        delay = RECONNECT_MIN
+        while True:
+            net.sink.emit(TncChanged(TNC_CONNECTING, port))
+            try:
+                await asyncio.wait_for(self.connect(port), CONNECT_TIMEOUT)
+            except ImportError as e:
+                # no pyserial, trying again won't help
+                net.sink.debug(f"Can't connect to {self.describe(port)}: {e}")
+                net.sink.emit(TncChanged(TNC_DISCONNECTED, port))
+                return
+            except (OSError, asyncio.TimeoutError) as e:
+                net.sink.debug(f"Couldn't connect to {self.describe(port)}: "
+                               f"{e or 'timed out'}, trying again in "
+                               f"{delay:g}s")
+                net.sink.emit(TncChanged(TNC_DISCONNECTED, port))
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX)
+                continue
+            delay = RECONNECT_MIN
+            # Net.receiving_stopped says why it ended
+            await asyncio.wait((net.receiver,))
+            await asyncio.sleep(delay)
+
+    def open(self, specs: list) -> None:
+        """Adds a port for each spec and starts connecting them all"""
+
+        for spec in specs:
+            port = self.add(spec).port
+            self.tasks[port] = asyncio.create_task(self.keep_connected(port))
+
+    @property
+    def net(self) -> Net:
+        """The Net commands go to"""
+        return self.nets[self.current]
+
+    def describe(self, port: int) -> str:
+        kind, where, number = self.specs[port]
+        if kind == 'serial':
+            return f"{where}@{number}"
+        return f"{where}:{number}"
+
+    def lines(self) -> list:
+        lines = []
+        for port, net in self.nets.items():
+            current = "*" if port == self.current else " "
+            state = "receiving" if net.receiving else "not connected"
+            lines.append(f"{current}{port}: {self.describe(port)} "
+                         f"{net.modes.mode_id} {state}, "
+                         f"{len(net.connections)} connection(s)")
+        return lines
+
+    async def run_command(self, command_id: str, args: list) -> list:
+        """Runs PORT here and everything else on the current port's Net"""
+
+        if command_id == commandset.PORT:
+            if args:
+                port = int(args[0])
+                if port not in self.nets:
+                    raise CommandError(f"There is no port {port}")
+                self.current = port
+            return self.lines()
+        return await self.net.run_command(command_id, args)
+
+    def close(self) -> None:
+        for task in self.tasks.values():
+            task.cancel()
+        for net in self.nets.values():
+            if net.receiver:
+                net.receiver.cancel()
+            net.connection.close()
+            net.close()
+        self.capture.flush()
+        self.search.close()
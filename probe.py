@@ -0,0 +1,271 @@
+import itertools
+import time
+from collections import deque
+
+import ax25
+
+from modes import airtime
+from packet import Packet
+
+PROBE_SIZE = 64     # rough size of a probe on air, for the timeouts
+PROBE_MARGIN = 2.0  # seconds for the remote station to turn a probe around
+PROBE_EXTENSIONS = 3  # most times a probe's timeout is put off, see timed_out
+RTT_SAMPLES = 200   # most recent round trip times kept for the p95
+
+SWEEP_PROBES = 10      # probes sent to each station in a sweep
+SWEEP_OUTSTANDING = 2  # most probes waiting on a reply from one station
+
+nonces = itertools.count()
+
+
+class RttStats():
+    """Running round trip times and loss for a station or a mode"""
+
+    __slots__ = ('received', 'lost', 'min', 'total', 'recent')
+
+    def __init__(self):
+        self.received = 0
+        self.lost = 0
+        self.min = None
+        self.total = 0.0
+        self.recent = deque(maxlen=RTT_SAMPLES)
+
+    def record(self, rtt: float | None) -> None:
+        """Adds a probe that came back after rtt seconds, or None if lost"""
+
+        if rtt is None:
+            self.lost += 1
+        else:
+            self.add(rtt)
+
+    def add(self, rtt: float) -> None:
+        self.received += 1
+        self.total += rtt
+        if self.min is None or rtt < self.min:
+            self.min = rtt
+        self.recent.append(rtt)
+
+    @property
+    def avg(self) -> float | None:
+        return self.total / self.received if self.received else None
+
+    @property
+    def p95(self) -> float | None:
+        if not self.recent:
+            return None
+        recent = sorted(self.recent)
+        return recent[min(len(recent) - 1, int(len(recent) * 0.95))]
+
+    @property
+    def loss(self) -> float | None:
+        done = self.received + self.lost
+        return self.lost / done if done else None
+
+    def __str__(self) -> str:
+        if not self.received:
+            return f"rtt - loss {self.loss or 0:.0%} ({self.lost} lost)"
+        return (f"rtt min/avg/p95 {self.min * 1000:.0f}/"
+                f"{self.avg * 1000:.0f}/{self.p95 * 1000:.0f}ms "
+                f"loss {self.loss:.0%} ({self.received}/"
+                f"{self.received + self.lost})")
+
+
+def stats_lines(stations: dict, modes: dict) -> list:
+    """A line for each station's RttStats, then each mode's"""
+
+    return ([f"{call}: {stats}" for call, stats in stations.items()] +
+            [f"{mode_id}: {stats}" for mode_id, stats in modes.items()])
+
+
+class Outstanding():
+    """A probe waiting on its reply"""
+
+    __slots__ = ('call', 'mode_id', 'sent_at', 'timer', 'done', 'extended')
+
+    def __init__(self, call: str, mode_id: str, sent_at: float, done):
+        self.call = call
+        self.mode_id = mode_id
+        self.sent_at = sent_at
+        self.timer = None
+        self.done = done
+        # how many times its timeout has been put off
+        self.extended = 0
+
+
+class Prober():
+    """
+    Stack action that sends TEST probes and matches the replies to them.
+    Runs forever.
+
+    Every probe carries a nonce made of a sequence number and the time it was
+    sent, which the other station sends back, so any number can be out at
+    once to any number of stations. A probe that isn't answered before its
+    timeout, which allows for the TxQueue ahead of it and is put off at most
+    PROBE_EXTENSIONS times while the channel stays busy, is lost. Round trip
+    times and loss are kept for each station and for each mode.
+    """
+
+    frame_types = (ax25.FrameType.TEST,)
+
+    def __init__(self, sink, net, our_call):
+        self.sink = sink
+        self.net = net
+        self.our_call = our_call
+        self.dst = our_call
+        # nonce -> Outstanding
+        self.outstanding = {}
+        self.stations = {}
+        self.modes = {}
+        # monotonic time the last reply came in
+        self.last_reply = 0.0
+
+    def probe(self, call: str, done=None) -> str:
+        """
+        Sends a TEST probe to call, returning its nonce. done(rtt) is called
+        when the reply comes back, or done(None) if it's lost.
+        """
+
+        call = call.upper()
+        # what the TxQueue will send it in
+        mode_id = self.net.modes.mode_for(call)
+        now = time.monotonic()
+        nonce = f"PROBE {next(nonces)} {time.time():.3f}"
+        probe = self.outstanding[nonce] = Outstanding(call, mode_id, now, done)
+        self.net.send_test_command(call, nonce)
+        self.wait(nonce, probe)
+        return nonce
+
+    def wait(self, nonce: str, probe: Outstanding) -> None:
+        # the clock starts now, but the probe may have to wait its turn, and
+        # its reply shares the channel with the replies to every other probe
+        # that's out
+        frame_airtime = airtime(probe.mode_id, PROBE_SIZE)
+        timeout = (self.net.txqueue.drain_time() +
+                   (len(self.outstanding) + 1) * frame_airtime + PROBE_MARGIN)
+        probe.timer = self.net.scheduler.call_later(
+            timeout, lambda: self.timed_out(nonce))
+
+    def timed_out(self, nonce: str) -> None:
+        probe = self.outstanding.get(nonce)
+        if probe is None:
+            return
+        # while we're still holding the channel with what was queued after
+        # it, or replies to other probes are still coming in, its reply may
+        # just be waiting its turn. But on a channel that's never quiet that
+        # would be forever, so only PROBE_EXTENSIONS times.
+        busy = time.monotonic() - self.last_reply < PROBE_MARGIN
+        if ((self.net.txqueue.drain_time() or busy) and
+                probe.extended < PROBE_EXTENSIONS):
+            probe.extended += 1
+            self.wait(nonce, probe)
+            return
+        self.lost(nonce)
+
+    def frame_received(self, packet: Packet) -> bool:
+        if packet.poll_final:
+            return True
+        probe = self.outstanding.get(packet.text)
+        if probe is None or probe.call != packet.src:
+            return True
+        del self.outstanding[packet.text]
+        self.net.scheduler.cancel(probe.timer)
+        self.last_reply = time.monotonic()
+        rtt = self.last_reply - probe.sent_at
+        self.record(probe, rtt)
+        if probe.done:
+            probe.done(rtt)
+        return True
+
+    def lost(self, nonce: str) -> None:
+        probe = self.outstanding.pop(nonce, None)
+        if probe is None:
+            return
+        self.record(probe, None)
+        if probe.done:
+            probe.done(None)
+
+    def forget(self, nonce: str) -> None:
+        """Stops waiting for a probe, without counting it as lost"""
+
+        probe = self.outstanding.pop(nonce, None)
+        if probe:
+            self.net.scheduler.cancel(probe.timer)
+
+    def record(self, probe: Outstanding, rtt: float | None) -> None:
+        """Adds how a probe went to its station's and its mode's stats"""
+
+        for table, key in ((self.stations, probe.call),
+                           (self.modes, probe.mode_id)):
+            stats = table.get(key)
+            if stats is None:
+                stats = table[key] = RttStats()
+            stats.record(rtt)
+
+    def cancel(self) -> None:
+        for probe in self.outstanding.values():
+            self.net.scheduler.cancel(probe.timer)
+        self.outstanding.clear()
+
+    def lines(self) -> list:
+        """The running stats, a line for each station then each mode"""
+        return stats_lines(self.stations, self.modes)
+
+    def __str__(self) -> str:
+        return f"Prober({len(self.outstanding)} outstanding)"
+
+
+class Sweep():
+    """
+    Probes a list of stations at once, SWEEP_PROBES each with at most
+    SWEEP_OUTSTANDING waiting on a reply from any one station, then reports
+    the round trip times and loss for each station and each mode. Sends its
+    probes through the Prober, so it isn't a stack action itself.
+    """
+
+    def __init__(self, sink, net, calls: list, probes: int = SWEEP_PROBES,
+                 outstanding: int = SWEEP_OUTSTANDING):
+        self.sink = sink
+        self.net = net
+        self.calls = [call.upper() for call in dict.fromkeys(calls)]
+        self.probes = probes
+        # call -> probes still to send, and probes sent but not done
+        self.to_send = dict.fromkeys(self.calls, probes)
+        self.waiting = dict.fromkeys(self.calls, 0)
+        # what this sweep saw, apart from the Prober's running totals
+        self.stations = {call: RttStats() for call in self.calls}
+        self.modes = {}
+        self.started = time.monotonic()
+
+        self.sink.debug(f"Sweep: probing {len(self.calls)} station(s), "
+                        f"{probes} probe(s) each")
+        for call in self.calls:
+            for _ in range(min(outstanding, probes)):
+                self.send(call)
+
+    def send(self, call: str) -> None:
+        self.to_send[call] -= 1
+        self.waiting[call] += 1
+        mode_id = self.net.modes.mode_for(call)
+        self.net.prober.probe(call, lambda rtt: self.done(call, mode_id, rtt))
+
+    def done(self, call: str, mode_id: str, rtt: float | None) -> None:
+        self.waiting[call] -= 1
+        self.stations[call].record(rtt)
+        self.modes.setdefault(mode_id, RttStats()).record(rtt)
+        if self.to_send[call]:
+            self.send(call)
+        elif not any(self.waiting.values()):
+            self.report()
+
+    def report(self) -> None:
+        seconds = time.monotonic() - self.started
+        self.sink.debug(f"Sweep: done in {seconds:.0f}s")
+        for line in self.lines():
+            self.sink.debug(f"Sweep: {line}")
+
+    def lines(self) -> list:
+        return stats_lines(self.stations, self.modes)
+
+    def __str__(self) -> str:
+        left = sum(self.to_send.values()) + sum(self.waiting.values())
+        return f"Sweep({len(self.calls)} stations, {left} probes left)"
@@ -0,0 +1,157 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+import traceback
+
+
+class Timer():
+    """
+    A callback waiting in the Scheduler. Keep it around if you may need to
+    cancel it.
+    """
+
+    __slots__ = ('deadline', 'callback', 'cancelled', 'pending')
+
+    def __init__(self, deadline: float, callback):
+        self.deadline = deadline
+        self.callback = callback
+        self.cancelled = False
+        # still in the Scheduler's heap
+        self.pending = True
+
+    def __str__(self) -> str:
+        return f"Timer({self.deadline - time.monotonic():.1f}s)"
+
+
+def callback_name(callback) -> str:
+    return getattr(callback, '__qualname__', 'callback')
+
+
+class Scheduler():
+    """
+    Runs callbacks when their deadlines expire, all from one long-lived Timer
+    thread. Deadlines are absolute time.monotonic() values, so a late callback
+    never pushes back the ones after it and nothing drifts. Pending timers are
+    kept in a heap, so the thread only wakes up when something is actually
+    due.
+
+    By default callbacks run on the Timer thread. Pass dispatch (for example
+    loop.call_soon_threadsafe) to hand them off to another thread instead.
+    Pass a stats.Profiler to time every callback, and how late it ran. A
+    callback that raises is reported with sink.debug().
+    """
+
+    def __init__(self, sink, dispatch=None, profiler=None):
+        self.sink = sink
+        self.dispatch = dispatch
+        self.profiler = profiler
+        # heap of (deadline, sequence, Timer), sequence keeps FIFO order for
+        # equal deadlines and keeps Timers from ever being compared
+        self.heap = []
+        self.sequence = itertools.count()
+        self.cancelled = 0
+        self.condition = threading.Condition()
+
+        self.thread = threading.Thread(target=self.run, name="Timer",
+                                       daemon=True)
+        self.thread.start()
+
+    def call_at(self, deadline: float, callback) -> Timer:
+        """Runs callback() once time.monotonic() reaches deadline"""
+
+        timer = Timer(deadline, callback)
+        with self.condition:
+            heapq.heappush(self.heap, (deadline, next(self.sequence), timer))
+            # only wake the thread if this is the new earliest deadline
+            if self.heap[0][2] is timer:
+                self.condition.notify()
+        return timer
+
+    def call_later(self, delay: float, callback) -> Timer:
+        """Runs callback() in delay seconds"""
+
+        return self.call_at(time.monotonic() + delay, callback)
+
+    def cancel(self, timer: Timer | None) -> None:
+        """
+        Cancels a timer. Cancelled timers are skipped when they come up and
+        the heap is compacted once they make up most of it.
+        """
+
+        if timer is None or timer.cancelled:
+            return
+        with self.condition:
+            timer.cancelled = True
+            if not timer.pending:
+                # already handed off, fire() will skip it
+                return
+            self.cancelled += 1
+            if self.cancelled > len(self.heap) // 2:
+                self.heap = [entry for entry in self.heap
+                             if not entry[2].cancelled]
+                heapq.heapify(self.heap)
+                self.cancelled = 0
+
+    def __len__(self) -> int:
+        return len(self.heap) - self.cancelled
+
+    def next_due(self) -> Timer:
+        """Blocks until the earliest timer is due and pops it"""
+
+        with self.condition:
+            while True:
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+                deadline, _, timer = self.heap[0]
+                if timer.cancelled:
+                    heapq.heappop(self.heap)
+                    timer.pending = False
+                    self.cancelled -= 1
+                    continue
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                heapq.heappop(self.heap)
+                timer.pending = False
+                return timer
+
+    def run(self) -> None:
+        """Body of the Timer thread"""
+
+        while True:
+            timer = self.next_due()
+            if self.dispatch:
+                self.dispatch(self.fire, timer)
+            else:
+                self.fire(timer)
+
+    def fire(self, timer: Timer) -> None:
+        """
+        Runs a due timer without the lock held, so the callback is free to
+        schedule or cancel other timers. A timer cancelled after it was handed
+        off but before it got to run is skipped here.
+        """
+
+        if timer.cancelled:
+            return
+        timer.cancelled = True
+        profiler = self.profiler
+        if profiler:
+            start = time.perf_counter_ns()
+            late = time.monotonic() - timer.deadline
+        try:
+            timer.callback()
+        except Exception as e:
+            # one bad callback shouldn't stop every other timer
+            where = traceback.extract_tb(e.__traceback__)[-1]
+            self.sink.debug(f"Timer {callback_name(timer.callback)} failed "
+                            f"at {os.path.basename(where.filename)}:"
+                            f"{where.lineno}: {e!r}")
+        if profiler:
+            name = callback_name(timer.callback)
+            profiler.record(f"Timer {name}", time.perf_counter_ns() - start)
+            profiler.record("Timer late", int(late * 1e9))
@@ -0,0 +1,439 @@
+import array
+import asyncio
+import bisect
+import hashlib
+import mmap
+import os
+import re
+import struct
+import time
+
+from capture import MAGIC, Capture
+from packet import FRAME_TYPE_NAMES, Packet
+
+# Frames are indexed as they're captured, by the tokens below. The newest
+# SEGMENT_SIZE frames are indexed in memory, and each time that fills up it
+# is written out next to the capture as a segment:
+#
+#   SEGMENT_HEADER, then TOKEN entries sorted by hash, then the capture
+#   offsets of the frames for each token, oldest first
+#
+# A segment covers every frame in the capture from its start offset up to its
+# end offset, so the parts of the capture no segment covers can be found.
+#
+# Tokens are stored as a hash, so a segment is only ever bisected and read,
+# never parsed, and frames it finds are checked against the query once read.
+SEGMENT_MAGIC = b"NTFIND1\0"
+SEGMENT_HEADER = struct.Struct("<8sddQQI")  # magic, first time, last time,
+                                           # start offset, end offset, tokens
+TOKEN = struct.Struct("<QII")  # hash, first posting, postings
+POSTING = struct.Struct("<Q")  # capture offset
+
+SEGMENT_SIZE = 20000  # frames indexed in memory before they go to disk
+WORDS_MAX = 24        # most words from one frame's data that are indexed
+FIND_LIMIT = 200      # most frames /find shows, the newest
+
+WORD = re.compile(r"[a-z0-9]{2,32}")
+# plain words also match callsigns, and these prefixes only match one field
+FIELDS = ('from', 'to', 'call', 'via', 'type')
+UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def token_hash(token: str) -> int:
+    # stable between runs, unlike hash()
+    return int.from_bytes(hashlib.blake2b(token.encode(),
+                                          digest_size=8).digest(), 'little')
+
+
+def tokens(packet: Packet) -> set:
+    """Everything a frame can be found by"""
+
+    found = {f"from:{packet.src}", f"to:{packet.dst}",
+             f"call:{packet.src}", f"call:{packet.dst}",
+             f"type:{FRAME_TYPE_NAMES.get(packet.frame_type, '').lower()}"}
+    for repeater in packet.via:
+        repeater = repeater.rstrip('*')
+        found.add(f"via:{repeater}")
+        found.add(f"call:{repeater}")
+    words = dict.fromkeys(WORD.findall(packet.text.lower()))
+    found.update(list(words)[:WORDS_MAX])
+    return found
+
+
+def parse_query(query: str) -> tuple:
+    """
+    Turns a query into (groups, since). A frame matches if it has a token
+    from every group, and was captured at or after since (a time.time()).
+    """
+
+    groups = []
+    since = None
+    for word in query.split():
+        field, _, value = word.partition(':')
+        field = field.lower()
+        if value and field == 'since':
+            number, unit = value[:-1], value[-1:].lower()
+            if unit not in UNITS or not number.replace('.', '', 1).isdigit():
+                raise ValueError(f"since:{value} should look like since:30m")
+            since = time.time() - float(number) * UNITS[unit]
+        elif value and field in FIELDS:
+            value = value.lower() if field == 'type' else value.upper()
+            groups.append((f"{field}:{value}",))
+        else:
+            groups.append((f"call:{word.upper()}", word.lower()))
+    return groups, since
+
+
+class Segment():
+    """A segment on disk, memory mapped"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.first_time, self.last_time, self.start_offset,
+         self.end_offset, self.count) = SEGMENT_HEADER.unpack_from(self.map)
+        if magic != SEGMENT_MAGIC:
+            raise ValueError(f"{path} is not a search segment")
+        self.postings_start = SEGMENT_HEADER.size + self.count * TOKEN.size
+
+    def hash_at(self, i: int) -> int:
+        return TOKEN.unpack_from(self.map, SEGMENT_HEADER.size +
+                                 i * TOKEN.size)[0]
+
+    def offsets(self, token: str) -> list:
+        """Capture offsets of the frames with token, oldest first"""
+
+        wanted = token_hash(token)
+        i = bisect.bisect_left(HashColumn(self), wanted)
+        if i == self.count or self.hash_at(i) != wanted:
+            return []
+        _, first, count = TOKEN.unpack_from(self.map, SEGMENT_HEADER.size +
+                                            i * TOKEN.size)
+        start = self.postings_start + first * POSTING.size
+        return list(struct.unpack_from(f"<{count}Q", self.map, start))
+
+    def close(self) -> None:
+        self.map.close()
+
+
+class HashColumn():
+    """The token hashes in a segment, as a sequence bisect can search"""
+
+    def __init__(self, segment: Segment):
+        self.segment = segment
+
+    def __len__(self) -> int:
+        return self.segment.count
+
+    def __getitem__(self, i: int) -> int:
+        return self.segment.hash_at(i)
+
+
+class Postings():
+    """
+    Frames indexed in memory: their time and offset, by frame number, and
+    the frame numbers for each token
+    """
+
+    def __init__(self):
+        self.times = []
+        self.offsets = array.array('Q')
+        self.postings = {}
+
+    def add(self, packet: Packet, offset: int, when: float) -> None:
+        frame = len(self.offsets)
+        self.times.append(when)
+        self.offsets.append(offset)
+        for token in tokens(packet):
+            frames = self.postings.get(token)
+            if frames is None:
+                frames = self.postings[token] = array.array('I')
+            frames.append(frame)
+
+    def offsets_for(self, groups: list) -> set:
+        frames = match(groups, lambda token: self.postings.get(token, ()))
+        return {self.offsets[frame] for frame in frames}
+
+    def write(self, directory: str, start: int, end: int) -> str:
+        """
+        Writes the frames out as a segment covering the capture from offset
+        start up to end, returning its path
+        """
+
+        path = os.path.join(directory, f"{start:016x}.seg")
+        # tokens whose hashes collide share an entry, they're told apart
+        # when the frames are read back
+        by_hash = {}
+        for token, frames in self.postings.items():
+            by_hash.setdefault(token_hash(token), set()).update(frames)
+        table = []
+        flat = array.array('Q')
+        for token_hash_, frames in sorted(by_hash.items()):
+            table.append(TOKEN.pack(token_hash_, len(flat), len(frames)))
+            flat.extend(self.offsets[frame] for frame in sorted(frames))
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, self.times[0],
+                                        self.times[-1], start, end,
+                                        len(table)))
+            f.write(b"".join(table))
+            f.write(struct.pack(f"<{len(flat)}Q", *flat))
+        # a reader never sees half a segment
+        os.replace(tmp, path)
+        return path
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+
+def match(groups: list, lookup) -> set:
+    """What lookup has for a token of every group, rarest group first"""
+
+    results = [set().union(*(lookup(token) for token in group))
+               for group in groups]
+    results.sort(key=len)
+    matched = results[0]
+    for result in results[1:]:
+        if not matched:
+            break
+        matched &= result
+    return matched
+
+
+def index_capture(path: str, start: int, end: int, directory: str) -> tuple:
+    """
+    Indexes the frames in the capture at path from offset start up to end
+    into segments in directory, returning (their paths, frames indexed). It
+    only reads the capture and writes new files, so it can run in another
+    thread.
+    """
+
+    past = Capture(path)
+    paths = []
+    count = 0
+    postings = Postings()
+    try:
+        for record in past.records(start):
+            if record.offset >= end:
+                break
+            try:
+                packet = Packet.unpack(record.data)
+            except (ValueError, IndexError):
+                continue
+            postings.add(packet, record.offset, record.time)
+            count += 1
+            if len(postings) >= SEGMENT_SIZE:
+                paths.append(postings.write(directory, start,
+                                            record.offset + 1))
+                start = record.offset + 1
+                postings = Postings()
+    finally:
+        past.close()
+    if postings:
+        paths.append(postings.write(directory, start, end))
+    return paths, count
+
+
+class SearchIndex():
+    """
+    An inverted index over every frame in the capture at path, by callsign
+    (from:, to:, via: or call: for any of them), frame type (type:) and the
+    words in its data. Frames from this session are indexed in memory as
+    they're captured, everything before is in segments on disk. Frames in
+    the capture that aren't in a segment yet, from before there was an
+    index or a session that didn't get to finish catching up, are indexed
+    in another thread the first time we're asked to find something.
+    """
+
+    def __init__(self, path: str, session_start: int):
+        self.path = path
+        self.directory = path + ".find"
+        os.makedirs(self.directory, exist_ok=True)
+        self.memory = Postings()
+        self.segments = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(".seg"):
+                try:
+                    self.segments.append(Segment(os.path.join(self.directory,
+                                                              name)))
+                except (OSError, ValueError):
+                    continue
+        self.session_start = session_start
+        # where the frames indexed in memory start
+        self.memory_start = session_start
+        # how far into the capture the segments go without a gap
+        self.covered = self.coverage()
+        # the catch_up() in progress
+        self.catching_up = None
+        self.frames_indexed = 0
+
+    def gaps(self) -> list:
+        """(start, end) of the parts of the capture no segment covers"""
+
+        gaps = []
+        covered = 0
+        for segment in sorted(self.segments,
+                              key=lambda segment: segment.start_offset):
+            if segment.start_offset > covered:
+                gaps.append((covered, segment.start_offset))
+            covered = max(covered, segment.end_offset)
+        gaps.append((covered, None))
+        return gaps
+
+    def coverage(self) -> int:
+        """How far into the capture the segments go without a gap"""
+
+        return self.gaps()[0][0]
+
+    def add(self, packet: Packet, offset: int, when: float) -> None:
+        """Indexes a frame that was just captured at offset"""
+
+        self.memory.add(packet, offset, when)
+        self.frames_indexed += 1
+        if len(self.memory) >= SEGMENT_SIZE:
+            self.save(offset + 1)
+
+    def save(self, end_offset: int | None = None) -> None:
+        """Writes out what's indexed in memory as a segment"""
+
+        if not self.memory:
+            return
+        if end_offset is None:
+            end_offset = self.memory.offsets[-1] + 1
+        self.segments.append(Segment(self.memory.write(
+            self.directory, self.memory_start, end_offset)))
+        self.memory_start = end_offset
+        self.memory = Postings()
+
+    def behind(self, capture) -> list:
+        """
+        (start, end) of the stretches of the capture from before this
+        session that no segment covers and that hold at least one frame
+        """
+
+        if self.covered >= self.session_start:
+            return []
+        behind = []
+        for start, end in self.gaps():
+            if start >= self.session_start:
+                break
+            end = min(end or self.session_start, self.session_start)
+            # nothing but the capture's header
+            if end <= len(MAGIC):
+                continue
+            if capture.first_at(max(start, len(MAGIC))) < end:
+                behind.append((start, end))
+        if not behind:
+            self.covered = self.session_start
+        return behind
+
+    def catch_up(self, behind: list) -> asyncio.Future:
+        """
+        Starts indexing the stretches behind() found in the default
+        executor, unless that's already going on, and returns the task, which
+        comes out as how many frames there were. It raises OSError or
+        ValueError if the capture can't be read.
+        """
+
+        if self.catching_up is None:
+            self.catching_up = asyncio.ensure_future(
+                self.index_earlier(behind))
+        return self.catching_up
+
+    async def index_earlier(self, behind: list) -> int:
+        loop = asyncio.get_running_loop()
+        count = 0
+        try:
+            for start, end in behind:
+                paths, indexed = await loop.run_in_executor(
+                    None, index_capture, self.path, start, end,
+                    self.directory)
+                self.segments.extend(Segment(path) for path in paths)
+                count += indexed
+        finally:
+            self.catching_up = None
+        self.covered = max(self.coverage(), self.session_start)
+        return count
+
+    def offsets_for(self, groups: list) -> list:
+        """
+        Capture offsets of the frames with a token from every group, oldest
+        first
+        """
+
+        found = self.memory.offsets_for(groups)
+        for segment in self.segments:
+            found.update(match(groups, segment.offsets))
+        return sorted(found)
+
+    def find(self, capture, query: str, limit: int = FIND_LIMIT) -> list:
+        """
+        The newest limit (record, packet) that match query, oldest first.
+        Raises ValueError if the query doesn't make sense.
+        """
+
+        groups, since = parse_query(query)
+        if not groups and since is None:
+            raise ValueError("Nothing to find")
+        if groups:
+            offsets = self.offsets_for(groups)
+        else:
+            offsets = capture.offsets_between(since, float('inf'))
+        found = []
+        for offset in reversed(offsets):
+            record = capture.read_at(offset)
+            if record is None:
+                continue
+            if since is not None and record.time < since:
+                # the capture is in time order, so that's all of them
+                break
+            try:
+                packet = Packet.unpack(record.data)
+            except (ValueError, IndexError):
+                continue
+            # a hash on disk may have matched a different token
+            frame_tokens = tokens(packet)
+            if all(frame_tokens.intersection(group) for group in groups):
+                found.append((record, packet))
+                if len(found) == limit:
+                    break
+        found.reverse()
+        return found
+
+    def history(self, capture, call: str, limit: int, before: int) -> list:
+        """
+        The newest limit records to or from call at offsets before before,
+        oldest first. Only the postings for call and the records they point
+        at are read, so anything not indexed yet isn't there.
+        """
+
+        offsets = self.offsets_for([(f"from:{call}", f"to:{call}")])
+        found = []
+        for offset in reversed(offsets):
+            if offset >= before:
+                continue
+            record = capture.read_at(offset)
+            if record is None:
+                continue
+            try:
+                packet = Packet.unpack(record.data)
+            except (ValueError, IndexError):
+                continue
+            # a hash on disk may have matched a different token
+            if call in (packet.src, packet.dst):
+                found.append(record)
+                if len(found) == limit:
+                    break
+        found.reverse()
+        return found
+
+    def close(self) -> None:
+        self.save()
+        for segment in self.segments:
+            segment.close()
+
+    def __str__(self) -> str:
+        return (f"SearchIndex({len(self.memory)} frames in memory, "
+                f"{len(self.memory.postings)} tokens, {len(self.segments)} "
+                f"segment(s) on disk)")
@@ -0,0 +1,16 @@
+import sys
+import time
+
+
+class Sink():
+    """
+    Where Net and its stack actions send debug output and events (see
+    events.py). This one just prints debug output, NetTerm and the gateway
+    have their own.
+    """
+
+    def debug(self, msg: str) -> None:
+        print(f"{time.strftime('%H:%M:%S')} {msg}", file=sys.stderr)
+
+    def emit(self, event) -> None:
+        pass
@@ -0,0 +1,186 @@
+import itertools
+
+import ax25
+
+
+class Version():
+    """
+    One state of the stack's index, never changed once published. Anything
+    that holds on to it (like a dispatch that is still running) keeps seeing
+    the stack as it was, whatever is pushed or removed in the meantime.
+    """
+
+    __slots__ = ('index', 'types')
+
+    def __init__(self, index: dict, types: dict):
+        # (frame type, dst) -> the stack actions that want it, in stack
+        # order. Destinations no stack action asked for share the
+        # (frame type, None) entry.
+        self.index = index
+        # class -> the stack actions of exactly that class
+        self.types = types
+
+
+EMPTY = Version({(frame_type, None): () for frame_type in ax25.FrameType}, {})
+
+
+def wants(stack_action, frame_type) -> bool:
+    return (stack_action.frame_types is None or
+            frame_type in stack_action.frame_types)
+
+
+class Stack():
+    """
+    The stack actions frames are dispatched to.
+
+    Each stack action declares the frame_types it wants (None for all of
+    them) and the dst callsign it wants (None for any). The stack keeps a
+    table of stack actions by handle for each (frame type, dst) entry that
+    push() and remove() change in place, one table entry per index entry
+    the stack action matches, so neither depends on how many other stack
+    actions there are. push() returns the handle, and removing by handle
+    (or by the stack action) doesn't search the stack.
+
+    What a dispatch reads is a Version built from those tables the first
+    time it's asked for after a change, redoing only the entries that
+    changed, and published with a single assignment, so a reader takes
+    version once and never needs a lock or a copy.
+    """
+
+    def __init__(self, stack_actions=()):
+        self.published = EMPTY
+        self.handles = itertools.count()
+        # handle -> stack action and back, bottom of the stack first
+        self.actions = {}
+        self.handle_of = {}
+        # (frame type, dst) -> {handle: stack action}, in stack order
+        self.entries = {key: {} for key in EMPTY.index}
+        # dst -> how many stack actions asked for it
+        self.dsts = {}
+        # class -> {handle: stack action}, in stack order
+        self.types = {}
+        # the entries and classes changed since the last Version
+        self.stale_keys = set()
+        self.stale_types = set()
+        for stack_action in stack_actions:
+            self.push(stack_action)
+
+    @property
+    def version(self) -> Version:
+        """The stack as it is now, published first if it has changed"""
+
+        if self.stale_keys or self.stale_types:
+            self.publish()
+        return self.published
+
+    def publish(self) -> None:
+        index = dict(self.published.index)
+        for key in self.stale_keys:
+            entry = self.entries.get(key)
+            if entry is None:
+                index.pop(key, None)
+            else:
+                index[key] = tuple(entry.values())
+        types = dict(self.published.types)
+        for cls in self.stale_types:
+            entry = self.types.get(cls)
+            if entry is None:
+                types.pop(cls, None)
+            else:
+                types[cls] = tuple(entry.values())
+        self.stale_keys = set()
+        self.stale_types = set()
+        self.published = Version(index, types)
+
+    def push(self, stack_action) -> int:
+        """Adds a stack action to the top of the stack, returning its handle"""
+
+        handle = next(self.handles)
+        self.actions[handle] = stack_action
+        self.handle_of[stack_action] = handle
+
+        entries = self.entries
+        dst = stack_action.dst
+        if dst is not None and dst not in self.dsts:
+            # a new destination starts with everything that takes any
+            for frame_type in ax25.FrameType:
+                entries[(frame_type, dst)] = dict(entries[(frame_type, None)])
+                self.stale_keys.add((frame_type, dst))
+        if dst is None:
+            keys = list(entries)
+        else:
+            self.dsts[dst] = self.dsts.get(dst, 0) + 1
+            keys = [(frame_type, dst) for frame_type in ax25.FrameType]
+        # handles only go up, so new stack actions go at the end of every
+        # entry, on top
+        for key in keys:
+            if wants(stack_action, key[0]):
+                entries[key][handle] = stack_action
+                self.stale_keys.add(key)
+        cls = type(stack_action)
+        self.types.setdefault(cls, {})[handle] = stack_action
+        self.stale_types.add(cls)
+        return handle
+
+    def remove(self, handle: int) -> None:
+        """Removes the stack action with handle from the stack"""
+
+        stack_action = self.actions.pop(handle)
+        del self.handle_of[stack_action]
+
+        entries = self.entries
+        dst = stack_action.dst
+        if dst is None:
+            keys = [key for key in entries if wants(stack_action, key[0])]
+        else:
+            keys = [(frame_type, dst) for frame_type in ax25.FrameType
+                    if wants(stack_action, frame_type)]
+        for key in keys:
+            del entries[key][handle]
+            self.stale_keys.add(key)
+        if dst is not None:
+            self.dsts[dst] -= 1
+            if not self.dsts[dst]:
+                # back to sharing the (frame type, None) entries
+                del self.dsts[dst]
+                for frame_type in ax25.FrameType:
+                    del entries[(frame_type, dst)]
+                    self.stale_keys.add((frame_type, dst))
+        cls = type(stack_action)
+        del self.types[cls][handle]
+        if not self.types[cls]:
+            del self.types[cls]
+        self.stale_types.add(cls)
+
+    def discard(self, stack_action) -> None:
+        """Removes stack_action, if it's still on the stack"""
+
+        handle = self.handle_of.get(stack_action)
+        if handle is not None:
+            self.remove(handle)
+
+    def of_type(self, cls) -> tuple:
+        """The stack actions of exactly class cls, bottom first"""
+        return self.version.types.get(cls, ())
+
+    def dispatch(self, frame_type, dst: str) -> tuple:
+        """The stack actions a frame of frame_type to dst goes to, in order"""
+
+        index = self.version.index
+        stack_actions = index.get((frame_type, dst))
+        if stack_actions is None:
+            return index[(frame_type, None)]
+        return stack_actions
+
+    def __iter__(self):
+        # a copy, so the stack can change while it's being gone through
+        return iter(tuple(self.actions.values()))
+
+    def __len__(self) -> int:
+        return len(self.actions)
+
+    def __contains__(self, stack_action) -> bool:
+        return stack_action in self.handle_of
+
+    def __str__(self) -> str:
+        return f"Stack({', '.join(str(action) for action in self)})"
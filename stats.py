@@ -0,0 +1,121 @@
+import json
+import os
+import time
+
+# latency histograms have a bucket per power of two microseconds, the first
+# is under 1us and the last everything from 2**(BUCKETS - 2)us (~8s) up
+BUCKETS = 25
+
+
+class Metric():
+    """
+    Call count, total time and a latency histogram for one thing we time.
+    Adding a sample is a few integer operations, so it can stay on.
+    """
+
+    __slots__ = ('count', 'total', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.buckets = [0] * BUCKETS
+
+    def add(self, ns: int) -> None:
+        """Adds a sample of ns nanoseconds"""
+
+        self.count += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+        bucket = (ns // 1000).bit_length()
+        self.buckets[bucket if bucket < BUCKETS else BUCKETS - 1] += 1
+
+    def percentile(self, fraction: float) -> int:
+        """
+        Microseconds that at least fraction of the samples took no longer
+        than, rounded up to the top of their bucket
+        """
+
+        wanted = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= wanted:
+                return 1 << bucket
+        return 0
+
+    def to_json(self) -> dict:
+        return {
+            'count': self.count,
+            'total_us': self.total // 1000,
+            'max_us': self.max // 1000,
+            'p50_us': self.percentile(0.5),
+            'p99_us': self.percentile(0.99),
+            # bucket i counts samples under 2**i microseconds
+            'buckets': self.buckets,
+        }
+
+    def __str__(self) -> str:
+        avg = self.total / self.count / 1000 if self.count else 0
+        return (f"{self.count} calls, {self.total / 1e6:.1f}ms total, "
+                f"avg {avg:.0f}us, p50 <{self.percentile(0.5)}us, "
+                f"p99 <{self.percentile(0.99)}us, max {self.max // 1000}us")
+
+
+class Profiler():
+    """
+    Metrics by name, for the stack, the scheduler's callbacks and the time
+    from a frame arriving to it being shown. Names look like
+    "Log.frame_received".
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        # stack action class -> its frame_received Metric
+        self.actions = {}
+        self.started = time.time()
+
+    def metric(self, name: str) -> Metric:
+        """The Metric for name, keep it around rather than looking it up"""
+
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = Metric()
+        return metric
+
+    def action(self, stack_action) -> Metric:
+        """The frame_received Metric for a stack action's class"""
+
+        cls = type(stack_action)
+        metric = self.actions.get(cls)
+        if metric is None:
+            metric = self.actions[cls] = self.metric(
+                f"{cls.__name__}.frame_received")
+        return metric
+
+    def record(self, name: str, ns: int) -> None:
+        self.metric(name).add(ns)
+
+    def lines(self) -> list:
+        """A line for each metric that has run, the most time first"""
+
+        metrics = sorted(self.metrics.items(),
+                         key=lambda item: item[1].total, reverse=True)
+        return [f"{name}: {metric}" for name, metric in metrics
+                if metric.count]
+
+    def to_json(self) -> dict:
+        return {
+            'started': self.started,
+            'time': time.time(),
+            'metrics': {name: metric.to_json()
+                        for name, metric in self.metrics.items()},
+        }
+
+    def export(self, path: str) -> None:
+        # write then rename, so a reader never sees half a file
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.to_json(), f, indent=1)
+        os.replace(tmp, path)
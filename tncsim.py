@@ -0,0 +1,294 @@
+"""
+A stand-in for a NinoTNC and the stations around it, for load testing NetTerm
+without radios. It serves KISS over TCP like a real TNC does, plays back
+captures or makes up traffic from many callsigns, and answers TEST and RMODE
+like a remote NetTerm. SETHW changes the simulated mode, and every frame
+takes the airtime of that mode and may be lost.
+
+A made up frame takes about 0.43s at 1200 baud, so the channel carries a
+little over 2 a second. The default --fps 1 leaves room for NetTerm's own
+replies; anything over about 2 oversaturates it, and frames back up behind
+each other, which is how to load test the queues on purpose.
+
+    python tncsim.py --stations 50
+    python tncsim.py --stations 50 --fps 20
+    python tncsim.py --replay ~/.netterm/capture.bin --fps 200
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+import ax25
+
+import capture
+import transport
+from modes import MODE_IDS, DEFAULT_MODE, MODE_TIMEOUT, airtime
+from packet import Packet
+
+UNPROTO_PID = 0xF0
+
+# chance a frame is lost in each mode, faster modes are less forgiving and
+# IL2P's FEC does better than plain AX.25
+LOSS = {
+    '19.2K-C4FSK-IL2Pc': 0.15,
+    '9600-C4SK-IL2Pc':   0.08,
+    '9600-GFSK-IL2Pc':   0.06,
+    '9600-GFSK-AX.25':   0.10,
+    '4800-GFSK-IL2Pc':   0.04,
+    '3600-AQPSK-IL2Pc':  0.03,
+    '2400-QPSK-IL2Pc':   0.02,
+    '1200-BPSK-ILP2Pc':  0.01,
+    '1200-AFSK-AX.25':   0.02,
+    '600-QPSK-IL2Pc':    0.005,
+    '300-BPSK-IP2Pc':    0.005,
+    '300-AFSK-IL2Pc':    0.005,
+    '300-AFSK-AX.25':    0.01,
+}
+
+
+class Station():
+    """A simulated remote station"""
+
+    def __init__(self, call: str):
+        self.call = call
+        self.mode_id = DEFAULT_MODE
+        self.mode_deadline = None
+
+    def current_mode(self, now: float) -> str:
+        # like Mode, drop back to the default once there's no traffic
+        if self.mode_deadline and now > self.mode_deadline:
+            self.mode_id = DEFAULT_MODE
+            self.mode_deadline = None
+        return self.mode_id
+
+    def heard(self, now: float) -> None:
+        if self.mode_deadline:
+            self.mode_deadline = now + MODE_TIMEOUT
+
+
+class Simulator():
+    """One half duplex channel shared by the TNC and every Station"""
+
+    def __init__(self, args):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.hw_mode = DEFAULT_MODE
+        self.stations = {
+            f"SIM{i}": Station(f"SIM{i}") for i in range(args.stations)
+        }
+        self.clients = []
+        self.busy_until = 0.0
+
+        # counters for the report
+        self.to_client = 0
+        self.from_client = 0
+        self.lost = 0
+        self.mode_switches = 0
+        self.rtts = []
+        self.probes = {}
+        self.probes_lost = 0
+
+    def transmit(self, mode_id: str, data: bytes, deliver) -> None:
+        """
+        Puts a frame on the channel. It is delivered once the channel is free
+        and the frame's airtime has passed, unless the channel loses it.
+        """
+
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        start = max(now, self.busy_until)
+        self.busy_until = start + airtime(mode_id, len(data))
+        loss = self.args.loss if self.args.loss is not None else LOSS[mode_id]
+        if self.random.random() < loss:
+            self.lost += 1
+            return
+        loop.call_at(self.busy_until, deliver, mode_id, data)
+
+    def deliver_to_client(self, mode_id: str, data: bytes) -> None:
+        # the TNC only decodes frames sent in the mode it is in
+        if mode_id != self.hw_mode:
+            self.lost += 1
+            return
+        frame = transport.encode(transport.DATA_FRAME, data)
+        for writer in self.clients:
+            writer.write(frame)
+        self.to_client += 1
+
+    def deliver_to_station(self, mode_id: str, data: bytes) -> None:
+        try:
+            packet = Packet.unpack(data)
+        except (ValueError, IndexError):
+            return
+        now = time.monotonic()
+
+        # a reply to one of our TEST probes
+        if (packet.frame_type == ax25.FrameType.TEST and
+            not packet.poll_final and packet.text in self.probes):
+            self.rtts.append(now - self.probes.pop(packet.text))
+            return
+
+        station = self.stations.get(packet.dst)
+        if not station or station.current_mode(now) != mode_id:
+            return
+        station.heard(now)
+        if not packet.poll_final:
+            return
+
+        if packet.frame_type == ax25.FrameType.TEST:
+            control = ax25.Control(ax25.FrameType.TEST, poll_final=False)
+            reply = ax25.Frame(packet.src, station.call, control=control,
+                               data=packet.data)
+            self.transmit(mode_id, reply.pack(), self.deliver_to_client)
+        elif (packet.frame_type == ax25.FrameType.UI and
+              packet.text.startswith("RMODE ")):
+            requested = packet.text[6:]
+            if requested in LOSS:
+                station.mode_id = requested
+                station.mode_deadline = now + MODE_TIMEOUT
+
+    def data_received(self, kiss_port: int, command: int, data: bytes) -> None:
+        """A KISS frame from NetTerm"""
+
+        if command == transport.SET_HARDWARE and data:
+            mode_id = MODE_IDS.get(data[0] & 0x0F)
+            if mode_id and mode_id != self.hw_mode:
+                self.hw_mode = mode_id
+                self.mode_switches += 1
+            return
+        if command != transport.DATA_FRAME:
+            return
+        self.from_client += 1
+        self.transmit(self.hw_mode, data, self.deliver_to_station)
+
+    async def handle_client(self, reader, writer) -> None:
+        self.clients.append(writer)
+        decoder = transport.Decoder()
+        try:
+            while data := await reader.read(transport.READ_SIZE):
+                for kiss_port, command, frame in decoder.feed(data):
+                    self.data_received(kiss_port, command, frame)
+        finally:
+            self.clients.remove(writer)
+
+    def station_frame(self, station: Station, seq: int) -> tuple:
+        """Makes up a frame for a station to send, with the mode it goes in"""
+
+        mode_id = station.current_mode(time.monotonic())
+        if self.args.target and self.random.random() < self.args.probes:
+            # probe NetTerm, the reply tells us how long it took
+            nonce = f"SIMTEST {station.call} {seq}"
+            self.probes[nonce] = time.monotonic()
+            control = ax25.Control(ax25.FrameType.TEST, poll_final=True)
+            frame = ax25.Frame(self.args.target, station.call,
+                               control=control, data=nonce.encode())
+        else:
+            dst = self.random.choice(["APRS", "CQ", *self.stations])
+            control = ax25.Control(ax25.FrameType.UI, poll_final=False)
+            frame = ax25.Frame(dst, station.call, via=["WIDE1-1"],
+                               control=control, pid=UNPROTO_PID,
+                               data=f"simulated traffic {seq}".encode())
+        return mode_id, frame.pack()
+
+    async def generate(self) -> None:
+        """Makes up traffic from the stations at the requested rate"""
+
+        stations = list(self.stations.values())
+        interval = 1 / self.args.fps
+        deadline = time.monotonic()
+        seq = 0
+        while True:
+            station = self.random.choice(stations)
+            mode_id, data = self.station_frame(station, seq)
+            self.transmit(mode_id, data, self.deliver_to_client)
+            seq += 1
+            # absolute deadlines, so the rate doesn't drift
+            deadline += interval
+            await asyncio.sleep(max(0, deadline - time.monotonic()))
+
+    async def replay(self, path: str) -> None:
+        """Plays back the frames NetTerm received in a capture"""
+
+        interval = 1 / self.args.fps
+        deadline = time.monotonic()
+        replay = capture.Capture(path)
+        for record in replay.records():
+            if record.direction != capture.RX:
+                continue
+            mode_id = record.mode_id or DEFAULT_MODE
+            self.transmit(mode_id, record.data, self.deliver_to_client)
+            deadline += interval
+            await asyncio.sleep(max(0, deadline - time.monotonic()))
+        replay.close()
+
+    async def report(self) -> None:
+        """Prints the rates seen over each reporting interval"""
+
+        last_to, last_from = 0, 0
+        while True:
+            await asyncio.sleep(self.args.report)
+            # probes that haven't come back by now never will
+            stale = time.monotonic() - MODE_TIMEOUT
+            for nonce, sent in list(self.probes.items()):
+                if sent < stale:
+                    del self.probes[nonce]
+                    self.probes_lost += 1
+            rtts = sorted(self.rtts)
+            self.rtts.clear()
+            rtt = "-"
+            if rtts:
+                rtt = (f"{rtts[0] * 1000:.0f}/"
+                       f"{sum(rtts) / len(rtts) * 1000:.0f}/"
+                       f"{rtts[int(len(rtts) * 0.95)] * 1000:.0f}ms")
+            print(f"{self.hw_mode}: "
+                  f"{(self.to_client - last_to) / self.args.report:.1f} fps to NetTerm, "
+                  f"{(self.from_client - last_from) / self.args.report:.1f} fps from NetTerm, "
+                  f"{self.lost} lost, {self.mode_switches} mode switches, "
+                  f"TEST rtt min/avg/p95 {rtt}, "
+                  f"{self.probes_lost} probes unanswered", flush=True)
+            last_to, last_from = self.to_client, self.from_client
+
+    async def run(self) -> None:
+        server = await asyncio.start_server(self.handle_client,
+                                            self.args.host, self.args.port)
+        tasks = [asyncio.create_task(self.report())]
+        if self.args.replay:
+            tasks.append(asyncio.create_task(
+                self.replay(self.args.replay.removesuffix(".bin"))))
+        elif self.args.fps > 0:
+            tasks.append(asyncio.create_task(self.generate()))
+        async with server:
+            if self.args.duration:
+                await asyncio.sleep(self.args.duration)
+            else:
+                await server.serve_forever()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--replay", metavar="FILE",
+                        help="play back the received frames in a capture")
+    parser.add_argument("--stations", type=int, default=20,
+                        help="how many simulated stations there are")
+    parser.add_argument("--fps", type=float, default=1,
+                        help="frames per second to send to NetTerm, over "
+                             "about 2 oversaturates a 1200 baud channel")
+    parser.add_argument("--target", metavar="CALL", default="N2BP",
+                        help="NetTerm's callsign, for TEST probes")
+    parser.add_argument("--probes", type=float, default=0.1,
+                        help="fraction of generated frames that probe TARGET")
+    parser.add_argument("--loss", type=float,
+                        help="loss rate for every mode instead of the model")
+    parser.add_argument("--report", type=float, default=5,
+                        help="seconds between reports")
+    parser.add_argument("--duration", type=float,
+                        help="stop after this many seconds")
+    parser.add_argument("--seed", type=int)
+    asyncio.run(Simulator(parser.parse_args()).run())
+
+
+if __name__ == "__main__":
+    main()
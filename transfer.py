@@ -0,0 +1,465 @@
+import itertools
+import os
+import struct
+import time
+import zlib
+
+import ax25
+
+from modes import PACLEN, airtime
+from packet import Packet
+from txqueue import BULK, CONTROL
+
+UNPROTO_PID = 0xF0
+
+# a chunk is CHUNK_MAGIC then the transfer id, flags, how many times it has
+# been sent before, its sequence number and where its data goes in the file
+CHUNK_MAGIC = b"XD"
+CHUNK_HEADER = struct.Struct("!BBBII")
+CHUNK_OVERHEAD = len(CHUNK_MAGIC) + CHUNK_HEADER.size
+DEFLATED = 0x01  # the data is a raw deflate stream of its own
+LAST = 0x02      # the last chunk of the file
+
+SEND_AHEAD = 2.0     # most seconds of airtime queued ahead of the next chunk
+REPLY_MARGIN = 3.0   # seconds for the other station to answer a poll
+RETRIES = 5          # most polls in a row that go unanswered before we give up
+PROGRESS = 10.0      # seconds between throughput reports
+RAW_MAX = 8          # most times a chunk's size in file data compressed into it
+NAK_MAX = 32         # most missing chunks listed in one XNAK
+
+RECEIVE_MAX = 16 * 1024 * 1024  # biggest file we take
+RECEIVE_IDLE = 120.0            # seconds a transfer can go quiet before we drop it
+
+transfer_ids = itertools.count()
+
+
+def compress(data: bytes) -> bytes:
+    """data as a raw deflate stream, which can be inflated on its own"""
+
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+
+def rate(length: int, seconds: float) -> str:
+    return f"{length / seconds:.0f} B/s" if seconds > 0 else "- B/s"
+
+
+class Transfer():
+    """
+    Stack action that sends a file to another station in UI frames. Runs
+    until the other station has all of it, or stops answering.
+
+    The file is offered with "XFER id attempt size name", and once the other
+    station answers "XOK" it is read a chunk at a time as the TxQueue makes
+    room, so only what is about to go on air is in memory. Each chunk fills
+    a frame in the mode the other station is in and is compressed on its own
+    whenever that makes it smaller, so compressible files take less airtime
+    and any chunk can be sent again by itself. Chunks are numbered and the
+    last one polls; the answer is "XACK" or an "XNAK" listing the missing
+    ones, which are all that get sent again.
+
+    Every frame carries how many times it has been sent, and every answer
+    the attempt of the poll it answers, so Dedup never drops a resend and a
+    late answer is never taken for a new one.
+    """
+
+    frame_types = (ax25.FrameType.UI,)
+
+    def __init__(self, sink, net, our_call, call, path):
+        self.sink = sink
+        self.net = net
+        self.our_call = our_call
+        self.dst = our_call
+        self.call = call
+        self.path = path
+        self.name = os.path.basename(path)
+        self.id = next(transfer_ids) % 256
+        self.file = open(path, "rb")
+        self.size = os.fstat(self.file.fileno()).st_size
+
+        # (offset, length in the file) of every chunk sent so far, by seq,
+        # and how many times each has been sent
+        self.chunks = []
+        self.attempts = []
+        # where the next new chunk starts, and what it compresses down to
+        # compared with the file, from the chunks so far
+        self.offset = 0
+        self.ratio = 1.0
+        self.eof = False
+        # chunks to send again, and the poll we're waiting on an answer to
+        self.resend = []
+        self.polled = None
+        self.offered = 0
+        self.accepted = False
+        self.retries = 0
+        self.timer = None
+
+        self.bytes_sent = 0
+        self.frames_sent = 0
+        self.resent = 0
+        self.started = time.monotonic()
+        self.reported = self.started
+
+        self.offer()
+
+    @property
+    def mode_id(self) -> str:
+        return self.net.modes.mode_for(self.call)
+
+    def send(self, data: bytes, poll: bool, priority: int) -> None:
+        control = ax25.Control(ax25.FrameType.UI, poll_final=poll)
+        self.net.send(ax25.Frame(self.call, self.our_call, control=control,
+                                 pid=UNPROTO_PID, data=data), priority)
+
+    def offer(self) -> None:
+        self.offered += 1
+        self.send(f"XFER {self.id} {self.offered} {self.size} {self.name}"
+                  .encode('utf-8'), True, CONTROL)
+        self.polled = f"{self.offered}"
+        self.wait()
+
+    def wait(self) -> None:
+        """Gives the other station until its answer should be here"""
+
+        self.net.scheduler.cancel(self.timer)
+        frame_airtime = airtime(self.mode_id, PACLEN[self.mode_id])
+        timeout = (self.net.txqueue.drain_time() + 2 * frame_airtime +
+                   REPLY_MARGIN)
+        self.timer = self.net.scheduler.call_later(timeout, self.timed_out)
+
+    def timed_out(self) -> None:
+        self.timer = None
+        if self.net.txqueue.drain_time():
+            # the poll hasn't even gone out yet
+            self.wait()
+            return
+        self.retries += 1
+        if self.retries > RETRIES:
+            self.finish(f"no answer from {self.call}")
+            self.net.remove(self)
+            return
+        if not self.accepted:
+            self.offer()
+            return
+        # ask again with the last chunk we polled, it's as good as any
+        seq = int(self.polled.split('.')[0])
+        self.send_chunk(seq, True)
+        self.wait()
+
+    def next_chunk(self) -> tuple:
+        """
+        Works out where the next chunk of the file ends, returning its seq
+        and its compressed data
+        """
+
+        payload = PACLEN[self.mode_id] - CHUNK_OVERHEAD
+        # guess how much file will compress down to a full frame, then back
+        # off until it fits
+        length = max(payload, min(int(payload * self.ratio), payload * RAW_MAX))
+        self.file.seek(self.offset)
+        raw = self.file.read(length)
+        data = compress(raw)
+        while len(data) > payload and len(raw) > payload:
+            raw = raw[:max(payload, len(raw) * payload * 9 // (len(data) * 10))]
+            data = compress(raw)
+        if raw:
+            self.ratio = (self.ratio + len(raw) / min(len(data), len(raw))) / 2
+        seq = len(self.chunks)
+        self.chunks.append((self.offset, len(raw)))
+        self.attempts.append(0)
+        self.offset += len(raw)
+        self.eof = self.offset >= self.size
+        return seq, data
+
+    def send_chunk(self, seq: int, poll: bool, data: bytes | None = None) -> None:
+        offset, length = self.chunks[seq]
+        self.file.seek(offset)
+        raw = self.file.read(length)
+        if data is None:
+            data = compress(raw)
+        flags = 0
+        # a chunk sent again may be a bit bigger than the frames of a mode
+        # we've since moved to, but it has to cover the same part of the file
+        if len(data) < len(raw):
+            raw = data
+            flags |= DEFLATED
+        if seq == len(self.chunks) - 1 and self.eof:
+            flags |= LAST
+        attempt = self.attempts[seq]
+        if attempt:
+            self.resent += 1
+        self.attempts[seq] = attempt + 1
+        header = CHUNK_HEADER.pack(self.id, flags, attempt % 256, seq, offset)
+        self.send(CHUNK_MAGIC + header + raw, poll, BULK)
+        if poll:
+            self.polled = f"{seq}.{attempt % 256}"
+        self.bytes_sent += len(raw)
+        self.frames_sent += 1
+
+    def pump(self) -> None:
+        """Queues chunks until SEND_AHEAD seconds are waiting to go out"""
+
+        self.timer = None
+        while self.net.txqueue.drain_time() < SEND_AHEAD:
+            data = None
+            if self.resend:
+                seq = self.resend.pop(0)
+                poll = not self.resend
+            elif not self.eof:
+                seq, data = self.next_chunk()
+                poll = self.eof
+            else:
+                return
+            self.send_chunk(seq, poll, data)
+            if poll:
+                self.wait()
+                return
+        self.progress()
+        self.timer = self.net.scheduler.call_later(
+            self.net.txqueue.drain_time() - SEND_AHEAD / 2, self.pump)
+
+    def frame_received(self, packet: Packet) -> bool:
+        if packet.src != self.call or packet.data[:1] != b"X":
+            return True
+        words = packet.text.split()
+        if (len(words) < 3 or words[0] not in ("XOK", "XNO", "XACK", "XNAK") or
+                words[1] != str(self.id) or words[2] != self.polled):
+            # not ours, or an answer to a poll we've given up on
+            return True
+        self.net.scheduler.cancel(self.timer)
+        self.timer = None
+        self.retries = 0
+        reply = words[0]
+        if reply == "XOK" and not self.accepted:
+            self.accepted = True
+            self.sink.debug(f"{self} accepted")
+            self.pump()
+        elif reply == "XNO":
+            self.finish(f"refused, {' '.join(words[3:])}")
+            return False
+        elif reply == "XACK":
+            self.finish()
+            return False
+        elif reply == "XNAK" and len(words) > 3:
+            # the chunks they're missing, then everything from next on
+            missing = [int(seq) for seq in words[4].split(',')] if len(words) > 4 else []
+            next_seq = int(words[3])
+            # if that's nothing, poll with the last chunk again
+            self.resend = sorted(set(missing) |
+                                 set(range(next_seq, len(self.chunks)))) or [
+                                     len(self.chunks) - 1]
+            self.pump()
+        return True
+
+    def progress(self) -> None:
+        now = time.monotonic()
+        if now - self.reported >= PROGRESS:
+            self.reported = now
+            self.sink.debug(f"{self}")
+
+    def finish(self, failed: str | None = None) -> None:
+        self.net.scheduler.cancel(self.timer)
+        self.timer = None
+        self.file.close()
+        if failed:
+            self.sink.debug(f"{self} failed, {failed}")
+        else:
+            seconds = time.monotonic() - self.started
+            self.sink.debug(f"Sent {self.name} to {self.call}, {self.size} "
+                            f"bytes in {seconds:.1f}s, {rate(self.size, seconds)}, "
+                            f"{self.frames_sent} frame(s), {self.resent} resent")
+
+    def __str__(self) -> str:
+        seconds = time.monotonic() - self.started
+        done = min(self.offset, self.size)
+        compression = done / self.bytes_sent if self.bytes_sent else 1.0
+        return (f"Transfer({self.name} to {self.call}, {done}/{self.size} "
+                f"bytes, {rate(done, seconds)}, {compression:.1f}x "
+                f"compression, {self.resent} resent)")
+
+
+class Incoming():
+    """
+    A file being received, written to a .part file as chunks arrive. The
+    .part file is named for the sender and transfer id, so two stations
+    sending files with the same name never write to the same one.
+    """
+
+    def __init__(self, directory: str, call: str, transfer_id: int,
+                 name: str, size: int):
+        self.path = os.path.join(directory, name)
+        self.part = os.path.join(directory, f".{call}-{transfer_id}.part")
+        self.name = name
+        self.size = size
+        self.file = open(self.part, "wb")
+        self.received = set()
+        # seq of the LAST chunk, once we've had it
+        self.last = None
+        self.length = 0
+        self.started = time.monotonic()
+        self.heard = self.started
+        self.timer = None
+
+    def missing(self) -> tuple:
+        """
+        (next, missing), next being the first chunk past everything we've
+        had and missing the chunks before it we haven't
+        """
+
+        if self.last is not None:
+            next_seq = self.last + 1
+        else:
+            next_seq = max(self.received, default=-1) + 1
+        missing = [seq for seq in range(next_seq) if seq not in self.received]
+        return next_seq, missing
+
+    def complete(self) -> bool:
+        return self.last is not None and len(self.received) == self.last + 1
+
+
+class TransferReceive():
+    """
+    Stack action that takes the files other stations send with Transfer and
+    writes them to directory. Runs forever.
+    """
+
+    frame_types = (ax25.FrameType.UI,)
+
+    def __init__(self, sink, net, our_call, directory):
+        self.sink = sink
+        self.net = net
+        self.our_call = our_call
+        self.dst = our_call
+        self.directory = directory
+        # (call, id) -> Incoming, and the ones we've finished, in case our
+        # XACK is lost and they ask again
+        self.incoming = {}
+        self.finished = {}
+
+    def reply(self, call: str, text: str) -> None:
+        control = ax25.Control(ax25.FrameType.UI, poll_final=False)
+        self.net.send(ax25.Frame(call, self.our_call, control=control,
+                                 pid=UNPROTO_PID, data=text.encode('utf-8')),
+                      CONTROL)
+
+    def frame_received(self, packet: Packet) -> bool:
+        data = packet.data
+        if data[:2] == CHUNK_MAGIC:
+            self.chunk(packet, data)
+        elif data[:5] == b"XFER ":
+            self.offered(packet)
+        return True
+
+    def offered(self, packet: Packet) -> None:
+        words = packet.text.split(' ', 4)
+        if len(words) < 5 or not all(word.isdigit() for word in words[1:4]):
+            return
+        transfer_id, attempt, size = (int(word) for word in words[1:4])
+        key = (packet.src, transfer_id)
+        name = os.path.basename(words[4].strip())
+        if size > RECEIVE_MAX:
+            self.reply(packet.src, f"XNO {transfer_id} {attempt} too big")
+            return
+        if not name or name.startswith('.'):
+            self.reply(packet.src, f"XNO {transfer_id} {attempt} bad name")
+            return
+        incoming = self.incoming.get(key)
+        if incoming is None or incoming.name != name or incoming.size != size:
+            if incoming:
+                self.drop(key)
+            os.makedirs(self.directory, exist_ok=True)
+            incoming = self.incoming[key] = Incoming(
+                self.directory, packet.src, transfer_id, name, size)
+            self.sink.debug(f"Receiving {name} ({size} bytes) from {packet.src}")
+            self.idle(key)
+        self.finished.pop(key, None)
+        self.reply(packet.src, f"XOK {transfer_id} {attempt}")
+
+    def chunk(self, packet: Packet, data: bytes) -> None:
+        if len(data) < CHUNK_OVERHEAD:
+            return
+        transfer_id, flags, attempt, seq, offset = CHUNK_HEADER.unpack_from(
+            data, len(CHUNK_MAGIC))
+        key = (packet.src, transfer_id)
+        tag = f"{transfer_id} {seq}.{attempt}"
+        incoming = self.incoming.get(key)
+        if incoming is None:
+            if packet.poll_final:
+                if key in self.finished:
+                    self.reply(packet.src, f"XACK {tag}")
+                else:
+                    self.reply(packet.src, f"XNO {tag} unknown transfer")
+            return
+        incoming.heard = time.monotonic()
+        if seq not in incoming.received:
+            body = data[CHUNK_OVERHEAD:]
+            try:
+                if flags & DEFLATED:
+                    body = zlib.decompress(body, -15)
+            except zlib.error:
+                # garbled, so as good as lost
+                body = None
+            if body is not None and offset + len(body) <= incoming.size:
+                incoming.file.seek(offset)
+                incoming.file.write(body)
+                incoming.received.add(seq)
+                incoming.length += len(body)
+                if flags & LAST:
+                    incoming.last = seq
+        if not packet.poll_final:
+            return
+        if incoming.complete():
+            self.reply(packet.src, f"XACK {tag}")
+            self.done(key)
+            return
+        next_seq, missing = incoming.missing()
+        nak = f"XNAK {tag} {next_seq}"
+        if missing:
+            nak += " " + ",".join(str(seq) for seq in missing[:NAK_MAX])
+        self.reply(packet.src, nak)
+
+    def done(self, key: tuple) -> None:
+        incoming = self.incoming.pop(key)
+        self.net.scheduler.cancel(incoming.timer)
+        incoming.file.truncate(incoming.size)
+        incoming.file.close()
+        # never overwrite anything
+        path = incoming.path
+        root, ext = os.path.splitext(path)
+        for n in itertools.count(1):
+            if not os.path.exists(path):
+                break
+            path = f"{root}-{n}{ext}"
+        os.replace(incoming.part, path)
+        seconds = time.monotonic() - incoming.started
+        self.sink.debug(f"Received {incoming.name} from {key[0]}, "
+                        f"{incoming.size} bytes in {seconds:.1f}s, "
+                        f"{rate(incoming.size, seconds)}, saved to {path}")
+        self.finished[key] = time.monotonic() + RECEIVE_IDLE
+        now = time.monotonic()
+        self.finished = {key: until for key, until in self.finished.items()
+                         if until > now}
+
+    def idle(self, key: tuple) -> None:
+        """Drops a transfer that has gone quiet for RECEIVE_IDLE seconds"""
+
+        incoming = self.incoming.get(key)
+        if incoming is None:
+            return
+        quiet = time.monotonic() - incoming.heard
+        if quiet < RECEIVE_IDLE:
+            incoming.timer = self.net.scheduler.call_later(
+                RECEIVE_IDLE - quiet, lambda: self.idle(key))
+            return
+        self.sink.debug(f"Gave up receiving {incoming.name} from {key[0]}, "
+                        f"{incoming.length}/{incoming.size} bytes")
+        self.drop(key)
+
+    def drop(self, key: tuple) -> None:
+        incoming = self.incoming.pop(key)
+        self.net.scheduler.cancel(incoming.timer)
+        incoming.file.close()
+        os.remove(incoming.part)
+
+    def __str__(self) -> str:
+        return f"TransferReceive({len(self.incoming)} incoming)"
@@ -0,0 +1,169 @@
+import asyncio
+
+# KISS special characters
+# http://www.ka9q.net/papers/kiss.html
+FEND = b'\xC0'
+FESC = b'\xDB'
+TFEND = b'\xDC'
+TFESC = b'\xDD'
+
+# KISS commands we use
+DATA_FRAME = 0x00
+SET_HARDWARE = 0x06
+
+READ_SIZE = 4096
+
+
+def encode(command: int, data: bytes, port: int = 0) -> bytes:
+    """Escapes data and wraps it in a KISS frame"""
+
+    # replace() always makes a copy, so check first
+    if FESC in data:
+        data = data.replace(FESC, FESC + TFESC)
+    if FEND in data:
+        data = data.replace(FEND, FESC + TFEND)
+    return FEND + bytes([(port << 4) | command]) + data + FEND
+
+
+def decode(data: bytes) -> bytes:
+    """Reverses the escaping done by encode()"""
+
+    if FESC not in data:
+        return data
+    return data.replace(FESC + TFEND, FEND).replace(FESC + TFESC, FESC)
+
+
+class Decoder():
+    """
+    Splits a KISS byte stream into frames. Bytes are collected in a single
+    bytearray that is reused between reads, so a partial frame at the end of
+    one read is simply completed by the next.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data: bytes) -> list:
+        """
+        Adds data from the stream and returns a list of (port, command, data)
+        tuples for every complete frame it finished
+        """
+
+        buffer = self.buffer
+        start = len(buffer)
+        buffer += data
+        end = buffer.rfind(FEND, start)
+        if end < 0:
+            return []
+
+        frames = []
+        for raw in bytes(buffer[:end]).split(FEND):
+            # back to back FENDs are fill, not empty frames
+            if raw:
+                frames.append((raw[0] >> 4, raw[0] & 0x0F, decode(raw[1:])))
+        # NOTE: Deleting from the front of a bytearray doesn't copy what's left
+        del buffer[:end + 1]
+        return frames
+
+
+class KISSTransport():
+    """
+    A KISS connection to a TNC that runs on the asyncio event loop.
+    data_received(kiss_port, data) is called on the loop for every data frame
+    the TNC sends us, all of the frames in a read are handled in one wakeup.
+    It can be connected again once the TNC has gone away.
+    """
+
+    def __init__(self, data_received):
+        self.data_received = data_received
+        self.decoder = Decoder()
+        self.reader = None
+        self.writer = None
+        self.serial = None
+        # True from connecting until the TNC goes away, nothing should be
+        # written while it's False
+        self.connected = False
+
+    async def connect_to_server(self, host: str, port: int) -> None:
+        """Connects to a TNC over TCP"""
+
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.write = self.writer.write
+        self.decoder = Decoder()
+        self.connected = True
+
+    async def connect_to_serial(self, device: str, baudrate: int = 57600) -> None:
+        """
+        Connects to a TNC on a serial port. pyserial blocks, so reads are done
+        in the default executor and handed back to the loop.
+        """
+
+        import serial
+
+        loop = asyncio.get_running_loop()
+        port = await loop.run_in_executor(
+            None, lambda: serial.Serial(device, baudrate, timeout=None))
+
+        def read() -> bytes:
+            # block for the first byte, then take whatever else arrived
+            data = port.read(1)
+            waiting = port.in_waiting
+            if waiting:
+                data += port.read(waiting)
+            return data
+
+        self.reader = SerialReader(loop, read)
+        self.write = port.write
+        self.serial = port
+        self.decoder = Decoder()
+        self.connected = True
+
+    async def receive(self) -> None:
+        """Reads from the TNC until the connection is closed"""
+
+        try:
+            while True:
+                data = await self.reader.read(READ_SIZE)
+                if not data:
+                    return
+                for kiss_port, command, frame in self.decoder.feed(data):
+                    # per the KISS spec the TNC only ever sends us data frames
+                    if command == DATA_FRAME:
+                        self.data_received(kiss_port, frame)
+        finally:
+            self.close()
+
+    def send_data(self, data: bytes, port: int = 0) -> None:
+        """Sends data in a KISS data frame"""
+
+        self.write(encode(DATA_FRAME, data, port))
+
+    def send_many(self, frames: list) -> None:
+        """Sends already encoded KISS frames in a single write"""
+
+        self.write(b"".join(frames))
+
+    def set_hardware(self, hardware: bytes, port: int = 0) -> None:
+        """Sends a TNC specific SETHW command"""
+
+        self.write(encode(SET_HARDWARE, hardware, port))
+
+    def close(self) -> None:
+        self.connected = False
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+        if self.serial:
+            self.serial.close()
+            self.serial = None
+
+
+class SerialReader():
+    """Looks enough like an asyncio.StreamReader for KISSTransport"""
+
+    def __init__(self, loop, read):
+        self.loop = loop
+        self._read = read
+
+    async def read(self, size: int) -> bytes:
+        return await self.loop.run_in_executor(None, self._read)
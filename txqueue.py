@@ -0,0 +1,242 @@
+import asyncio
+import time
+from collections import deque
+
+import ax25
+
+import capture
+import transport
+from modes import airtime
+from packet import Packet
+
+# priorities, lowest goes first
+CONTROL = 0      # acknowledgements, TEST, RMODE and the like
+INTERACTIVE = 1  # unconnected UI traffic
+BULK = 2         # connected data
+PRIORITIES = (CONTROL, INTERACTIVE, BULK)
+
+TNC_AHEAD = 1.0  # most seconds of airtime handed to the TNC before it's sent
+SETHW_SETTLE = 0.1  # seconds we assume the modem is off air after SETHW
+MODE_DWELL = 10.0   # most seconds of airtime in one mode while others wait
+AWAY_MAX = 200      # most frames kept while the TNC is away, see drop()
+
+
+def priority_for(packet: Packet) -> int:
+    """The priority a frame goes out at if the sender doesn't say"""
+
+    if packet.frame_type == ax25.FrameType.I:
+        return BULK
+    if packet.frame_type == ax25.FrameType.UI and not packet.poll_final:
+        return INTERACTIVE
+    return CONTROL
+
+
+class Group():
+    """Frames queued for one mode, one deque per priority"""
+
+    __slots__ = ('mode_id', 'queues')
+
+    def __init__(self, mode_id: str):
+        self.mode_id = mode_id
+        self.queues = tuple(deque() for _ in PRIORITIES)
+
+    def pop(self) -> tuple | None:
+        for queue in self.queues:
+            if queue:
+                return queue.popleft()
+        return None
+
+    def priority(self) -> int:
+        """The priority of the most urgent frame waiting"""
+
+        for priority, queue in zip(PRIORITIES, self.queues):
+            if queue:
+                return priority
+        return len(PRIORITIES)
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self.queues)
+
+
+class TxQueue():
+    """
+    Sits between Net.send and the TNC. Frames wait here until the TNC can
+    take them, control frames ahead of unconnected traffic ahead of bulk
+    data.
+
+    We keep track of how much airtime we've already handed the TNC and stop
+    once that is more than TNC_AHEAD seconds, so its buffer never overflows
+    and a control frame never sits behind a long run of data. Everything
+    sent in one go is written to the TNC as one batch of KISS frames.
+
+    Every frame is queued for the mode its destination is listening in (see
+    ModeManager), and frames are grouped by mode. Everything waiting for the
+    mode the TNC is in goes first, then the TNC switches once for each of
+    the other groups, most urgent first, and finally goes back to the
+    listening mode. So a queue full of frames for 9600 and 1200 stations
+    costs two SETHWs, however they were interleaved. To keep one busy mode
+    from starving the others we move on after MODE_DWELL seconds of airtime
+    if anything else is waiting.
+
+    While the TNC is away frames wait here until it's back, but no more than
+    AWAY_MAX of them.
+    """
+
+    def __init__(self, net, connection, modes):
+        self.net = net
+        self.connection = connection
+        self.modes = modes
+        # mode_id -> Group, in the order they were first needed
+        self.groups = {}
+        # monotonic time the TNC should be done with what we've given it
+        self.busy_until = 0.0
+        self.queued_airtime = 0.0
+        # airtime spent in the current mode since we last switched
+        self.dwell = 0.0
+        self.timer = None
+        self.scheduled = False
+
+        self.frames_sent = 0
+        self.writes = 0
+        self.dropped = 0
+
+    def send(self, packet: Packet, priority: int | None = None) -> None:
+        if priority is None:
+            priority = priority_for(packet)
+        data = packet.pack()
+        mode_id = self.modes.mode_for(packet.dst)
+        group = self.groups.get(mode_id)
+        if group is None:
+            group = self.groups[mode_id] = Group(mode_id)
+        group.queues[priority].append((packet, data))
+        self.queued_airtime += airtime(mode_id, len(data))
+        if not self.connection.connected and self.depth > AWAY_MAX:
+            self.drop()
+        self.schedule()
+
+    def drop(self) -> None:
+        """
+        Drops the oldest of the least urgent frames. Connections send
+        theirs again, so it's the bulk data that goes first.
+        """
+
+        for priority in reversed(PRIORITIES):
+            for group in self.groups.values():
+                if group.queues[priority]:
+                    packet, data = group.queues[priority].popleft()
+                    self.queued_airtime -= airtime(group.mode_id, len(data))
+                    if not group:
+                        del self.groups[group.mode_id]
+                    self.dropped += 1
+                    return
+
+    def set_mode(self, mode_id: str) -> None:
+        """Makes mode_id the mode the TNC sits in when there's nothing to send"""
+
+        self.modes.listen_in(mode_id)
+        self.schedule()
+
+    def schedule(self) -> None:
+        # on the next pass of the loop, so frames sent together go together
+        if not self.scheduled and self.timer is None:
+            self.scheduled = True
+            asyncio.get_running_loop().call_soon(self.drain)
+
+    def next_group(self) -> Group | None:
+        """The group to send from next, switching modes only if we must"""
+
+        current = self.groups.get(self.modes.mode_id)
+        others = [group for group in self.groups.values()
+                  if group is not current]
+        if current and (not others or self.dwell < MODE_DWELL):
+            return current
+        if not others:
+            return None
+        # min() keeps the first of equals, so the oldest group wins ties
+        return min(others, key=Group.priority)
+
+    def drain(self) -> None:
+        """Hands the TNC as much as it can take in one write"""
+
+        self.scheduled = False
+        self.timer = None
+        if not self.connection.connected:
+            # it all waits for the TNC, which schedules us when it's back
+            return
+        now = time.monotonic()
+        self.busy_until = max(self.busy_until, now)
+        batch = []
+        while True:
+            if self.busy_until - now > TNC_AHEAD:
+                # come back once the TNC has worked through some of it
+                self.timer = self.net.scheduler.call_at(
+                    self.busy_until - TNC_AHEAD, self.drain)
+                break
+            group = self.next_group()
+            if group is None:
+                # nothing left, go back to listening
+                if self.modes.mode_id != self.modes.listen:
+                    batch.append(self.modes.switch(self.modes.listen))
+                    self.busy_until += SETHW_SETTLE
+                    self.dwell = 0.0
+                break
+            if group.mode_id != self.modes.mode_id:
+                batch.append(self.modes.switch(group.mode_id))
+                self.busy_until += SETHW_SETTLE
+                self.dwell = 0.0
+            packet, data = group.pop()
+            frame_airtime = airtime(group.mode_id, len(data))
+            self.queued_airtime -= frame_airtime
+            if not group:
+                del self.groups[group.mode_id]
+                if not self.groups:
+                    # don't let rounding leave airtime behind for nothing
+                    self.queued_airtime = 0.0
+            self.busy_until += frame_airtime
+            self.dwell += frame_airtime
+            self.modes.sent(packet.dst, group.mode_id)
+            self.net.channel.frame(packet, group.mode_id, len(data))
+            offset = self.net.capture.write(capture.TX, self.net.port,
+                                            group.mode_id, data, packet.src,
+                                            packet.dst)
+            self.net.search.add(packet, offset, time.time())
+            batch.append(transport.encode(transport.DATA_FRAME, data))
+            self.frames_sent += 1
+        if batch:
+            self.writes += 1
+            self.connection.send_many(batch)
+
+    @property
+    def depth(self) -> int:
+        """Frames waiting to be handed to the TNC"""
+        return sum(len(group) for group in self.groups.values())
+
+    def depths(self) -> tuple:
+        """Frames waiting at each priority"""
+        return tuple(sum(len(group.queues[priority])
+                         for group in self.groups.values())
+                     for priority in PRIORITIES)
+
+    def drain_time(self) -> float:
+        """
+        Seconds until everything queued here and in the TNC should be on
+        air, what a new frame can expect to wait
+        """
+
+        return (max(0.0, self.busy_until - time.monotonic()) +
+                max(0.0, self.queued_airtime))
+
+    def clear(self) -> None:
+        self.net.scheduler.cancel(self.timer)
+        self.timer = None
+        self.groups.clear()
+        self.queued_airtime = 0.0
+
+    def __str__(self) -> str:
+        control, interactive, bulk = self.depths()
+        coalesced = self.frames_sent / self.writes if self.writes else 0
+        return (f"TxQueue({control}/{interactive}/{bulk} queued in "
+                f"{len(self.groups)} mode(s), {self.drain_time():.1f}s to "
+                f"drain, {self.frames_sent} sent in {self.writes} writes "
+                f"({coalesced:.1f} per write), {self.dropped} dropped while "
+                f"the TNC was away)")
@@ -1,42 +1,150 @@
-from datetime import datetime
+import time
+from collections import deque
 
-from textual.widgets import ContentSwitcher, ListView, ListItem, RichLog, Label
-from textual.await_complete import AwaitComplete
-from textual.css.query import NoMatches
+from textual.app import ComposeResult
+from textual.widget import AwaitMount, Widget
+from textual.widgets import ListView, ListItem, RichLog, Label
 
+STORE_SIZE = 20000   # lines kept, shared by every view
+RENDER_LINES = 2000  # lines rendered when switching to a view
 
-class View(ContentSwitcher):
-    """The main view"""
+
+class Store():
+    """
+    A capped ring buffer of (time, msg) lines shared by every view. Each line
+    gets a sequence number that views use to refer to it. Once the buffer is
+    full the oldest line is overwritten and its sequence number expires.
+    """
+
+    def __init__(self, size: int = STORE_SIZE):
+        self.size = size
+        self.lines = [None] * size
+        self.next_seq = 0
+
+    @property
+    def first_seq(self) -> int:
+        """The oldest sequence number still in the store"""
+        return max(0, self.next_seq - self.size)
+
+    def append(self, line: tuple) -> int:
+        seq = self.next_seq
+        self.lines[seq % self.size] = line
+        self.next_seq += 1
+        return seq
+
+    def __getitem__(self, seq: int) -> tuple:
+        return self.lines[seq % self.size]
+
+
+class ViewIndex():
+    """The sequence numbers of the lines in the Store that belong to a view"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.seqs = deque()
+
+    def append(self, seq: int, first_seq: int) -> None:
+        seqs = self.seqs
+        # forget lines the store has already overwritten
+        while seqs and seqs[0] < first_seq:
+            seqs.popleft()
+        seqs.append(seq)
+
+
+class View(Widget):
+    """
+    The main view. Every line is stored once in a shared Store and each view
+    is just an index into it. Only the view being looked at is rendered, in
+    a single RichLog: writes to the others only append a sequence number, and
+    switching to a view renders its most recent lines.
+    """
+
+    def __init__(self):
+        self.store = Store()
+        self.views = {}
+        self.current = None
+        # view_id -> lines, for views like the dashboard that are redrawn
+        # rather than appended to
+        self.live = {}
+        self.rich_log = RichLog(markup=True, wrap=True, max_lines=RENDER_LINES)
+
+        # formatting the time is the slow part, so cache it per second
+        self.last_second = None
+        self.last_time = ""
+
+        super().__init__()
+
+    def compose(self) -> ComposeResult:
+        yield self.rich_log
+
+    def format_time(self, t: float) -> str:
+        second = int(t)
+        if second != self.last_second:
+            self.last_second = second
+            self.last_time = time.strftime("%Y-%m-%d %H:%M:%S",
+                                           time.localtime(second))
+        return self.last_time
+
+    def show_line(self, line: tuple) -> None:
+        t, msg = line
+        self.rich_log.write(f"[green]{self.format_time(t)}[/] {msg}")
 
     def switch(self, view_id):
         """Switch to a different view based on the view_id"""
 
-        self.border_title = self.query_one(f"#{view_id}").name
+        view = self.views[view_id]
+        self.border_title = view.name
         self.current = view_id
 
-    def append(self, view_id: str, view_name: str) -> AwaitComplete:
-        new_view = RichLog(markup=True, wrap=True, id=view_id, name=view_name)
-        return self.add_content(new_view)
+        self.rich_log.clear()
+        if view_id in self.live:
+            for line in self.live[view_id]:
+                self.rich_log.write(line)
+            return
+        first_seq = self.store.first_seq
+        for seq in list(view.seqs)[-RENDER_LINES:]:
+            if seq >= first_seq:
+                self.show_line(self.store[seq])
+
+    def append(self, view_id: str, view_name: str) -> None:
+        self.views[view_id] = ViewIndex(view_name)
 
-    def write(self, view_id: str, msg: str) -> None:
-        time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        msg = f"[green]{time}[/] {msg}"
-        self.query_one(f"#{view_id}").write(msg)
+    def show(self, view_id: str, lines: list) -> None:
+        """
+        Replaces everything a live view shows. Its lines never go in the
+        Store, so redrawing it often doesn't push out anyone else's.
+        """
+
+        self.live[view_id] = lines
+        if view_id == self.current:
+            self.rich_log.clear()
+            for line in lines:
+                self.rich_log.write(line)
+
+    def write(self, view_id: str, msg: str, t: float | None = None) -> None:
+        self.write_many((view_id,), msg, t)
+
+    def write_many(self, view_ids, msg: str, t: float | None = None) -> None:
+        """Stores msg once and adds it to every view in view_ids"""
+
+        line = (t or time.time(), msg)
+        seq = self.store.append(line)
+        first_seq = self.store.first_seq
+        for view_id in view_ids:
+            self.views[view_id].append(seq, first_seq)
+            if view_id == self.current:
+                self.show_line(line)
 
     def exists(self, view_id: str) -> bool:
         """Returns true if a view exists"""
-        try:
-            self.query_one(f"#{view_id}")
-        except NoMatches:
-            return False
-        return True
-    
+        return view_id in self.views
+
 class ViewList(ListView):
     """A listing of views available"""
 
     BORDER_TITLE = "Views"
 
-    def append(self, view_id: str, name: str | None = None) -> None:
+    def append(self, view_id: str, name: str | None = None) -> AwaitMount:
         if not name:
             name = view_id
-        super().append(ListItem(Label(name), id=view_id))
+        return super().append(ListItem(Label(name), id=view_id))